@@ -0,0 +1,45 @@
+"""
+.. py:module:: benchmarks
+   :synopsis: Benchmarks of parsing and loading the repositories.
+
+Run the benchmarks from the root of the source tree, with ``src`` on the
+path, e.g.::
+
+    PYTHONPATH=src python3 -m benchmarks.load --scale 100000
+
+.. moduleauthor:: Florian Leitner <florian.leitner@gmail.com>
+.. License: GNU GPL v3 (http://www.gnu.org/licenses/gpl.html)
+"""
+import os
+import platform
+import subprocess
+
+from datetime import datetime
+
+import gnamed
+
+
+def Environment(**settings) -> dict:
+    """
+    Describe the environment benchmark results were measured in (the code
+    revision, the Python version, the machine, ...), plus any `settings`
+    of the benchmark, so results can be compared across runs.
+    """
+    try:
+        revision = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True,
+            universal_newlines=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+
+    environment = {
+        'date': datetime.utcnow().isoformat() + 'Z',
+        'gnamed': gnamed.__version__, 'revision': revision,
+        'python': platform.python_version(), 'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+    environment.update(settings)
+    return environment
@@ -0,0 +1,457 @@
+"""
+.. py:module:: benchmarks.load
+   :synopsis: End-to-end benchmarks of the loading paths.
+
+Loads the synthetic repository files (see `benchmarks.synthetic`) into a
+fresh DB along each of the loading `PATHS`, on SQLite and (if a URL is
+given) on PostgreSQL, and reports each stage's throughput (records/sec),
+its peak memory use (maximum resident set size) and the time spent in DB
+calls. Each stage runs in a fresh interpreter process, so the peak RSS is
+that of the stage alone and no stage profits from the caches (e.g., the
+string IDs) of an earlier one.
+
+The DB time is measured at the DBAPI cursor (incl. ``COPY``), i.e., it
+covers the time of the DB and of the driver, and it is summed over all
+threads (e.g., of the `gnamed.orm.IndexManager`).
+
+To make results comparable across runs, the input files only depend on the
+scale and the seed, every path starts from an empty DB, and with
+``--repeat N``, the fastest of N runs of each stage is reported (the noise
+of a benchmark only ever slows it down). The results and the environment
+they were measured in can be written to a JSON file (``--output``) and
+compared against earlier results (``--compare``)::
+
+    PYTHONPATH=src python3 -m benchmarks.load --scale 100000 -o base.json
+    # ... change the code ...
+    PYTHONPATH=src python3 -m benchmarks.load --scale 100000 -c base.json
+
+To include PostgreSQL, give the URL of a DB to use with ``--postgresql``;
+that DB is **dropped** and re-created for each path (the user needs the
+``CREATEDB`` privilege), e.g.::
+
+    PYTHONPATH=src python3 -m benchmarks.load \\
+        --postgresql postgresql://gnamed@localhost/gnamed_benchmark
+
+.. moduleauthor:: Florian Leitner <florian.leitner@gmail.com>
+.. License: GNU GPL v3 (http://www.gnu.org/licenses/gpl.html)
+"""
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sqlite3
+import sys
+import threading
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import engine
+
+from benchmarks import Environment, synthetic
+from gnamed.constants import LOAD_ORDER
+from gnamed.orm import InitDb, CloseDb, RelaxDurability, RefreshClosure
+from gnamed.parsed import CachePath, Checksum, RecordWriter
+from gnamed.parsers import taxa
+from gnamed.unify import Unify
+
+PATHS = {
+    'parser': "load each repository with its Parser",
+    'speed': "load Entrez and UniProt with their SpeedLoader",
+    'bulk': "load each repository with its Parser in --bulk mode",
+    'parsed': "parse into record caches, then load from the caches",
+    'unify': "parse into record caches, then unify the caches",
+}
+"""The loading paths and their description."""
+
+_FAST = frozenset({'entrez', 'uniprot'})  # modules with a SpeedLoader
+
+# the DB time of the current (stage) process
+_db_seconds = 0.0
+_db_lock = threading.Lock()
+
+
+class _File:
+    # an input file the parsers open without a (terminal) progress bar
+
+    def __init__(self, path: str):
+        self.name = path
+
+    def open(self, encoding: str):
+        return open(self.name, encoding=encoding)
+
+
+def _timed(method):
+    # wrap a DBAPI cursor method to add its run time to the DB time
+    def call(*args, **kwds):
+        global _db_seconds
+        start = time.perf_counter()
+
+        try:
+            return method(*args, **kwds)
+        finally:
+            elapsed = time.perf_counter() - start
+
+            with _db_lock:
+                _db_seconds += elapsed
+
+    return call
+
+
+class _SqliteCursor(sqlite3.Cursor):
+    execute = _timed(sqlite3.Cursor.execute)
+    executemany = _timed(sqlite3.Cursor.executemany)
+    fetchone = _timed(sqlite3.Cursor.fetchone)
+    fetchmany = _timed(sqlite3.Cursor.fetchmany)
+    fetchall = _timed(sqlite3.Cursor.fetchall)
+
+
+class _SqliteConnection(sqlite3.Connection):
+
+    def cursor(self, factory=_SqliteCursor):
+        return super(_SqliteConnection, self).cursor(factory)
+
+
+def _connectArgs(url: str) -> dict:
+    # the DBAPI connection arguments that time all cursor calls
+    backend = engine.url.make_url(url).get_backend_name()
+
+    if backend == 'sqlite':
+        return {'factory': _SqliteConnection}
+    elif backend == 'postgresql':
+        from psycopg2.extensions import cursor
+
+        class _PgCursor(cursor):
+            execute = _timed(cursor.execute)
+            executemany = _timed(cursor.executemany)
+            copy_from = _timed(cursor.copy_from)
+            copy_expert = _timed(cursor.copy_expert)
+            fetchone = _timed(cursor.fetchone)
+            fetchmany = _timed(cursor.fetchmany)
+            fetchall = _timed(cursor.fetchall)
+
+        return {'cursor_factory': _PgCursor}
+
+    raise ValueError('no DB time for {} DBs'.format(backend))
+
+
+def _peakRss() -> float:
+    # the maximum resident set size of this process (in MiB)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    if sys.platform == 'darwin':
+        return rss / 1024 / 1024  # bytes
+
+    return rss / 1024  # KiB
+
+
+def _initWorker(url: str, loglevel: int):
+    logging.basicConfig(level=loglevel,
+                        format='%(asctime)s %(name)s %(levelname)s: '
+                               '%(message)s')
+    InitDb(url, connect_args=_connectArgs(url))
+    RelaxDurability()
+
+
+def _runStage(function, *args) -> dict:
+    # runs in the stage's own process
+    start = time.perf_counter()
+    function(*args)
+    seconds = time.perf_counter() - start
+    RelaxDurability(False)
+    CloseDb()
+    return {'seconds': seconds, 'db_seconds': _db_seconds,
+            'peak_rss': _peakRss()}
+
+
+def _loader(repo_key: str, name: str):
+    return getattr(__import__('gnamed.parsers.' + repo_key, globals(),
+                              fromlist=[name]), name)
+
+
+def _init(files: list):
+    if not taxa.Parser(*(_File(f) for f in files)).parse():
+        raise RuntimeError('failed to load the NCBI Taxonomy')
+
+
+def _load(repo_key: str, files: list, fast: bool=False, bulk: bool=False):
+    loader = _loader(repo_key, 'SpeedLoader' if fast else 'Parser')(
+        *(_File(f) for f in files)
+    )
+    loader.closure = False
+    loader.bulk = bulk
+
+    if not loader.parse():
+        raise RuntimeError('failed to load {}'.format(repo_key))
+
+
+def _parse(repo_key: str, files: list, directory: str):
+    os.makedirs(directory, exist_ok=True)
+    checksum = Checksum(*files)
+    parser = _loader(repo_key, 'Parser')(*(_File(f) for f in files))
+    parser.closure = False
+
+    with RecordWriter(CachePath(directory, repo_key, checksum),
+                      checksum) as parser.cache:
+        if not parser.parse():
+            raise RuntimeError('failed to parse {}'.format(repo_key))
+
+
+def _loadParsed(repo_key: str, files: list, directory: str):
+    loader = _loader(repo_key, 'Parser')()
+    loader.parsed = [CachePath(directory, repo_key, Checksum(*files))]
+    loader.closure = False
+
+    if not loader.parse():
+        raise RuntimeError('failed to load {}'.format(repo_key))
+
+
+def _unify(caches: list):
+    Unify(*caches, closure=False)
+
+
+def _stages(path: str, data: dict, directory: str) -> list:
+    # the (name, records, function, args) of each stage of a path
+    keys = [key for key in LOAD_ORDER if key in data]
+    stages = [('taxa', data['taxa']['records'], _init,
+               (data['taxa']['files'],))]
+
+    if path in ('parsed', 'unify'):
+        for key in keys:
+            stages.append(('parse:' + key, data[key]['records'], _parse,
+                           (key, data[key]['files'], directory)))
+
+    if path == 'unify':
+        stages.append(('unify', sum(data[key]['records'] for key in keys),
+                       _unify, ([CachePath(directory, key,
+                                           Checksum(*data[key]['files']))
+                                 for key in keys],)))
+    else:
+        for key in keys:
+            if path == 'parsed':
+                function, args = _loadParsed, (key, data[key]['files'],
+                                               directory)
+            else:
+                function, args = _load, (key, data[key]['files'],
+                                         path == 'speed' and key in _FAST,
+                                         path == 'bulk')
+
+            stages.append(('load:' + key, data[key]['records'], function,
+                           args))
+
+    stages.append(('closure', data['entrez']['records'] +
+                   data['uniprot']['records'], RefreshClosure, ()))
+    return stages
+
+
+def _recreate(url: str) -> str:
+    # create an empty DB for a path and return its description
+    url = engine.url.make_url(url)
+
+    if url.get_backend_name() == 'sqlite':
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(url.database + suffix):
+                os.remove(url.database + suffix)
+
+        return 'SQLite {}'.format(sqlite3.sqlite_version)
+
+    server = engine.url.URL(url.drivername, username=url.username,
+                            password=url.password, host=url.host,
+                            port=url.port, database='postgres',
+                            query=url.query)
+    db = engine.create_engine(server, isolation_level='AUTOCOMMIT')
+
+    try:
+        with db.connect() as connection:
+            connection.execute('DROP DATABASE IF EXISTS "{}"'.format(
+                url.database
+            ))
+            connection.execute('CREATE DATABASE "{}"'.format(url.database))
+            return connection.execute('SHOW server_version').scalar()
+    finally:
+        db.dispose()
+
+
+def Run(databases: dict, paths: list, scale: int=synthetic.SCALE,
+        seed: int=synthetic.SEED, directory: str='benchmark',
+        repeat: int=1, loglevel: int=logging.WARNING) -> dict:
+    """
+    Run the benchmarks and return the results and their environment.
+
+    :param databases: the DB URL of each DB name (e.g., ``sqlite``);
+                      the DBs are **dropped** before each path
+    :param paths: the names of the `PATHS` to run
+    :param scale: the scale of the synthetic files
+    :param seed: the seed of the synthetic files
+    :param directory: the working directory (for the synthetic files, the
+                      SQLite DBs and the record caches)
+    :param repeat: the number of runs of each path (the fastest run of
+                   each stage is reported)
+    :param loglevel: the log level of the stage processes
+    """
+    data = synthetic.Generate(os.path.join(directory, 'data-{}-{}'.format(
+        scale, seed
+    )), scale, seed)
+    results = []
+    versions = {}
+    context = multiprocessing.get_context('spawn')
+
+    for db, url in databases.items():
+        for path in paths:
+            best = {}
+            caches = os.path.join(directory, '{}-{}'.format(db, path))
+
+            for run in range(repeat):
+                logging.info('running %s on %s (%s/%s)', path, db, run + 1,
+                             repeat)
+                versions[db] = _recreate(url)
+
+                for name, records, function, args in _stages(path, data,
+                                                              caches):
+                    with ProcessPoolExecutor(
+                        1, mp_context=context, initializer=_initWorker,
+                        initargs=(url, loglevel)
+                    ) as executor:
+                        result = executor.submit(_runStage, function,
+                                                 *args).result()
+
+                    logging.info('%s %s %s: %.2f s', db, path, name,
+                                 result['seconds'])
+
+                    if name not in best or \
+                            result['seconds'] < best[name]['seconds']:
+                        result.update(db=db, path=path, stage=name,
+                                      records=records)
+                        best[name] = result
+
+            for name, _, _, _ in _stages(path, data, caches):
+                result = best[name]
+                result['rate'] = result['records'] / result['seconds'] \
+                    if result['seconds'] else None
+                results.append(result)
+
+    return {'environment': Environment(scale=scale, seed=seed,
+                                       data=synthetic.VERSION, repeat=repeat,
+                                       databases=versions),
+            'results': results}
+
+
+def Report(report: dict, baseline: dict=None, stream=sys.stdout):
+    """
+    Print the `report` of a `Run` as a table, comparing the throughput
+    against the `baseline` (an earlier report) if given.
+    """
+    env = report['environment']
+    print('# gnamed {} ({}), Python {}, {}; scale={} seed={} data={} '
+          'repeat={}'.format(env['gnamed'], env['revision'], env['python'],
+                             env['platform'], env['scale'], env['seed'],
+                             env['data'], env['repeat']), file=stream)
+
+    for db, version in sorted(env['databases'].items()):
+        print('# {}: {}'.format(db, version), file=stream)
+
+    columns = ['db', 'path', 'stage', 'records', 'seconds', 'records/s',
+               'RSS MiB', 'DB s']
+    rates = {}
+
+    if baseline is not None:
+        base = baseline['environment']
+
+        if (base['scale'], base['seed'], base['data']) != \
+                (env['scale'], env['seed'], env['data']):
+            logging.warning('the baseline was measured on other data '
+                            '(scale=%s seed=%s data=%s)', base['scale'],
+                            base['seed'], base['data'])
+
+        print('# baseline: gnamed {} ({}) from {}'.format(
+            base['gnamed'], base['revision'], base['date']
+        ), file=stream)
+        columns.append('change')
+        rates = {(r['db'], r['path'], r['stage']): r['rate']
+                 for r in baseline['results']}
+
+    print('\t'.join(columns), file=stream)
+
+    for r in report['results']:
+        row = [r['db'], r['path'], r['stage'], str(r['records']),
+               '{:.2f}'.format(r['seconds']),
+               '{:.0f}'.format(r['rate']) if r['rate'] else '-',
+               '{:.0f}'.format(r['peak_rss']),
+               '{:.2f}'.format(r['db_seconds'])]
+
+        if baseline is not None:
+            rate = rates.get((r['db'], r['path'], r['stage']))
+            row.append('{:+.1%}'.format(r['rate'] / rate - 1)
+                       if rate and r['rate'] else '-')
+
+        print('\t'.join(row), file=stream)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='benchmark the loading paths on synthetic data',
+        epilog='paths: ' + '; '.join('{} ({})'.format(*item)
+                                      for item in PATHS.items())
+    )
+    parser.add_argument('paths', metavar='PATH', nargs='*',
+                        help='the paths to run [all]')
+    parser.add_argument('--scale', type=int, default=synthetic.SCALE,
+                        help='number of Entrez genes [%(default)s]')
+    parser.add_argument('--seed', type=int, default=synthetic.SEED,
+                        help='seed of the synthetic data [%(default)s]')
+    parser.add_argument('-d', '--directory', default='benchmark',
+                        help='working directory [%(default)s]')
+    parser.add_argument('-n', '--repeat', type=int, default=1,
+                        help='runs of each path; the fastest run of each '
+                             'stage is reported [%(default)s]')
+    parser.add_argument('--postgresql', metavar='URL',
+                        help='also benchmark PostgreSQL, using this DB '
+                             '(dropped before each path!)')
+    parser.add_argument('--no-sqlite', action='store_false', dest='sqlite',
+                        help='do not benchmark SQLite')
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='write the results to a JSON file')
+    parser.add_argument('-c', '--compare', metavar='FILE',
+                        help='compare the throughput to earlier results')
+    parser.add_argument('-v', '--verbose', action='store_const',
+                        const=logging.INFO, dest='loglevel',
+                        default=logging.WARNING, help='log progress')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglevel,
+                        format='%(asctime)s %(levelname)s: %(message)s')
+
+    for path in args.paths:
+        if path not in PATHS:
+            parser.error('unknown path "{}"'.format(path))
+
+    databases = {}
+
+    if args.sqlite:
+        databases['sqlite'] = 'sqlite:///' + os.path.abspath(
+            os.path.join(args.directory, 'benchmark.db')
+        )
+
+    if args.postgresql:
+        databases['postgresql'] = args.postgresql
+
+    if not databases:
+        parser.error('no DB to benchmark')
+
+    baseline = None
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as stream:
+            baseline = json.load(stream)
+
+    os.makedirs(args.directory, exist_ok=True)
+    report = Run(databases, args.paths or list(PATHS), scale=args.scale,
+                 seed=args.seed, directory=args.directory,
+                 repeat=args.repeat, loglevel=args.loglevel)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as stream:
+            json.dump(report, stream, indent=1, sort_keys=True)
+
+    Report(report, baseline)
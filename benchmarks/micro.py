@@ -0,0 +1,430 @@
+"""
+.. py:module:: benchmarks.micro
+   :synopsis: Micro-benchmarks of the parsers' line handlers.
+
+Where `benchmarks.load` measures whole loads, these benchmarks measure the
+hot functions of the parsers alone: sampled lines are replayed through each
+handler (e.g., `gnamed.parsers.uniprot.Parser._parseDE`), without any DB
+(the parsed records are handed to a `cache` that discards them), and the
+time (ns/line) and the allocations of each handler are reported.
+
+The lines are sampled from the synthetic files (see `benchmarks.synthetic`)
+or from a directory of real, fetched files (``--data``, see ``gnamed
+fetch``); the first ``--sample N`` records of each repository are used.
+The time is the fastest of ``--repeat`` runs (with the garbage collector
+disabled, as `timeit` does). The allocations are measured in an extra run
+with `tracemalloc`: the number of memory blocks a handler retains per line
+(e.g., in the parsed records) and the peak of its traced memory, which
+also covers the temporary objects a handler creates.
+
+As with `benchmarks.load`, results can be written to a JSON file and
+compared against earlier results::
+
+    PYTHONPATH=src python3 -m benchmarks.micro -o base.json
+    PYTHONPATH=src python3 -m benchmarks.micro -c base.json uniprot
+
+.. moduleauthor:: Florian Leitner <florian.leitner@gmail.com>
+.. License: GNU GPL v3 (http://www.gnu.org/licenses/gpl.html)
+"""
+import gc
+import gzip
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+from collections import namedtuple
+
+from benchmarks import Environment, synthetic
+from gnamed.constants import REPOSITORIES
+from gnamed.loader import ProteinRecord
+from gnamed.parsers import entrez, hgnc, mgi, rgd, sgd, tair, uniprot
+
+SAMPLE = 10000
+"""Default number of records (lines or entries) to sample per repository."""
+
+REPEAT = 5
+"""Default number of timed runs of each handler."""
+
+Case = namedtuple('Case', ['name', 'lines', 'setup', 'run'])
+"""
+A benchmarked handler: `setup` returns a fresh state for `run`, which
+replays all `lines` through the handler (only `run` is measured).
+"""
+
+
+class _Sink:
+    # a parsed-record cache that discards the records (i.e., no DB)
+
+    def write(self, db_key, record):
+        pass
+
+
+def _path(directory: str, filename: str) -> str:
+    # the fetched (compressed) or the synthetic (uncompressed) file
+    path = os.path.join(directory, filename)
+
+    if not os.path.exists(path) and filename.endswith('.gz'):
+        path = path[:-3]
+
+    return path
+
+
+def _read(directory: str, filename: str, sample: int, skip: int=0) -> list:
+    # the first `sample` non-empty lines, stripped as by the parsers
+    path = _path(directory, filename)
+    lines = []
+
+    with (gzip.open(path, 'rt') if path.endswith('.gz') else
+          open(path)) as stream:
+        for line in stream:
+            if skip:
+                skip -= 1
+                continue
+
+            line = line.strip()
+
+            if line:
+                lines.append(line)
+
+                if len(lines) == sample:
+                    break
+
+    return lines
+
+
+def _lineCase(name: str, parser: type, handler: str, lines: list,
+              prepare=None) -> Case:
+    # a handler method that parses one line at a time
+    def setup():
+        instance = parser()
+        instance.cache = _Sink()
+
+        if prepare is not None:
+            prepare(instance)
+
+        return getattr(instance, handler)
+
+    def run(handle):
+        for line in lines:
+            handle(line)
+
+    return Case(name, len(lines), setup, run)
+
+
+def _uniprotCases(directory: str, sample: int) -> list:
+    # the DE, DR, and GN lines of each entry, handled with a fresh record
+    entries = []
+    entry = {'DE': [], 'DR': [], 'GN': []}
+    sequence = False
+    path = _path(directory, REPOSITORIES['uniprot']['resources'][0][1])
+
+    with (gzip.open(path, 'rt') if path.endswith('.gz') else
+          open(path)) as stream:
+        for line in stream:
+            line = line.strip()
+
+            if line.startswith('//'):
+                entries.append(entry)
+                entry = {'DE': [], 'DR': [], 'GN': []}
+                sequence = False
+
+                if len(entries) == sample:
+                    break
+            elif line.startswith('SQ'):
+                sequence = True
+            elif line[:2] in entry and not sequence:
+                entry[line[:2]].append(line)
+
+    cases = []
+
+    for kind in ('DE', 'DR', 'GN'):
+        def setup(kind=kind):
+            parser = uniprot.Parser()
+            handle = getattr(parser, '_parse' + kind)
+            return parser, handle, [(ProteinRecord(-1), e[kind])
+                                    for e in entries]
+
+        def run(state):
+            parser, handle, records = state
+
+            for record, lines in records:
+                parser.record = record
+                parser._name_cat = None
+
+                for line in lines:
+                    handle(line)
+
+        cases.append(Case('uniprot._parse' + kind,
+                          sum(len(e[kind]) for e in entries), setup, run))
+
+    return cases
+
+
+def _entrezCases(directory: str, sample: int) -> list:
+    def prepare(parser):
+        parser._generefs = set()
+        parser._pmidMapping = {}
+
+    lines = _read(directory, REPOSITORIES['entrez']['resources'][1][1],
+                  sample, skip=1)
+    return [_lineCase('entrez._parseMain', entrez.Parser, '_parseMain',
+                      lines, prepare)]
+
+
+def _hgncCases(directory: str, sample: int) -> list:
+    lines = _read(directory, REPOSITORIES['hgnc']['resources'][0][1],
+                  sample, skip=1)
+    # the quoted, comma-delimited fields: previous names, name synonyms and
+    # gene family names
+    fields = []
+
+    for line in lines:
+        items = line.split('\t')
+        fields.append([items[i] for i in (4, 6, 10) if i < len(items)])
+
+    def run(_):
+        for values in fields:
+            for value in values:
+                for _ in hgnc.Parser._parseQCD(value):
+                    pass
+
+    return [
+        Case('hgnc._parseQCD', len(fields), lambda: None, run),
+        _lineCase('hgnc._parse', hgnc.Parser, '_parse', lines),
+    ]
+
+
+def _mgiCases(directory: str, sample: int) -> list:
+    resources = REPOSITORIES['mgi']['resources']
+    # the lines of each report, with their number of columns
+    reports = [
+        (_read(directory, resources[0][1], sample, skip=1), 12),
+        (_read(directory, resources[1][1], sample), 7),
+        (_read(directory, resources[2][1], sample), 15),
+    ]
+
+    def run(_):
+        for lines, columns in reports:
+            for line in lines:
+                for _ in mgi.Parser._toItems(line, columns):
+                    pass
+
+    return [
+        Case('mgi._toItems', sum(len(lines) for lines, _ in reports),
+             lambda: None, run),
+        _lineCase('mgi._parseList1', mgi.Parser, '_parseList1',
+                  reports[0][0], lambda parser: setattr(parser, '_records',
+                                                        {})),
+    ]
+
+
+def _rgdCases(directory: str, sample: int) -> list:
+    path = _path(directory, REPOSITORIES['rgd']['resources'][0][1])
+    skip = 0
+
+    with open(path) as stream:
+        for line in stream:
+            skip += 1
+
+            if not line.startswith('#'):
+                break  # the header
+
+    lines = _read(directory, REPOSITORIES['rgd']['resources'][0][1], sample,
+                  skip=skip)
+    return [_lineCase('rgd._parse', rgd.Parser, '_parse', lines)]
+
+
+def _sgdCases(directory: str, sample: int) -> list:
+    def prepare(parser):
+        parser._db_key = None
+        parser._record = None
+
+    lines = _read(directory, REPOSITORIES['sgd']['resources'][0][1], sample)
+    return [_lineCase('sgd._parse', sgd.Parser, '_parse', lines, prepare)]
+
+
+def _tairCases(directory: str, sample: int) -> list:
+    lines = _read(directory, REPOSITORIES['tair']['resources'][0][1], sample,
+                  skip=1)
+    return [_lineCase('tair._parseName', tair.Parser, '_parseName', lines,
+                      lambda parser: setattr(parser, '_records', {}))]
+
+
+CASES = {
+    'entrez': _entrezCases,
+    'uniprot': _uniprotCases,
+    'hgnc': _hgncCases,
+    'mgi': _mgiCases,
+    'rgd': _rgdCases,
+    'sgd': _sgdCases,
+    'tair': _tairCases,
+}
+"""The function that samples the cases of each repository."""
+
+
+def Measure(case: Case, repeat: int=REPEAT) -> dict:
+    """
+    Measure the time and the allocations of a `Case`.
+    """
+    best = None
+    enabled = gc.isenabled()
+    gc.disable()
+
+    try:
+        for _ in range(repeat):
+            state = case.setup()
+            start = time.perf_counter_ns()
+            case.run(state)
+            elapsed = time.perf_counter_ns() - start
+            best = elapsed if best is None else min(best, elapsed)
+            del state
+    finally:
+        if enabled:
+            gc.enable()
+
+    state = case.setup()
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+
+    try:
+        case.run(state)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    blocks = sys.getallocatedblocks() - blocks
+    lines = max(case.lines, 1)
+    return {'handler': case.name, 'lines': case.lines,
+            'ns': best / lines, 'blocks': blocks / lines,
+            'peak': peak / 1024}
+
+
+def Run(keys: list, directory: str, sample: int=SAMPLE,
+        repeat: int=REPEAT) -> list:
+    """
+    Measure the cases of the repositories with the given `keys` on the
+    files in the `directory` and return the results.
+    """
+    results = []
+
+    for key in keys:
+        for case in CASES[key](directory, sample):
+            logging.info('measuring %s (%s lines)', case.name, case.lines)
+            results.append(Measure(case, repeat))
+
+    return results
+
+
+def Report(report: dict, baseline: dict=None, stream=sys.stdout):
+    """
+    Print the `report` as a table, comparing the time per line against the
+    `baseline` (an earlier report) if given.
+    """
+    env = report['environment']
+    print('# gnamed {} ({}), Python {}, {}; data={} sample={} '
+          'repeat={}'.format(env['gnamed'], env['revision'], env['python'],
+                             env['platform'], env['data'], env['sample'],
+                             env['repeat']), file=stream)
+    columns = ['handler', 'lines', 'ns/line', 'blocks/line', 'peak KiB']
+    times = {}
+
+    if baseline is not None:
+        base = baseline['environment']
+
+        if (base['data'], base['sample']) != (env['data'], env['sample']):
+            logging.warning('the baseline was measured on other data '
+                            '(%s, sample=%s)', base['data'], base['sample'])
+
+        print('# baseline: gnamed {} ({}) from {}'.format(
+            base['gnamed'], base['revision'], base['date']
+        ), file=stream)
+        columns.append('change')
+        times = {r['handler']: r['ns'] for r in baseline['results']}
+
+    print('\t'.join(columns), file=stream)
+
+    for r in report['results']:
+        row = [r['handler'], str(r['lines']), '{:.0f}'.format(r['ns']),
+               '{:.2f}'.format(r['blocks']), '{:.0f}'.format(r['peak'])]
+
+        if baseline is not None:
+            ns = times.get(r['handler'])
+            row.append('{:+.1%}'.format(r['ns'] / ns - 1) if ns else '-')
+
+        print('\t'.join(row), file=stream)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="benchmark the parsers' line handlers"
+    )
+    parser.add_argument('repositories', metavar='KEY', nargs='*',
+                        help='the repositories to benchmark [all]')
+    parser.add_argument('--data', metavar='DIR',
+                        help='sample the (fetched) files in DIR instead of '
+                             'synthetic files')
+    parser.add_argument('--scale', type=int, default=synthetic.SCALE,
+                        help='number of Entrez genes of the synthetic '
+                             'files [%(default)s]')
+    parser.add_argument('--seed', type=int, default=synthetic.SEED,
+                        help='seed of the synthetic files [%(default)s]')
+    parser.add_argument('-d', '--directory', default='benchmark',
+                        help='directory of the synthetic files '
+                             '[%(default)s]')
+    parser.add_argument('-s', '--sample', type=int, default=SAMPLE,
+                        help='records to sample per repository '
+                             '[%(default)s]')
+    parser.add_argument('-n', '--repeat', type=int, default=REPEAT,
+                        help='timed runs of each handler; the fastest run '
+                             'is reported [%(default)s]')
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='write the results to a JSON file')
+    parser.add_argument('-c', '--compare', metavar='FILE',
+                        help='compare the time per line to earlier results')
+    parser.add_argument('-v', '--verbose', action='store_const',
+                        const=logging.INFO, dest='loglevel',
+                        default=logging.WARNING, help='log progress')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglevel,
+                        format='%(asctime)s %(levelname)s: %(message)s')
+
+    for key in args.repositories:
+        if key not in CASES:
+            parser.error('no micro-benchmarks for "{}"'.format(key))
+
+    if args.data is not None:
+        directory = args.data
+        data = os.path.abspath(directory)
+    else:
+        directory = os.path.join(args.directory, 'data-{}-{}'.format(
+            args.scale, args.seed
+        ))
+        synthetic.Generate(directory, args.scale, args.seed)
+        data = 'synthetic scale={} seed={} version={}'.format(
+            args.scale, args.seed, synthetic.VERSION
+        )
+
+    baseline = None
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as stream:
+            baseline = json.load(stream)
+
+    report = {
+        'environment': Environment(data=data, sample=args.sample,
+                                   repeat=args.repeat),
+        'results': Run(args.repositories or list(CASES), directory,
+                       args.sample, args.repeat),
+    }
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as stream:
+            json.dump(report, stream, indent=1, sort_keys=True)
+
+    Report(report, baseline)
@@ -0,0 +1,840 @@
+"""
+.. py:module:: benchmarks.synthetic
+   :synopsis: Generate synthetic repository files at a configurable scale.
+
+The files mimic the formats of the real repositories closely enough that
+the parsers cannot tell them apart: a gene "universe" of `SCALE` Entrez
+genes of the supported species (and their proteins) is generated, and each
+repository file describes its share of the universe, with the same
+cross-references between the repositories as in the real files (e.g., an
+HGNC record links to the Entrez gene that links back to it). The files also
+contain the usual noise (junk names, backslashes, ``NEWENTRY`` lines,
+UniProt species unknown to the Taxonomy, ...).
+
+The same `SCALE` and `SEED` always produce the same files, so benchmark
+results are comparable across runs and machines. To generate the files of
+all repositories in a directory::
+
+    PYTHONPATH=src python3 -m benchmarks.synthetic DIR --scale 100000
+
+.. moduleauthor:: Florian Leitner <florian.leitner@gmail.com>
+.. License: GNU GPL v3 (http://www.gnu.org/licenses/gpl.html)
+"""
+import json
+import logging
+import os
+import random
+
+from collections import namedtuple
+from string import ascii_lowercase, ascii_uppercase, digits
+
+from gnamed.constants import REPOSITORIES, Species
+
+SCALE = 10000
+"""Default number of Entrez genes in the generated universe."""
+
+SEED = 1
+"""Default seed of the random number generators."""
+
+VERSION = 1
+"""
+Version of the generated data; increase it whenever the output of the
+generators changes, so that results of different versions are not mixed.
+"""
+
+MANIFEST = 'synthetic.json'
+"""Name of the file that records the generated files and record counts."""
+
+# the species of the universe, their share of the genes, the DB that names
+# their genes, and the UniProt mnemonic
+_SPECIES = (
+    (Species.human, 0.3, 'HGNC', 'HUMAN'),
+    (Species.mouse, 0.2, 'MGI', 'MOUSE'),
+    (Species.rat, 0.15, 'RGD', 'RAT'),
+    (Species.budding_yeast, 0.1, 'SGD', 'YEAST'),
+    (Species.cress, 0.1, 'TAIR', 'ARATH'),
+    (Species.fly, 0.05, 'FLYBASE', 'DROME'),
+    (Species.nematode, 0.05, 'WormBase', 'CAEEL'),
+    (Species.e_coli, 0.05, None, 'ECOLI'),
+)
+
+# a TaxID UniProt uses, but the Taxonomy does not know (yet)
+_UNKNOWN_SPECIES = 2000000000
+
+_CHROMOSOMES = {
+    Species.human: [str(c) for c in range(1, 23)] + ['X', 'Y'],
+    Species.mouse: [str(c) for c in range(1, 20)] + ['X', 'Y'],
+    Species.rat: [str(c) for c in range(1, 21)] + ['X'],
+    Species.budding_yeast: list(ascii_uppercase[:16]),
+    Species.cress: ['1', '2', '3', '4', '5'],
+    Species.fly: ['2L', '2R', '3L', '3R', '4', 'X'],
+    Species.nematode: ['I', 'II', 'III', 'IV', 'V', 'X'],
+    Species.e_coli: [''],
+}
+
+_STEMS = (
+    'ABC', 'ACT', 'ADH', 'AKT', 'ALDH', 'ANK', 'APO', 'ARF', 'ATP', 'BCL',
+    'CALM', 'CASP', 'CCN', 'CD', 'CDK', 'CHR', 'COL', 'CYP', 'DNAJ', 'EGF',
+    'EIF', 'FGF', 'FOX', 'GAB', 'GPR', 'GST', 'HOX', 'HSP', 'IL', 'ITG',
+    'KCN', 'KIF', 'KRT', 'LRR', 'MAP', 'MYO', 'NDUF', 'NOTCH', 'OR', 'PAX',
+    'PDE', 'PRK', 'RAB', 'RPL', 'SLC', 'SOX', 'TBC', 'TNF', 'UBE', 'ZNF',
+)
+
+_ADJECTIVES = (
+    'alpha', 'beta', 'gamma', 'delta', 'putative', 'small', 'large',
+    'acidic', 'basic', 'mitochondrial', 'nuclear', 'cytosolic', 'membrane',
+    'serine/threonine', 'tyrosine', 'zinc finger', 'ATP-binding',
+    'calcium-dependent', 'ribosomal', 'heat shock',
+)
+
+_NOUNS = (
+    'kinase', 'phosphatase', 'receptor', 'transporter', 'protein',
+    'dehydrogenase', 'synthase', 'reductase', 'channel', 'factor',
+    'ligase', 'transferase', 'hydrolase', 'isomerase', 'binding protein',
+    'domain containing protein', 'subunit', 'regulator', 'antigen',
+    'carrier family member',
+)
+
+_JUNK = ('hypothetical protein', 'predicted protein', 'unnamed',
+         'similar to predicted protein')
+
+_KEYWORDS = (
+    'ATP-binding', 'Acetylation', 'Alternative splicing', 'Cytoplasm',
+    'Disulfide bond', 'Glycoprotein', 'Hydrolase', 'Kinase', 'Membrane',
+    'Metal-binding', 'Nucleus', 'Phosphoprotein', 'Receptor', 'Repeat',
+    'Signal', 'Transcription', 'Transferase', 'Transmembrane', 'Transport',
+    'Zinc',
+)
+
+_AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+_BASE36 = digits + ascii_uppercase
+
+Gene = namedtuple('Gene', [
+    'gid', 'species', 'key', 'type', 'symbol', 'name', 'synonyms', 'names',
+    'chromosome', 'location', 'pmids', 'proteins',
+])
+
+Protein = namedtuple('Protein', [
+    'accessions', 'species', 'gene', 'reviewed', 'mnemonic', 'symbol',
+    'name', 'short_names', 'alt_names', 'ec', 'pmids', 'keywords', 'length',
+])
+
+
+def Generate(directory: str, scale: int=SCALE, seed: int=SEED) -> dict:
+    """
+    Generate the files of all repositories in the `directory` (unless the
+    same files have been generated there already) and return a dictionary
+    of the ``files`` (paths, in parsing order) and the number of
+    ``records`` (of the main entity type) of each repository key (and of
+    ``taxa``, the NCBI Taxonomy dump).
+
+    :param directory: the directory to write the files to
+    :param scale: the number of Entrez genes
+    :param seed: the seed of the random number generators
+    """
+    manifest = os.path.join(directory, MANIFEST)
+
+    if os.path.exists(manifest):
+        with open(manifest, encoding='utf-8') as stream:
+            data = json.load(stream)
+
+        if (data['scale'], data['seed'], data['version']) == \
+                (scale, seed, VERSION):
+            logging.info('reusing the synthetic files in %s', directory)
+            return _repositories(directory, data)
+
+    os.makedirs(directory, exist_ok=True)
+    logging.info('generating synthetic files of %s genes in %s',
+                 scale, directory)
+    genes, proteins = _universe(random.Random(seed), scale)
+    repositories = {}
+
+    for repo_key, writer in _WRITERS:
+        rng = random.Random('{}:{}'.format(seed, repo_key))
+        filenames = _filenames(repo_key)
+        paths = [os.path.join(directory, name) for name in filenames]
+        records = writer(rng, genes, proteins, *paths)
+        repositories[repo_key] = {'files': filenames, 'records': records}
+        logging.info('generated %s %s records', records, repo_key)
+
+    data = {'scale': scale, 'seed': seed, 'version': VERSION,
+            'repositories': repositories}
+
+    with open(manifest, 'w', encoding='utf-8') as stream:
+        json.dump(data, stream, indent=1, sort_keys=True)
+
+    return _repositories(directory, data)
+
+
+def _repositories(directory: str, data: dict) -> dict:
+    return {key: {'files': [os.path.join(directory, name)
+                            for name in repo['files']],
+                  'records': repo['records']}
+            for key, repo in data['repositories'].items()}
+
+
+def _filenames(repo_key: str) -> list:
+    # the names of the fetched files, but uncompressed
+    if repo_key == 'taxa':
+        return ['nodes.dmp', 'names.dmp', 'merged.dmp']
+
+    return [name[:-3] if name.endswith('.gz') else name
+            for _, name, _ in REPOSITORIES[repo_key]['resources']]
+
+
+def _accession(n: int) -> str:
+    # the n-th UniProt accession ([A-Z][0-9][A-Z0-9]{3}[0-9])
+    n, last = divmod(n, 10)
+    n, middle = divmod(n, 36 ** 3)
+    n, second = divmod(n, 10)
+    chars = []
+
+    for _ in range(3):
+        middle, c = divmod(middle, 36)
+        chars.append(_BASE36[c])
+
+    return '{}{}{}{}'.format(ascii_uppercase[n % 26], second,
+                             ''.join(reversed(chars)), last)
+
+
+def _symbol(rng: random.Random, species: int) -> str:
+    symbol = '{}{}'.format(rng.choice(_STEMS), rng.randint(1, 99))
+
+    if rng.random() < 0.2:
+        symbol += rng.choice(ascii_uppercase[:6])
+
+    if species in (Species.mouse, Species.rat):
+        symbol = symbol[0] + symbol[1:].lower()
+
+    return symbol
+
+
+def _name(rng: random.Random) -> str:
+    return '{} {} {}'.format(rng.choice(_ADJECTIVES), rng.choice(_NOUNS),
+                             rng.randint(1, 30))
+
+
+def _pmids(rng: random.Random, hot: int) -> list:
+    # a few articles are cited by many genes, most only by a few
+    return sorted({rng.randint(1, hot) if rng.random() < 0.5 else
+                   rng.randint(1000000, 30000000)
+                   for _ in range(min(int(rng.expovariate(0.4)), 50))})
+
+
+def _location(rng: random.Random, species: int, chromosome: str) -> str:
+    if species == Species.human:
+        return '{}{}{}.{}'.format(chromosome, rng.choice('pq'),
+                                  rng.randint(11, 36), rng.randint(1, 3))
+    elif species == Species.mouse:
+        return '{} {}{}'.format(chromosome, rng.choice('ABCDEFGH'),
+                                rng.randint(1, 5))
+    elif species == Species.rat:
+        return 'q{}'.format(rng.randint(11, 41))
+    elif species == Species.cress:
+        return None
+
+    return chromosome or None
+
+
+def _universe(rng: random.Random, scale: int) -> tuple:
+    # generate the genes and proteins all repositories are made of
+    genes = []
+    proteins = []
+    keys = {}
+    hot = max(scale // 10, 10)
+    weights = [share for _, share, _, _ in _SPECIES]
+
+    for index in range(scale):
+        species, _, db, mnemonic = rng.choices(_SPECIES, weights)[0]
+        count = keys[species] = keys.get(species, 0) + 1
+        chromosome = rng.choice(_CHROMOSOMES[species])
+        gene_type = rng.choices(('protein-coding', 'ncRNA', 'pseudo'),
+                                (0.8, 0.1, 0.1))[0]
+
+        if species == Species.budding_yeast:
+            key = 'S{:09d}'.format(count)
+        elif species == Species.cress:
+            key = 'AT{}G{:05d}'.format(count % 5 + 1, count * 10)
+        elif species == Species.fly:
+            key = 'FBgn{:07d}'.format(count)
+        elif species == Species.nematode:
+            key = 'WBGene{:08d}'.format(count)
+        elif db is not None:
+            key = str(count)
+        else:
+            key = None
+
+        gene = Gene(
+            gid=str(index + 1), species=species, key=key, type=gene_type,
+            symbol=_symbol(rng, species), name=_name(rng),
+            synonyms=[_symbol(rng, species)
+                      for _ in range(int(rng.expovariate(0.8)))],
+            names=[_name(rng) for _ in range(int(rng.expovariate(1.5)))],
+            chromosome=chromosome,
+            location=_location(rng, species, chromosome),
+            pmids=_pmids(rng, hot), proteins=[],
+        )
+        genes.append(gene)
+
+        if gene_type == 'protein-coding':
+            for _ in range(1 if rng.random() < 0.9 else 2):
+                protein = _protein(rng, len(proteins), species, mnemonic,
+                                   gene)
+                gene.proteins.append(protein)
+                proteins.append(protein)
+
+    # unlinked (TrEMBL) proteins, some of unknown species
+    for _ in range(scale * 3 // 10):
+        if rng.random() < 0.05:
+            species, mnemonic = _UNKNOWN_SPECIES, 'UNKNOWN'
+        else:
+            species, _, _, mnemonic = rng.choices(_SPECIES, weights)[0]
+
+        proteins.append(_protein(rng, len(proteins), species, mnemonic))
+
+    return genes, proteins
+
+
+def _protein(rng: random.Random, index: int, species: int, mnemonic: str,
+             gene: Gene=None) -> Protein:
+    accessions = [_accession(index * 3)]
+
+    if rng.random() < 0.3:
+        accessions.append(_accession(index * 3 + 1))
+
+    reviewed = gene is not None and rng.random() < 0.6
+    symbol = gene.symbol.upper() if gene is not None and \
+        rng.random() < 0.9 else None
+
+    if not reviewed and rng.random() < 0.2:
+        name = 'Uncharacterized protein'
+    else:
+        name = _name(rng).capitalize()
+
+    return Protein(
+        accessions=accessions, species=species, gene=gene,
+        reviewed=reviewed, mnemonic=mnemonic, symbol=symbol, name=name,
+        short_names=[_symbol(rng, Species.human)
+                     for _ in range(int(rng.expovariate(1.5)))],
+        alt_names=[_name(rng).capitalize()
+                   for _ in range(int(rng.expovariate(1.0)))],
+        ec='{}.{}.{}.{}'.format(*(rng.randint(1, 20) for _ in range(4)))
+        if rng.random() < 0.2 else None,
+        pmids=gene.pmids[:3] if gene is not None else _pmids(rng, 10),
+        keywords=rng.sample(_KEYWORDS, rng.randint(0, 6)),
+        length=rng.randint(50, 1500),
+    )
+
+
+def _taxdump(rng: random.Random, genes: list, proteins: list, nodes: str,
+             names: str, merged: str) -> int:
+    # a small tree of the universe's species and their lineages, plus
+    # random filler species (and a few merged IDs)
+    tree = [
+        (1, 1, 'no rank', 'root'),
+        (131567, 1, 'no rank', 'cellular organisms'),
+        (2, 131567, 'superkingdom', 'Bacteria'),
+        (1224, 2, 'phylum', 'Proteobacteria'),
+        (561, 1224, 'genus', 'Escherichia'),
+        (562, 561, 'species', 'Escherichia coli'),
+        (2759, 131567, 'superkingdom', 'Eukaryota'),
+        (33208, 2759, 'kingdom', 'Metazoa'),
+        (40674, 33208, 'class', 'Mammalia'),
+        (9605, 40674, 'genus', 'Homo'),
+        (9606, 9605, 'species', 'Homo sapiens'),
+        (10088, 40674, 'genus', 'Mus'),
+        (10090, 10088, 'species', 'Mus musculus'),
+        (10114, 40674, 'genus', 'Rattus'),
+        (10116, 10114, 'species', 'Rattus norvegicus'),
+        (50557, 33208, 'class', 'Insecta'),
+        (7215, 50557, 'genus', 'Drosophila'),
+        (7227, 7215, 'species', 'Drosophila melanogaster'),
+        (6231, 33208, 'phylum', 'Nematoda'),
+        (6237, 6231, 'genus', 'Caenorhabditis'),
+        (6239, 6237, 'species', 'Caenorhabditis elegans'),
+        (4751, 2759, 'kingdom', 'Fungi'),
+        (4930, 4751, 'genus', 'Saccharomyces'),
+        (4932, 4930, 'species', 'Saccharomyces cerevisiae'),
+        (33090, 2759, 'kingdom', 'Viridiplantae'),
+        (3701, 33090, 'genus', 'Arabidopsis'),
+        (3702, 3701, 'species', 'Arabidopsis thaliana'),
+        (12908, 1, 'no rank', 'unclassified sequences'),
+        (32644, 12908, 'species', 'unidentified'),
+    ]
+    common = {9606: 'human', 10090: 'house mouse', 10116: 'Norway rat',
+              4932: "baker's yeast", 3702: 'thale cress',
+              7227: 'fruit fly'}
+    parents = [taxon[0] for taxon in tree if taxon[2] != 'species']
+    genus = None
+
+    for n in range(max(len(genes) // 10, 10)):
+        if n % 10 == 0:
+            genus = ''.join(rng.choice(ascii_lowercase)
+                            for _ in range(rng.randint(5, 10))).capitalize()
+            tree.append((3000000 + n // 10, rng.choice(parents), 'genus',
+                         genus))
+
+        tree.append((3500000 + n, 3000000 + n // 10, 'species',
+                     '{} {}'.format(genus, ''.join(
+                         rng.choice(ascii_lowercase)
+                         for _ in range(rng.randint(4, 12))
+                     ))))
+
+    tree.sort()
+    species = [taxon[0] for taxon in tree if taxon[2] == 'species']
+
+    with open(nodes, 'w', encoding='utf-8') as stream:
+        for tax_id, parent_id, rank, _ in tree:
+            stream.write('\t|\t'.join((
+                str(tax_id), str(parent_id), rank, '', '0', '1', '1', '1',
+                '0', '1', '0', '0', ''
+            )))
+            stream.write('\t|\n')
+
+    with open(names, 'w', encoding='utf-8') as stream:
+        for tax_id, _, _, name in tree:
+            rows = [(name, '', 'scientific name')]
+
+            if tax_id in common:
+                rows.append((common[tax_id], '', 'genbank common name'))
+
+            if rng.random() < 0.3:
+                rows.append(('{} {}'.format(name, rng.randint(1, 9)), '',
+                             'synonym'))
+
+            for row in rows:
+                stream.write('{}\t|\t{}\t|\t{}\t|\t{}\t|\n'.format(tax_id,
+                                                                 *row))
+
+    with open(merged, 'w', encoding='utf-8') as stream:
+        for n in range(max(len(genes) // 100, 1)):
+            stream.write('{}\t|\t{}\t|\n'.format(4000000 + n,
+                                                 rng.choice(species)))
+
+    return len(tree)
+
+
+def _xrefs(gene: Gene) -> list:
+    # the dbXrefs of a gene in the Entrez gene_info file
+    db = dict((s, d) for s, _, d, _ in _SPECIES)[gene.species]
+    xrefs = []
+
+    if gene.key is not None:
+        xrefs.append('{}:{}'.format(db, gene.key))
+
+    if gene.species == Species.human:
+        xrefs.append('MIM:{}'.format(100000 + int(gene.gid)))
+        xrefs.append('Ensembl:ENSG{:011d}'.format(int(gene.gid)))
+    elif gene.species == Species.e_coli:
+        xrefs.append('EcoGene:EG{:05d}'.format(int(gene.gid) % 100000))
+
+    return xrefs
+
+
+def _entrez(rng: random.Random, genes: list, proteins: list, gene2pubmed: str,
+            gene_info: str) -> int:
+    with open(gene2pubmed, 'w', encoding='utf-8') as stream:
+        stream.write('#Format: tax_id GeneID PubMed_ID '
+                     '(tab is used as a separator, pound sign - start of a '
+                     'comment)\n')
+
+        for gene in genes:
+            for pmid in gene.pmids:
+                stream.write('{}\t{}\t{}\n'.format(gene.species, gene.gid,
+                                                   pmid))
+
+    with open(gene_info, 'w', encoding='utf-8') as stream:
+        stream.write('#Format: tax_id GeneID Symbol LocusTag Synonyms '
+                     'dbXrefs chromosome map_location description '
+                     'type_of_gene Symbol_from_nomenclature_authority '
+                     'Full_name_from_nomenclature_authority '
+                     'Nomenclature_status Other_designations '
+                     'Modification_date (tab is used as a separator, pound '
+                     'sign - start of a comment)\n')
+
+        for gene in genes:
+            name = gene.name
+
+            if rng.random() < 0.02:
+                name = rng.choice(_JUNK)
+            elif rng.random() < 0.01:
+                name = name.replace(' ', '\\ ', 1)
+
+            chromosome = gene.chromosome
+
+            if rng.random() < 0.01:
+                chromosome += '|Un'
+
+            official = gene.key is not None and rng.random() < 0.8
+            designations = gene.names + [p.name for p in gene.proteins]
+
+            if rng.random() < 0.05:
+                designations.append(rng.choice(_JUNK))
+
+            stream.write('\t'.join((
+                str(gene.species), gene.gid, gene.symbol,
+                gene.key if gene.species == Species.budding_yeast else '-',
+                '|'.join(gene.synonyms) or '-',
+                '|'.join(_xrefs(gene)) or '-',
+                chromosome or '-', gene.location or '-', name,
+                gene.type, gene.symbol if official else '-',
+                gene.name if official else '-', 'O' if official else '-',
+                '|'.join(designations) or '-',
+                '2013{:02d}{:02d}'.format(rng.randint(1, 12),
+                                          rng.randint(1, 28)),
+            )))
+            stream.write('\n')
+
+            if rng.random() < 0.001:
+                stream.write('{}\t{}\tNEWENTRY\t-\t-\t-\t-\t-\tRecord to '
+                             'support submission of GeneRIFs for a gene not '
+                             'in Gene\tother\t-\t-\t-\t-\t20130101\n'.format(
+                                 gene.species, 100000000 + int(gene.gid)
+                             ))
+
+    return len(genes)
+
+
+def _uniprot(rng: random.Random, genes: list, proteins: list, sprot: str,
+             trembl: str) -> int:
+    with open(sprot, 'w', encoding='utf-8') as reviewed, \
+            open(trembl, 'w', encoding='utf-8') as unreviewed:
+        for protein in proteins:
+            _uniprotEntry(rng, protein,
+                          reviewed if protein.reviewed else unreviewed)
+
+    return len(proteins)
+
+
+def _uniprotEntry(rng: random.Random, protein: Protein, stream):
+    gene = protein.gene
+    write = stream.write
+    entry_name = '{}_{}'.format(
+        protein.symbol if protein.reviewed and protein.symbol else
+        protein.accessions[0], protein.mnemonic
+    )
+    write('ID   {:<23} {:<18} {} AA.\n'.format(
+        entry_name,
+        'Reviewed;' if protein.reviewed else 'Unreviewed;',
+        protein.length
+    ))
+    write('AC   {};\n'.format('; '.join(protein.accessions)))
+    write('DT   01-JAN-1990, integrated into UniProtKB/{}.\n'.format(
+        'Swiss-Prot' if protein.reviewed else 'TrEMBL'
+    ))
+    write('DT   16-JAN-2013, entry version {}.\n'.format(
+        rng.randint(1, 150)
+    ))
+    write('DE   {}: Full={};\n'.format(
+        'RecName' if protein.reviewed else 'SubName', protein.name
+    ))
+
+    for short in protein.short_names:
+        write('DE            Short={};\n'.format(short))
+
+    if protein.ec is not None:
+        write('DE            EC={};\n'.format(protein.ec))
+
+    for alt in protein.alt_names:
+        write('DE   AltName: Full={};\n'.format(alt))
+
+    if rng.random() < 0.1:
+        write('DE   Flags: Precursor;\n')
+
+    if protein.symbol is not None:
+        synonyms = gene.synonyms if gene is not None else []
+        write('GN   Name={};{}\n'.format(protein.symbol, (
+            ' Synonyms={};'.format(', '.join(synonyms)) if synonyms else ''
+        )))
+    elif rng.random() < 0.5:
+        write('GN   ORFNames={};\n'.format(protein.accessions[0].lower()))
+
+    write('OS   Some species.\n')
+    write('OC   Eukaryota; Metazoa.\n')
+    write('OX   NCBI_TaxID={};\n'.format(protein.species))
+
+    for n, pmid in enumerate(protein.pmids):
+        write('RN   [{}]\n'.format(n + 1))
+        write('RP   NUCLEOTIDE SEQUENCE [MRNA].\n')
+        write('RX   PubMed={}; DOI=10.1000/{};\n'.format(pmid, pmid))
+        write('RA   Doe J., Roe R.;\n')
+        write('RT   "A synthetic reference.";\n')
+        write('RL   J. Synth. Biol. {}:1-{}(2013).\n'.format(n + 1, pmid % 97))
+
+    if protein.reviewed:
+        write('CC   -!- FUNCTION: Synthetic.\n')
+
+    write('DR   EMBL; X{:05d}; CAA{:05d}.1; -; mRNA.\n'.format(
+        rng.randint(0, 99999), rng.randint(0, 99999)
+    ))
+
+    if gene is not None:
+        write('DR   GeneID; {}; -.\n'.format(gene.gid))
+
+        if gene.key is not None:
+            if gene.species == Species.human:
+                write('DR   HGNC; HGNC:{}; {}.\n'.format(gene.key,
+                                                        gene.symbol))
+            elif gene.species == Species.mouse:
+                write('DR   MGI; MGI:{}; {}.\n'.format(gene.key,
+                                                      gene.symbol))
+            elif gene.species == Species.rat:
+                write('DR   RGD; {}; {}.\n'.format(gene.key, gene.symbol))
+            elif gene.species == Species.budding_yeast:
+                write('DR   SGD; {}; {}.\n'.format(gene.key, gene.symbol))
+            elif gene.species == Species.cress:
+                write('DR   TAIR; {}; -.\n'.format(gene.key))
+            elif gene.species == Species.fly:
+                write('DR   FlyBase; {}; {}.\n'.format(gene.key,
+                                                      gene.symbol))
+            elif gene.species == Species.nematode:
+                write('DR   WormBase; C{:05d}; CE{:05d}; {}; {}.\n'.format(
+                    int(gene.gid) % 100000, int(gene.gid) % 100000,
+                    gene.key, gene.symbol.lower()
+                ))
+
+    write('DR   GO; GO:{:07d}; C:synthetic; IEA:InterPro.\n'.format(
+        rng.randint(1, 99999)
+    ))
+    write('DR   InterPro; IPR{:06d}; Synthetic.\n'.format(
+        rng.randint(1, 99999)
+    ))
+    write('PE   {}: Evidence at {} level;\n'.format(
+        *((1, 'protein') if protein.reviewed else (4, 'predicted'))
+    ))
+
+    if protein.keywords:
+        write('KW   {}.\n'.format('; '.join(protein.keywords)))
+
+    write('FT   CHAIN         1   {:>4}       {}.\n'.format(protein.length,
+                                                           protein.name))
+    write('SQ   SEQUENCE {:>5} AA;  {:>5} MW;  {:016X} CRC64;\n'.format(
+        protein.length, protein.length * 110, rng.getrandbits(64)
+    ))
+    sequence = ''.join(rng.choices(_AMINO_ACIDS, k=protein.length))
+
+    for start in range(0, protein.length, 60):
+        line = sequence[start:start + 60]
+        write('     {}\n'.format(' '.join(line[i:i + 10]
+                                          for i in range(0, len(line), 10))))
+
+    write('//\n')
+
+
+def _hgnc(rng: random.Random, genes: list, proteins: list, path: str) -> int:
+    records = 0
+
+    with open(path, 'w', encoding='ISO-8859-1') as stream:
+        stream.write('\t'.join((
+            'HGNC ID', 'Approved Symbol', 'Approved Name', 'Previous Symbols',
+            'Previous Names', 'Synonyms', 'Name Synonyms', 'Chromosome',
+            'Pubmed IDs', 'Gene Family Tag', 'Gene family description',
+            'Entrez Gene ID', 'Ensembl Gene ID', 'Mouse Genome Database ID',
+            'UniProt ID', 'Rat Genome Database ID'
+        )))
+        stream.write('\n')
+
+        for gene in genes:
+            if gene.species != Species.human:
+                continue
+
+            previous = gene.synonyms[:1]
+            family = rng.choice(_STEMS) if rng.random() < 0.3 else ''
+            stream.write('\t'.join((
+                gene.key, gene.symbol, gene.name, ', '.join(previous),
+                ', '.join('"{}"'.format(n) for n in gene.names[:1]),
+                ', '.join(gene.synonyms[1:]),
+                ', '.join('"{}"'.format(n) for n in gene.names[1:]),
+                gene.location + (' ALT_REF_LOCI_1'
+                                 if rng.random() < 0.01 else ''),
+                ', '.join(str(pmid) for pmid in gene.pmids[:3]),
+                family, '"{} family"'.format(family) if family else '',
+                gene.gid if rng.random() < 0.95 else '',
+                'ENSG{:011d}'.format(int(gene.gid)),
+                'MGI:{}'.format(rng.randint(1, 99999)),
+                gene.proteins[0].accessions[0] if gene.proteins else '',
+                'RGD:{}'.format(rng.randint(1, 99999)),
+            )))
+            stream.write('\n')
+            records += 1
+
+    return records
+
+
+def _mgi(rng: random.Random, genes: list, proteins: list, list1: str,
+         uniprot: str, entrez: str) -> int:
+    mouse = [gene for gene in genes if gene.species == Species.mouse]
+
+    with open(list1, 'w', encoding='utf-8') as stream:
+        stream.write('MGI Accession ID\tChr\tcM Position\tgenome coordinate '
+                     'start\tgenome coordinate end\tstrand\tMarker Symbol\t'
+                     'Status\tMarker Name\tMarker Type\tFeature Type\t'
+                     'Marker Synonyms (pipe-separated)\n')
+
+        for gene in mouse:
+            start = rng.randint(1, 190000000)
+            stream.write('\t'.join((
+                'MGI:' + gene.key, gene.chromosome,
+                '{:.2f}'.format(rng.uniform(0, 90)), str(start),
+                str(start + rng.randint(1000, 100000)), rng.choice('+-'),
+                gene.symbol, 'O', gene.name, 'Gene',
+                'protein coding gene' if gene.proteins else 'pseudogene',
+                '|'.join(gene.synonyms),
+            )))
+            stream.write('\n')
+
+    with open(uniprot, 'w', encoding='utf-8') as stream:
+        for gene in mouse:
+            if gene.proteins:
+                stream.write('\t'.join((
+                    'MGI:' + gene.key, gene.symbol, 'O', gene.name, '1.00',
+                    gene.chromosome,
+                    ' '.join(p.accessions[0] for p in gene.proteins),
+                )))
+                stream.write('\n')
+
+    with open(entrez, 'w', encoding='utf-8') as stream:
+        for gene in mouse:
+            stream.write('\t'.join((
+                'MGI:' + gene.key, gene.symbol, 'O', gene.name, '1.00',
+                gene.chromosome, 'Gene',
+                'NM_{:06d}'.format(int(gene.gid)) if gene.proteins else '',
+                gene.gid if rng.random() < 0.95 else '',
+                '|'.join(gene.synonyms), 'protein coding gene', '', '', '',
+                'protein_coding',
+            )))
+            stream.write('\n')
+
+    return len(mouse)
+
+
+def _rgd(rng: random.Random, genes: list, proteins: list, path: str) -> int:
+    rat = [gene for gene in genes if gene.species == Species.rat]
+
+    with open(path, 'w', encoding='utf-8') as stream:
+        stream.write('# RGD-PIPELINE: ftp-file-extracts\n'
+                     '# MODULE: genes-version-2.2.6\n'
+                     '# GENERATED-ON: 2013/01/17\n')
+        stream.write('\t'.join('COLUMN_{}'.format(c) for c in range(40)))
+        stream.write('\n')
+
+        for gene in rat:
+            row = [''] * 40
+            row[0] = gene.key
+            row[1] = gene.symbol
+            row[2] = gene.name
+            row[3] = '; '.join(rng.sample(_KEYWORDS, rng.randint(0, 3)))
+            row[5] = gene.chromosome
+            row[7] = gene.location
+            row[20] = gene.gid
+            row[21] = ';'.join(p.accessions[0] for p in gene.proteins)
+            row[29] = ';'.join(gene.synonyms)
+            row[30] = ';'.join(gene.names)
+
+            if rng.random() < 0.05:
+                row[32] = '{}QTL{}'.format(gene.symbol, rng.randint(1, 9))
+
+            row[36] = gene.type
+            row[39] = 'ENSRNOG{:011d}'.format(int(gene.gid))
+
+            stream.write('\t'.join(row))
+            stream.write('\n')
+
+    return len(rat)
+
+
+def _sgd(rng: random.Random, genes: list, proteins: list, path: str) -> int:
+    yeast = [gene for gene in genes if gene.species == Species.budding_yeast]
+
+    with open(path, 'w', encoding='ascii') as stream:
+        for gene in yeast:
+            # the systematic name, e.g. YAL001C
+            location = 'Y{}{}{:03d}{}'.format(
+                gene.chromosome, rng.choice('LR'), int(gene.key[1:]) % 1000,
+                rng.choice('WC')
+            )
+            symbol = gene.symbol if rng.random() < 0.7 else '""'
+            columns = (
+                gene.key,
+                rng.choice(('Verified', 'Uncharacterized', 'Dubious')),
+                symbol, gene.name if rng.random() < 0.5 else '""',
+                location, str(rng.randint(100, 5000)),
+                symbol.capitalize() + 'p' if symbol != '""' else '""',
+            )
+
+            # one line per alias
+            for alias in [gene.symbol] + gene.synonyms + gene.names:
+                stream.write('\t'.join(columns + (alias,)))
+                stream.write('\n')
+
+    return len(yeast)
+
+
+def _tair(rng: random.Random, genes: list, proteins: list, names: str,
+          aliases: str, entrez: str) -> int:
+    cress = [gene for gene in genes if gene.species == Species.cress]
+
+    with open(names, 'w', encoding='utf-8') as stream:
+        stream.write('name\tsymbol\tfull_name\n')
+
+        for gene in cress:
+            if rng.random() < 0.8:
+                stream.write('{}\t{}\t{}\n'.format(gene.key, gene.symbol,
+                                                   gene.name))
+            else:
+                stream.write('{}\t{}\n'.format(gene.key, gene.symbol))
+
+    with open(aliases, 'w', encoding='utf-8') as stream:
+        stream.write('name\tsymbol\tfull_name\n')
+
+        for gene in cress:
+            for n, synonym in enumerate(gene.synonyms):
+                if n < len(gene.names):
+                    stream.write('{}\t{}\t"{}"\n'.format(
+                        gene.key, synonym, gene.names[n]
+                    ))
+                else:
+                    stream.write('{}\t{}\n'.format(gene.key, synonym))
+
+    with open(entrez, 'w', encoding='utf-8') as stream:
+        for gene in cress:
+            if rng.random() < 0.95:
+                stream.write('{}\t{}\n'.format(gene.gid, gene.key))
+
+    return len(cress)
+
+
+# the generator of each repository's files, in load order
+_WRITERS = (
+    ('taxa', _taxdump),
+    ('entrez', _entrez),
+    ('uniprot', _uniprot),
+    ('hgnc', _hgnc),
+    ('mgi', _mgi),
+    ('rgd', _rgd),
+    ('sgd', _sgd),
+    ('tair', _tair),
+)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='generate synthetic repository files'
+    )
+    parser.add_argument('directory', metavar='DIR',
+                        help='the directory to write the files to')
+    parser.add_argument('--scale', type=int, default=SCALE,
+                        help='number of Entrez genes [%(default)s]')
+    parser.add_argument('--seed', type=int, default=SEED,
+                        help='seed of the random generators [%(default)s]')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s: %(message)s')
+
+    for key, repository in Generate(args.directory, args.scale,
+                                    args.seed).items():
+        print(key, repository['records'], ' '.join(repository['files']),
+              sep='\t')
@@ -12,7 +12,7 @@ setup(
     long_description=open('README.rst').read(),
     package_dir={'': 'src'},
     install_requires=[
-        'sqlalchemy >= 0.8',
+        'sqlalchemy >= 1.1',
         'psycopg2 >= 2.3',
         'progress_bar >= 5',
         'bumpversion >= 0.4',
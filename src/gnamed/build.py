@@ -0,0 +1,406 @@
+"""
+.. py:module:: gnamed.build
+   :synopsis: Build the DB from the repositories in one dependency-aware run.
+
+A full DB build fetches, parses and loads every repository, in the right
+order: the NCBI Taxonomy first, then the generic repositories, and only
+then the organism-specific ones, because the last repository loaded sets
+the metadata of an entity (see `gnamed.constants.LOAD_ORDER`). `Build`
+models this as a DAG of stages:
+
+- ``fetch:KEY`` downloads the files of a repository (into a directory, or
+  into a `gnamed.releases.Store`);
+- ``init`` loads the NCBI Taxonomy (the ``taxa`` repository);
+- ``parse:KEY`` parses the files into a parsed-record cache (see
+  `gnamed.parsed`), unless that cache exists already;
+- ``load:KEY`` loads the parsed records into the DB;
+- ``indexes:drop`` and ``indexes:rebuild`` bracket the loads in bulk mode
+  (see `gnamed.orm.IndexManager`);
+- ``closure`` refreshes the mapping closure once all loads are done.
+
+All fetch stages start at once (in threads), and each parse stage starts
+(in a worker process) as soon as its files are there, so downloading and
+parsing overlap for all repositories. A load stage waits for the ``init``
+stage and for all earlier loads it conflicts with: generic repositories
+conflict with every other repository, while organism-specific repositories
+only conflict if their species overlap (see
+`gnamed.constants.SPECIES_SPACES`). On PostgreSQL, loads that do not
+conflict run in parallel; on other DBs, one load runs at a time.
+
+Each stage records its start and end time, so a build reports the total
+wall-clock time and the time of every stage (see `Build.report`).
+
+.. moduleauthor:: Florian Leitner <florian.leitner@gmail.com>
+.. License: GNU GPL v3 (http://www.gnu.org/licenses/gpl.html)
+"""
+import logging
+import multiprocessing
+import os
+import sys
+import tarfile
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, \
+    ThreadPoolExecutor, wait
+from sqlalchemy.engine.url import make_url
+
+from gnamed.constants import LOAD_ORDER, REPOSITORIES, SPECIES_SPACES, \
+    Namespace
+from gnamed.fetcher import Retrieve, StoredEncoding, WORKERS
+from gnamed.orm import CloseDb, IndexManager, InitDb, RefreshClosure, \
+    RelaxDurability, POOL_SIZE
+from gnamed.parsed import CachePath, Checksum, RecordWriter
+from gnamed.parsers.taxa import Parser as TaxaParser
+from gnamed.releases import Store
+
+PROCESSES = os.cpu_count() or 1
+"""Default number of worker processes (for all but the fetch stages)."""
+
+TAXDUMP = ('nodes.dmp', 'names.dmp', 'merged.dmp')
+"""The files of the NCBI Taxonomy archive to load, in load order."""
+
+_MODULES = {'swissprot': 'uniprot'}  # parser module names that differ
+_FAST = frozenset({'entrez', 'uniprot'})  # modules with a SpeedLoader
+
+
+def _module(repo_key: str) -> str:
+    return _MODULES.get(repo_key, repo_key)
+
+
+def _conflict(a: str, b: str) -> bool:
+    # two loads conflict unless both are organism-specific repositories of
+    # disjoint species
+    a = SPECIES_SPACES.get(getattr(Namespace, a, None))
+    b = SPECIES_SPACES.get(getattr(Namespace, b, None))
+    return a is None or b is None or not a.isdisjoint(b)
+
+
+class Stage:
+    """
+    A step of a `Build`: calls its `function` with the results of the
+    stages it takes `inputs` from (plus any keyword arguments), once those
+    and the stages it has to run `after` are done.
+    """
+
+    def __init__(self, name: str, function, inputs: tuple=(),
+                 after: tuple=(), **kwds):
+        """
+        :param name: the name of the stage (``KIND`` or ``KIND:KEY``)
+        :param function: a module-level function (to run it in a process)
+        :param inputs: the names of the stages to pass the results of
+        :param after: the names of the other stages to wait for
+        :param kwds: the keyword arguments for the `function`
+        """
+        self.name = name
+        self.function = function
+        self.inputs = tuple(inputs)
+        self.deps = self.inputs + tuple(after)
+        self.kwds = kwds
+        self.result = None
+        self.started = None
+        self.finished = None
+
+    def __repr__(self) -> str:
+        return '<Stage {}>'.format(self.name)
+
+    @property
+    def kind(self) -> str:
+        return self.name.split(':')[0]
+
+    @property
+    def seconds(self) -> float:
+        """The run time of the stage (``None`` if it did not complete)."""
+        if self.finished is None:
+            return None
+
+        return self.finished - self.started
+
+
+class Build:
+    """
+    Fetches, parses and loads a set of repositories into the DB, running
+    independent stages concurrently (see the module documentation).
+    """
+
+    def __init__(self, db_url, *repo_keys: str, directory: str=os.getcwd(),
+                 store: str=None, taxa: bool=True, fast: bool=False,
+                 bulk: bool=False, closure: bool=True,
+                 encoding: str=sys.getdefaultencoding(),
+                 workers: int=WORKERS, processes: int=PROCESSES,
+                 pool_size: int=POOL_SIZE):
+        """
+        :param db_url: the URL of the DB to build
+        :param repo_keys: the repositories to load (by default, all in
+                          `gnamed.constants.LOAD_ORDER` except ``swissprot``)
+        :param directory: the directory for the downloads (unless a `store`
+                          is used) and the parsed-record caches
+        :param store: the directory of a `gnamed.releases.Store` to fetch
+                      into
+        :param taxa: load the NCBI Taxonomy first (into an empty DB)
+        :param fast: use the fast loaders where available
+        :param bulk: drop the indexes and foreign keys while loading
+        :param closure: refresh the mapping closure at the end
+        :param encoding: the encoding of text files
+        :param workers: the number of concurrent downloads per repository
+        :param processes: the number of worker processes
+        :param pool_size: the DB connection pool size of each process
+        :raises ValueError: for repositories that cannot be built
+        """
+        if not repo_keys:
+            repo_keys = tuple(k for k in LOAD_ORDER if k != 'swissprot')
+
+        for key in repo_keys:
+            if key not in LOAD_ORDER:
+                raise ValueError('repository "{}" cannot be built'.format(key))
+
+        if 'uniprot' in repo_keys and 'swissprot' in repo_keys:
+            raise ValueError('uniprot includes swissprot')
+
+        self.db_url = db_url
+        self.repo_keys = sorted(set(repo_keys), key=LOAD_ORDER.index)
+        self.directory = directory
+        self.store = store
+        self.taxa = taxa
+        self.fast = fast
+        self.bulk = bulk
+        self.closure = closure
+        self.encoding = encoding
+        self.workers = workers
+        self.processes = processes
+        self.pool_size = pool_size
+        self.parallel = \
+            make_url(db_url).get_backend_name() == 'postgresql'
+        self.stages = {}
+        self.started = None
+        self.finished = None
+        self._plan()
+
+    def _add(self, stage: Stage):
+        self.stages[stage.name] = stage
+
+    def _plan(self):
+        fetch = dict(directory=self.directory, store=self.store,
+                     encoding=self.encoding, workers=self.workers)
+        first = ()
+
+        if self.taxa:
+            self._add(Stage('fetch:taxa', _fetch, repo_key='taxa', **fetch))
+            self._add(Stage('init', _init, inputs=['fetch:taxa'],
+                            directory=self.directory, encoding=self.encoding))
+            first = ('init',)
+
+        if self.bulk:
+            self._add(Stage('indexes:drop', _dropIndexes, after=first))
+            first = ('indexes:drop',)
+
+        loads = []
+
+        for key in self.repo_keys:
+            self._add(Stage('fetch:' + key, _fetch, repo_key=key, **fetch))
+            self._add(Stage('parse:' + key, _parse, inputs=['fetch:' + key],
+                            repo_key=key, directory=self.directory,
+                            encoding=self.encoding))
+            after = first + tuple(
+                'load:' + other for other in loads
+                if not self.parallel or _conflict(key, other)
+            )
+            self._add(Stage('load:' + key, _load, inputs=['parse:' + key],
+                            after=after, repo_key=key, fast=self.fast))
+            loads.append(key)
+
+        last = tuple('load:' + key for key in loads) or first
+
+        if self.bulk:
+            self._add(Stage('indexes:rebuild', _rebuildIndexes, after=last))
+            last = ('indexes:rebuild',)
+
+        if self.closure:
+            self._add(Stage('closure', _closure, after=last))
+
+    def run(self) -> bool:
+        """
+        Run all stages; return ``True`` if all stages completed.
+
+        If a stage fails, no further stages are started, but the running
+        ones are completed.
+        """
+        self.started = time.time()
+        pending = dict(self.stages)
+        running = {}
+        done = set()
+        failed = False
+        # the forked workers must not share any pooled DB connection
+        CloseDb()
+        threads = ThreadPoolExecutor(max(1, sum(
+            1 for s in self.stages.values() if s.kind == 'fetch'
+        )))
+        processes = ProcessPoolExecutor(
+            self.processes, mp_context=multiprocessing.get_context('fork'),
+            initializer=_initWorker, initargs=(self.db_url, self.pool_size)
+        )
+
+        try:
+            # fork all workers before any fetch thread is started
+            processes.submit(os.getpid).result()
+
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    if failed or not done.issuperset(stage.deps):
+                        continue
+
+                    del pending[name]
+                    executor = threads if stage.kind == 'fetch' else processes
+                    args = [self.stages[i].result for i in stage.inputs]
+                    logging.info('starting %s', name)
+                    running[executor.submit(
+                        _timed, stage.function, *args, **stage.kwds
+                    )] = stage
+
+                if not running:
+                    break
+
+                completed, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in completed:
+                    stage = running.pop(future)
+
+                    try:
+                        stage.started, stage.finished, stage.result = \
+                            future.result()
+                    except Exception as e:
+                        failed = True
+                        logging.warning("%s in stage %s",
+                                        e.__class__.__name__, stage.name)
+
+                        if logging.getLogger().getEffectiveLevel() <= \
+                                logging.INFO:
+                            logging.exception(e)
+                        else:
+                            logging.error(str(e).strip())
+                    else:
+                        done.add(stage.name)
+                        logging.info('%s done in %.1f s', stage.name,
+                                     stage.seconds)
+        finally:
+            threads.shutdown()
+            processes.shutdown()
+            self.finished = time.time()
+
+        return not failed and not pending
+
+    def report(self) -> list:
+        """
+        Return the (name, start offset, seconds) of each completed stage,
+        in the order they started, followed by the total wall-clock time of
+        the build (as the ``build`` "stage").
+        """
+        stages = sorted((s for s in self.stages.values()
+                         if s.finished is not None),
+                        key=lambda s: s.started)
+        rows = [(s.name, s.started - self.started, s.seconds)
+                for s in stages]
+
+        if self.finished is not None:
+            rows.append(('build', 0.0, self.finished - self.started))
+
+        return rows
+
+
+def _timed(function, *args, **kwds) -> tuple:
+    started = time.time()
+    result = function(*args, **kwds)
+    return started, time.time(), result
+
+
+def _initWorker(db_url, pool_size: int):
+    InitDb(db_url, pool_size=pool_size)
+    RelaxDurability()
+
+
+def _fetch(repo_key: str, directory: str, store: str, encoding: str,
+           workers: int) -> dict:
+    # returns the paths, encodings and (if known) checksum of the files
+    if store is not None:
+        releases = Store(store).fetch(repo_key, encoding=encoding,
+                                      workers=workers)
+
+        if releases is None:
+            raise RuntimeError('failed to fetch {}'.format(repo_key))
+
+        release = releases[0]
+        return {'paths': release.paths, 'encodings': release.encodings,
+                'checksum': release.checksum}
+
+    if not Retrieve(repo_key, directory=directory, encoding=encoding,
+                    workers=workers, echo=False):
+        raise RuntimeError('failed to fetch {}'.format(repo_key))
+
+    paths = [os.path.join(directory, filename)
+             for _, filename, _ in REPOSITORIES[repo_key]['resources']]
+    encodings = {path: StoredEncoding(path) for path in paths}
+    return {'paths': paths, 'checksum': None, 'encodings': {
+        path: enc for path, enc in encodings.items() if enc is not None
+    }}
+
+
+def _init(fetched: dict, directory: str, encoding: str):
+    target = os.path.join(directory, 'taxdump')
+    os.makedirs(target, exist_ok=True)
+
+    with tarfile.open(fetched['paths'][0]) as archive:
+        for name in TAXDUMP:
+            archive.extract(name, target)
+
+    if not TaxaParser(*(os.path.join(target, name) for name in TAXDUMP),
+                       encoding=encoding).parse():
+        raise RuntimeError('failed to load the NCBI Taxonomy')
+
+
+def _loader(module: str, name: str):
+    return getattr(__import__('gnamed.parsers.' + module, globals(),
+                              fromlist=[name]), name)
+
+
+def _parse(fetched: dict, repo_key: str, directory: str,
+           encoding: str) -> str:
+    # returns the path of the parsed-record cache
+    module = _module(repo_key)
+    checksum = fetched['checksum'] or Checksum(*fetched['paths'])
+    path = CachePath(directory, module, checksum)
+
+    if os.path.exists(path):
+        logging.info('%s is parsed already (%s)', repo_key, path)
+        return path
+
+    parser = _loader(module, 'Parser')(*fetched['paths'], encoding=encoding)
+    parser.encodings = fetched['encodings']
+    parser.closure = False
+
+    with RecordWriter(path, checksum) as parser.cache:
+        if not parser.parse():
+            raise RuntimeError('failed to parse {}'.format(repo_key))
+
+    return path
+
+
+def _load(cache: str, repo_key: str, fast: bool):
+    module = _module(repo_key)
+    loader = _loader(module, 'SpeedLoader' if fast and module in _FAST
+                     else 'Parser')()
+    loader.parsed = [cache]
+    loader.closure = False
+
+    if not loader.parse():
+        raise RuntimeError('failed to load {}'.format(repo_key))
+
+
+def _dropIndexes():
+    IndexManager().drop()
+
+
+def _rebuildIndexes():
+    IndexManager().rebuild()
+
+
+def _closure():
+    RefreshClosure()
@@ -15,8 +15,9 @@ REPOSITORIES = {
     'entrez': {
         'url': 'ftp://ftp.ncbi.nih.gov/gene/DATA/',
         'resources': [
-            ('gene_info.gz', 'gene_info.gz', None),
+            # in load order: the PMIDs are collected before the records
             ('gene2pubmed.gz', 'gene2pubmed.gz', None),
+            ('gene_info.gz', 'gene_info.gz', None),
         ],
         'description': "NCBI Entrez Gene gene2pubmed and gene_info file",
         },
@@ -87,6 +88,12 @@ REPOSITORIES = {
     }
 }
 
+# the order in which to load the repositories that have a parser: the last
+# repository loaded sets the metadata (chromosome, location, length, mass)
+# of an entity, so the generic repositories go first (see gnamed.build)
+LOAD_ORDER = ('entrez', 'uniprot', 'swissprot', 'hgnc', 'mgi', 'rgd', 'sgd',
+              'tair')
+
 
 class Namespace:
     # general DBs
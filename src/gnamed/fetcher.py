@@ -2,59 +2,711 @@
 .. py:module:: gnamed.fetcher
    :synopsis: Functions to download repository files.
 
+Downloads run concurrently (see `Retrieve`), are retried after errors, and
+resume interrupted transfers where they stopped (HTTP ``Range`` requests or
+FTP ``REST``). The validators of every download (ETag, Last-Modified or
+``MDTM`` time, and size) are kept in a `Manifest` in the download directory,
+so files that have not changed since the last download are skipped.
+
+Text files are transcoded in large blocks after their download, or stored
+with their original encoding (recorded in the manifest, see
+`StoredEncoding`) to be decoded by the parsers instead.
+
 .. moduleauthor:: Florian Leitner <florian.leitner@gmail.com>
 .. License: GNU GPL v3 (http://www.gnu.org/licenses/gpl.html)
 """
+import codecs
+import ftplib
+import gzip
+import io
+import json
 import logging
 import os
+import queue
 import re
 import sys
+import threading
+import time
 
-from urllib.request import urlopen, urlretrieve
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.error import HTTPError
+from urllib.parse import unquote, urlsplit
+from urllib.request import Request, urlopen
 
 from gnamed.constants import REPOSITORIES
 
+WORKERS = 4
+"""Default number of concurrent downloads."""
+
+RETRIES = 3
+"""Number of times a failed download is resumed (or restarted)."""
+
+BACKOFF = 5
+"""Seconds to wait before the first retry; doubled with every retry."""
+
+TIMEOUT = 60
+"""Socket timeout (in seconds) of all connections."""
+
+CHUNK = 1 << 20
+"""Number of bytes to read (and write) at a time."""
+
+PARTIAL = '.part'
+"""File name extension of incomplete downloads."""
+
+BUFFERS = 64
+"""
+Number of chunks a `RemoteFile` stream buffers ahead of its reader, so
+that the download and the parsing of the stream overlap.
+"""
+
+
+class Manifest:
+    """
+    The validators of all files downloaded into a directory, stored as a
+    JSON file in that directory.
+
+    Each entry holds the URL, ETag, modification time and size of a file as
+    reported by the server, and whether the download is complete; entries
+    of incomplete downloads are used to resume them. Updates are
+    thread-safe and written to disk immediately; as they are merged with
+    the file on disk, several manifests of the same directory can be used
+    concurrently (e.g., by parallel fetches of different repositories).
+    """
+
+    FILENAME = '.gnamed-manifest.json'
+    """The name of the manifest file."""
+
+    _lock = threading.Lock()
+
+    def __init__(self, directory: str):
+        """
+        :param directory: the download directory
+        """
+        self.path = os.path.join(directory, Manifest.FILENAME)
+
+        with self._lock:
+            self._load()
+
+    def get(self, filename: str) -> dict:
+        """
+        Return (a copy of) the entry for `filename` (empty if none).
+        """
+        with self._lock:
+            return dict(self._entries.get(filename, {}))
+
+    def update(self, filename: str, **entry):
+        """
+        Set the given values of the entry for `filename` and save the
+        manifest.
+        """
+        with self._lock:
+            self._load()
+            self._entries.setdefault(filename, {}).update(entry)
+            self._save()
+
+    def discard(self, filename: str):
+        """
+        Drop the entry for `filename` (e.g., to force a new download).
+        """
+        with self._lock:
+            self._load()
+
+            if self._entries.pop(filename, None) is not None:
+                self._save()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as stream:
+                self._entries = json.load(stream)
+        except FileNotFoundError:
+            self._entries = {}
+
+    def _save(self):
+        tmp = '{}.tmp{}'.format(self.path, os.getpid())
+
+        with open(tmp, 'w', encoding='utf-8') as stream:
+            json.dump(self._entries, stream, indent=1, sort_keys=True)
+
+        os.replace(tmp, self.path)
+
 
 def Retrieve(*repo_keys: str, directory: str=os.getcwd(),
-             encoding: str=sys.getdefaultencoding()):
+             encoding: str=sys.getdefaultencoding(), workers: int=WORKERS,
+             force: bool=False, transcode: bool=True,
+             echo: bool=True) -> bool:
     """
+    Download the files of the given repositories, `workers` files at a time;
+    return ``True`` if all files were retrieved.
+
+    Files that have not changed since their last download are skipped
+    (unless `force` is set). The path of each retrieved (or unchanged) file
+    is printed to STDOUT as soon as it is available (if `echo` is set).
+
     :param repo_keys: keys of the repositories to download
     :param directory: target directory to store the downloaded files
     :param encoding: encoding to use for text files
+    :param workers: the number of concurrent downloads
+    :param force: download all files, even if unchanged
+    :param transcode: transcode text files to the `encoding` (otherwise,
+                      they keep their original encoding)
+    :param echo: print the path of each retrieved file
     """
+    manifest = Manifest(directory)
+    downloads = {}
+
     for db in repo_keys:
-        logging.info('downloading files for "%s"', db)
         repo = REPOSITORIES[db]
-        url = repo['url']
 
         for path, filename, remote_enc in repo['resources']:
-            logging.debug("connecting to '%s%s'", url, path)
-            logging.info("streaming into '%s' (%s)",
-                         os.path.join(directory, filename), encoding)
+            # resources shared by several repositories are fetched once
+            downloads[filename] = (repo['url'] + path, remote_enc)
+
+    success = True
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+
+        for filename, (url, remote_enc) in downloads.items():
+            if force:
+                manifest.discard(filename)
+
+            target = os.path.join(directory, filename)
+            futures[executor.submit(
+                Download, url, target, manifest=manifest,
+                remote_enc=remote_enc, encoding=encoding,
+                transcode=transcode
+            )] = (url, target)
+
+        for future in as_completed(futures):
+            url, target = futures[future]
+
+            try:
+                future.result()
+            except Exception as e:
+                success = False
+                logging.warning("%s while downloading %s",
+                                e.__class__.__name__, url)
+
+                if logging.getLogger().getEffectiveLevel() <= logging.INFO:
+                    logging.exception(e)
+                else:
+                    logging.error(str(e).strip())
+            else:
+                if echo:
+                    print(target, file=sys.stdout)
+
+    return success
+
+
+def Download(url: str, target: str, manifest: Manifest=None,
+             remote_enc: str=None, encoding: str=sys.getdefaultencoding(),
+             retries: int=RETRIES, transcode: bool=True) -> bool:
+    """
+    Download the file at `url` (``http``, ``https`` or ``ftp``) to the
+    `target` path; return ``False`` if the file has not changed since its
+    last download (according to the `manifest`).
+
+    The file is first downloaded to a ``.part`` file. Should the transfer
+    fail, it is resumed `retries` times (after a growing delay); as long as
+    the `manifest` has the validators of the partial download, even a later
+    call resumes it. Text files (with a `remote_enc`) are transcoded to the
+    `encoding` once the download is complete, unless `transcode` is unset.
+    The encoding a text file is stored with is recorded in the `manifest`.
+
+    :param url: the URL of the file
+    :param target: the path to store the file at
+    :param manifest: the `Manifest` of the target directory
+    :param remote_enc: the encoding of a remote text file
+    :param encoding: the encoding to store a text file with
+    :param retries: the number of times to retry a failed download
+    :param transcode: transcode a text file to the `encoding`
+    """
+    if manifest is None:
+        manifest = Manifest(os.path.dirname(target) or os.curdir)
+
+    filename = os.path.basename(target)
+    partial = target + PARTIAL
+    scheme = urlsplit(url).scheme
+    fetch = _ftpFetch if scheme == 'ftp' else _httpFetch
+    attempt = 0
+
+    while True:
+        entry = manifest.get(filename)
+
+        if entry.get('url') != url:
+            entry = {}
+
+        try:
+            logging.debug("connecting to '%s'", url)
+
+            if not fetch(url, target, partial, entry, manifest, filename):
+                logging.info("'%s' is unchanged", target)
+                return False
+
+            break
+        except (OSError, EOFError, ftplib.Error) as e:
+            if isinstance(e, HTTPError) and e.code < 500:
+                raise
+
+            if attempt == retries:
+                raise
+
+            delay = BACKOFF * 2 ** attempt
+            attempt += 1
+            logging.warning("%s while downloading %s (%s); retrying in %ss",
+                            e.__class__.__name__, url, str(e).strip(), delay)
+            time.sleep(delay)
+
+    entry = manifest.get(filename)
+
+    if remote_enc is not None:
+        if entry.get('charset') and entry['charset'] != remote_enc:
+            remote_enc = entry['charset']
+            logging.warning("remote encoding at %s is %s", url, remote_enc)
+
+        if transcode and \
+                codecs.lookup(remote_enc).name != codecs.lookup(encoding).name:
+            logging.info("transcoding into '%s' (%s)", target, encoding)
+            # never write into the old target: it might be linked elsewhere
+            tmp = '{}.tmp{}'.format(target, os.getpid())
+            _transcode(partial, tmp, remote_enc, encoding)
+            os.replace(tmp, target)
+            os.remove(partial)
+        else:
+            os.replace(partial, target)
+            encoding = remote_enc
+
+        manifest.update(filename, complete=True, encoding=encoding)
+    else:
+        os.replace(partial, target)
+        manifest.update(filename, complete=True)
+
+    return True
+
+
+def StoredEncoding(path: str) -> str:
+    """
+    Return the encoding of the text file at `path` as recorded by the
+    `Manifest` in its directory when the file was downloaded, or ``None``
+    if unknown.
+    """
+    directory, filename = os.path.split(os.path.abspath(path))
+    return Manifest(directory).get(filename).get('encoding')
+
+
+def _transcode(source: str, target: str, source_enc: str, target_enc: str):
+    # transcode in blocks; the incremental decoder keeps any character
+    # split across two blocks until the next block completes it
+    decoder = codecs.getincrementaldecoder(source_enc)()
+    encoder = codecs.getincrementalencoder(target_enc)()
+
+    with open(source, 'rb') as stream, open(target, 'wb') as output:
+        for data in iter(lambda: stream.read(CHUNK), b''):
+            output.write(encoder.encode(decoder.decode(data)))
+
+        output.write(encoder.encode(decoder.decode(b'', final=True),
+                                    final=True))
+
+
+class RemoteFile:
+    """
+    A repository file that is streamed into a parser instead of being
+    downloaded first (see ``gnamed sync``).
+
+    `open` returns a text stream that a background thread fills with the
+    downloaded data (resuming the transfer after errors, as `Download`
+    does); gzip-compressed files are decompressed on the fly. As `name`,
+    the stream uses the name the (uncompressed) file would have on disk, so
+    parsers can tell the files of a repository apart. If an `archive`
+    directory is given, the downloaded (compressed) data is also stored
+    there, just as `Retrieve` would have.
+    """
+
+    def __init__(self, url: str, filename: str, remote_enc: str=None,
+                 archive: str=None):
+        """
+        :param url: the URL of the file
+        :param filename: the file name of the download
+        :param remote_enc: the encoding of a remote text file
+        :param archive: a directory to store the downloaded data in
+        """
+        self.url = url
+        self.filename = filename
+        self.remote_enc = remote_enc
+        self.archive = archive
+        self.compressed = filename.endswith('.gz')
+        self.name = filename[:-3] if self.compressed else filename
+
+    def __repr__(self) -> str:
+        return '<RemoteFile {}>'.format(self.url)
+
+    def open(self, encoding: str=sys.getdefaultencoding()) -> io.TextIOBase:
+        """
+        Start streaming the file and return a text stream of its content.
+
+        :param encoding: the encoding to decode files without a
+                         `remote_enc` with
+        """
+        logging.info("streaming '%s' from %s", self.name, self.url)
+        pipe = _Pipe(self.url, self.name, self.archive and os.path.join(
+            self.archive, self.filename
+        ), self.remote_enc)
+
+        if self.compressed:
+            binary = gzip.GzipFile(fileobj=pipe, mode='rb')
+        else:
+            binary = io.BufferedReader(pipe, CHUNK)
 
-            if remote_enc is not None:
-                stream = urlopen(url + path)
-                info = stream.info()
+        return io.TextIOWrapper(binary, encoding=self.remote_enc or encoding)
 
-                if 'content-type' in info and\
-                   'charset' in info['content-type']:
-                    mo = re.search('charset\s*=\s*(.*?)\s*$',
-                                   info['content-type'])
 
-                    if remote_enc != mo.group(1):
-                        remote_enc = mo.group(1)
-                        logging.warn("remote encoding at %s is %s",
-                                     url + path, remote_enc)
+def RemoteFiles(repo_key: str, archive: str=None) -> list:
+    """
+    Return the `RemoteFile` of each resource of a repository.
+
+    :param repo_key: the key of the repository
+    :param archive: a directory to also store the downloaded files in
+    """
+    repo = REPOSITORIES[repo_key]
+    return [RemoteFile(repo['url'] + path, filename, remote_enc, archive)
+            for path, filename, remote_enc in repo['resources']]
+
+
+class _Pipe(io.RawIOBase):
+    """
+    A read-only, raw binary stream of a download that a background thread
+    fills (up to `BUFFERS` chunks ahead).
+    """
+
+    def __init__(self, url: str, name: str, archive: str=None,
+                 encoding: str=None):
+        super(_Pipe, self).__init__()
+        self.url = url
+        self.name = name
+        self.archive = archive
+        self.encoding = encoding
+        self._queue = queue.Queue(BUFFERS)
+        self._stop = threading.Event()
+        self._chunk = b''
+        self._eof = False
+        self._thread = threading.Thread(target=self._pump, daemon=True)
+        self._thread.start()
 
-                output = open(os.path.join(directory, filename), mode='w',
-                              encoding=encoding)
+    def readable(self) -> bool:
+        return True
 
-                for data in stream:
-                    output.write(data.decode(remote_enc))
+    def readinto(self, buffer) -> int:
+        while not self._chunk and not self._eof:
+            item = self._queue.get()
 
-                output.close()
-                stream.close()
+            if item is None:
+                self._eof = True
+            elif isinstance(item, Exception):
+                self._eof = True
+                raise item
             else:
-                urlretrieve(url + path, os.path.join(directory, filename))
+                self._chunk = item
+
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+
+            # unblock the pump, should it wait for the queue
+            while self._thread.is_alive():
+                try:
+                    self._queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+        super(_Pipe, self).close()
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def _pump(self):
+        offset = 0
+        attempt = 0
+        validators = {}
+        tee = None
+
+        try:
+            if self.archive is not None:
+                tee = open(self.archive + PARTIAL, 'wb')
+
+            while True:
+                try:
+                    source, close = _openStream(self.url, offset, validators)
+
+                    try:
+                        for data in iter(lambda: source.read(CHUNK), b''):
+                            if tee is not None:
+                                tee.write(data)
+
+                            if not self._put(data):
+                                return
+
+                            offset += len(data)
+                    finally:
+                        close()
+
+                    break
+                except (OSError, EOFError, ftplib.Error) as e:
+                    if isinstance(e, HTTPError) and e.code < 500 or \
+                            attempt == RETRIES:
+                        raise
+
+                    delay = BACKOFF * 2 ** attempt
+                    attempt += 1
+                    logging.warning("%s while streaming %s (%s); resuming "
+                                    "in %ss", e.__class__.__name__, self.url,
+                                    str(e).strip(), delay)
+                    time.sleep(delay)
+
+            if tee is not None:
+                tee.close()
+                tee = None
+                os.replace(self.archive + PARTIAL, self.archive)
+                Manifest(os.path.dirname(self.archive) or os.curdir).update(
+                    os.path.basename(self.archive), url=self.url,
+                    complete=True, size=offset, encoding=self.encoding,
+                    **validators
+                )
+
+            self._put(None)
+        except Exception as e:
+            self._put(e)
+        finally:
+            if tee is not None:
+                tee.close()
+
+
+def _openStream(url: str, offset: int, validators: dict) -> tuple:
+    # open the file at `url` after `offset` bytes and return the binary
+    # stream and a function to close the connection; the first call sets
+    # the `validators`, which later calls use to ensure they resume the
+    # same file
+    if urlsplit(url).scheme == 'ftp':
+        ftp, path = _ftpConnect(url)
+
+        try:
+            if not validators:
+                validators['etag'] = None
+                validators['modified'] = _mdtm(ftp, path)
+
+            connection = ftp.transfercmd('RETR ' + path, rest=offset or None)
+        except Exception:
+            ftp.close()
+            raise
+
+        stream = connection.makefile('rb')
+
+        def close():
+            stream.close()
+            connection.close()
+
+            try:
+                ftp.voidresp()
+                ftp.quit()
+            except (OSError, EOFError, ftplib.Error):
+                ftp.close()
+
+        return stream, close
+
+    headers = {}
+
+    if offset:
+        headers['Range'] = 'bytes={}-'.format(offset)
+
+        if validators.get('etag') or validators.get('modified'):
+            headers['If-Range'] = validators['etag'] or validators['modified']
+
+    stream = urlopen(Request(url, headers=headers), timeout=TIMEOUT)
+
+    if offset and stream.status != 206:
+        stream.close()
+        raise RuntimeError('cannot resume streaming {}'.format(url))
+    elif not validators:
+        validators['etag'] = stream.info().get('ETag')
+        validators['modified'] = stream.info().get('Last-Modified')
+
+    return stream, stream.close
+
+
+def _ftpConnect(url: str) -> tuple:
+    # return a logged-in FTP connection (in binary mode) and the path of
+    # the file at `url`
+    parts = urlsplit(url)
+    ftp = ftplib.FTP(timeout=TIMEOUT)
+    ftp.connect(parts.hostname, parts.port or ftplib.FTP_PORT)
+
+    try:
+        ftp.login(unquote(parts.username or 'anonymous'),
+                  unquote(parts.password or 'anonymous@'))
+        ftp.voidcmd('TYPE I')
+    except Exception:
+        ftp.close()
+        raise
+
+    return ftp, unquote(parts.path)
+
+
+def _mdtm(ftp: ftplib.FTP, path: str) -> str:
+    try:
+        return ftp.voidcmd('MDTM ' + path)[4:].strip()
+    except ftplib.error_perm:
+        return None
+
+
+class _StalePartial(OSError):
+    # the server rejected the range of a partial download, which was
+    # dropped; the download can be restarted
+    pass
+
+
+def _resumable(entry: dict, partial: str, validators: dict) -> int:
+    # the number of bytes to resume the partial download with, if its
+    # validators still match
+    if entry and not entry.get('complete') and os.path.exists(partial) and \
+            any(validators.values()) and \
+            all(entry.get(k) == v for k, v in validators.items()):
+        size = os.path.getsize(partial)
+
+        if entry.get('size') is None or size <= entry['size']:
+            return size
+
+    return 0
+
+
+def _unchanged(entry: dict, target: str, validators: dict) -> bool:
+    return bool(entry.get('complete') and os.path.exists(target) and
+                any(validators.values()) and
+                all(entry.get(k) == v for k, v in validators.items()))
+
+
+def _httpFetch(url: str, target: str, partial: str, entry: dict,
+               manifest: Manifest, filename: str) -> bool:
+    headers = {}
+    validators = {'etag': entry.get('etag'), 'modified': entry.get('modified')}
+    offset = 0
+
+    if entry.get('complete') and os.path.exists(target):
+        if validators['etag']:
+            headers['If-None-Match'] = validators['etag']
+
+        if validators['modified']:
+            headers['If-Modified-Since'] = validators['modified']
+    else:
+        offset = _resumable(entry, partial, validators)
+
+        if offset:
+            headers['Range'] = 'bytes={}-'.format(offset)
+            headers['If-Range'] = validators['etag'] or validators['modified']
+
+    try:
+        stream = urlopen(Request(url, headers=headers), timeout=TIMEOUT)
+    except HTTPError as e:
+        if e.code == 304:
+            return False
+        elif e.code == 416 and offset:
+            # the partial file is no longer valid; start over
+            os.remove(partial)
+            manifest.update(filename, complete=False, etag=None,
+                            modified=None)
+            raise _StalePartial('cannot resume {} after {} bytes'.format(
+                partial, offset
+            )) from e
+
+        raise
+
+    try:
+        info = stream.info()
+
+        if stream.status != 206:
+            offset = 0
+
+        size = info.get('Content-Length')
+        charset = None
+
+        if 'content-type' in info and 'charset' in info['content-type']:
+            mo = re.search(r'charset\s*=\s*(.*?)\s*$', info['content-type'])
+            charset = mo.group(1)
+
+        manifest.update(filename, url=url, complete=False,
+                        etag=info.get('ETag'),
+                        modified=info.get('Last-Modified'),
+                        size=None if size is None else int(size) + offset,
+                        charset=charset or entry.get('charset'))
+
+        if offset:
+            logging.info("resuming '%s' after %s bytes", partial, offset)
+        else:
+            logging.info("streaming into '%s'", partial)
+
+        with open(partial, 'ab' if offset else 'wb') as output:
+            for data in iter(lambda: stream.read(CHUNK), b''):
+                output.write(data)
+    finally:
+        stream.close()
+
+    _checkSize(partial, manifest.get(filename).get('size'))
+    return True
+
+
+def _ftpFetch(url: str, target: str, partial: str, entry: dict,
+              manifest: Manifest, filename: str) -> bool:
+    ftp, path = _ftpConnect(url)
+
+    try:
+        try:
+            size = ftp.size(path)
+        except ftplib.error_perm:
+            size = None
+
+        modified = _mdtm(ftp, path)
+        validators = {'size': size, 'modified': modified}
+
+        if _unchanged(entry, target, validators):
+            return False
+
+        offset = _resumable(entry, partial, validators)
+        manifest.update(filename, url=url, complete=False, etag=None,
+                        modified=modified, size=size)
+
+        if offset:
+            logging.info("resuming '%s' after %s bytes", partial, offset)
+        else:
+            logging.info("streaming into '%s'", partial)
+
+        if offset and offset == size:
+            logging.info("'%s' is complete", partial)
+        else:
+            with open(partial, 'ab' if offset else 'wb') as output:
+                ftp.retrbinary('RETR ' + path, output.write,
+                               blocksize=CHUNK, rest=offset or None)
+    finally:
+        try:
+            ftp.quit()
+        except (OSError, EOFError, ftplib.Error):
+            ftp.close()
+
+    _checkSize(partial, size)
+    return True
+
 
-            print(os.path.join(directory, filename), file=sys.stdout)
+def _checkSize(partial: str, size: int):
+    if size is not None and os.path.getsize(partial) != size:
+        raise EOFError('{} has {} of {} bytes'.format(
+            partial, os.path.getsize(partial), size
+        ))
@@ -5,18 +5,24 @@
 .. moduleauthor:: Florian Leitner <florian.leitner@gmail.com>
 .. License: GNU GPL v3 (http://www.gnu.org/licenses/gpl.html)
 """
+import io
 import logging
 
+from array import array
 from collections import defaultdict, namedtuple
 from gnamed.constants import GENE_SPACES, PROTEIN_SPACES, SPECIES_SPACES, \
     Namespace
-from sqlalchemy.orm import joinedload
-from sqlalchemy.sql.expression import and_
-from sys import getdefaultencoding
+from sqlalchemy import event
+from sqlalchemy.orm.attributes import get_history
+from sqlalchemy.sql.expression import and_, select
+from sys import getdefaultencoding, intern
+from time import perf_counter
 
 from gnamed.orm import \
     Gene, Protein, GeneRef, ProteinRef, GeneString, ProteinString, \
-    mapping, Gene2PubMed, Protein2PubMed
+    mapping, Gene2PubMed, Protein2PubMed, IdAllocator, IndexManager, \
+    InsertIgnore, InternStrings, LoadCheckpoint, LoadLock, RefLookup, \
+    RefreshClosure, Session
 from gnamed.parsers import AbstractParser
 
 DBRef = namedtuple('DBRef', ['namespace', 'accession'])
@@ -32,19 +38,32 @@ class AbstractRecord:
 
     This representation is used by the Parsers' loadRecord methods to add any
     relevant, novel data to the DB.
+
+    To keep the many records that some parsers hold in memory small, records
+    use slots, intern the string categories, and collect strings and PMIDs
+    in flat lists that are only deduplicated on `finalize`. The collections
+    are exposed as (new) frozen sets; use the ``add...`` methods to modify
+    them. `toTuple` and `fromTuple` provide a compact, marshal-able
+    representation that is also used for pickling.
     """
 
+    __slots__ = ('species_id', 'symbol', 'name',
+                 '_strings', '_refs', '_mappings', '_pmids')
+
+    _EXTRA = ()
+    """Names of the additional (metadata) attributes of a record type."""
+
     def __init__(self, species_id: int, symbol: str=None, name: str=None):
         """
         Initialize a new record with the species ID, the official symbol and
         name of that gene/protein as found in the originating DB.
 
-        Add additional `symbols` and `names` as strings after initialization
-        to these corresponding sets.
+        Add additional symbols and names as strings after initialization
+        using the corresponding ``add...`` methods.
 
-        The set of `links` is a collection of (namespace, accession)
-        tuples. Add `links` to other records in other namespaces after
-        initialization using the `Record.addLink` method.
+        The set of `refs` and `mappings` is a collection of (namespace,
+        accession) tuples. Add these links to other records using the
+        `Record.addDBRef` method.
 
         Note that, while proteins have lengths and masses and genes have
         locations and chromosomes, this data is handled directly in the parsers
@@ -53,10 +72,10 @@ class AbstractRecord:
         self.species_id = int(species_id)
         self.symbol = symbol
         self.name = name
-        self.strings = defaultdict(set)
-        self.refs = set()
-        self.mappings = set()
-        self.pmids = set()
+        self._strings = []  # flat list of category, value pairs
+        self._refs = []
+        self._mappings = []
+        self._pmids = array('i')
 
         if symbol:
             self.addSymbol(symbol)
@@ -69,24 +88,120 @@ class AbstractRecord:
             self.species_id, self.symbol, self.name
         )
 
+    def __reduce__(self):
+        return self.__class__.fromTuple, (self.toTuple(),)
+
+    @property
+    def strings(self) -> dict:
+        """
+        A dictionary of the (frozen) sets of string values by category.
+        """
+        strings = defaultdict(set)
+        values = iter(self._strings)
+
+        for cat, value in zip(values, values):
+            strings[cat].add(value)
+
+        return {cat: frozenset(values) for cat, values in strings.items()}
+
+    @property
+    def refs(self) -> frozenset:
+        return frozenset(self._refs)
+
+    @refs.setter
+    def refs(self, db_refs):
+        self._refs = list(db_refs)
+
+    @property
+    def mappings(self) -> frozenset:
+        return frozenset(self._mappings)
+
+    @mappings.setter
+    def mappings(self, db_refs):
+        self._mappings = list(db_refs)
+
+    @property
+    def pmids(self) -> frozenset:
+        return frozenset(self._pmids)
+
+    @pmids.setter
+    def pmids(self, pmids):
+        self._pmids = array('i', pmids)
+
     #noinspection PyUnusedLocal
     def addDBRef(self, db_ref: DBRef):
         raise NotImplementedError('abstract')
 
     def addKeyword(self, keyword: str):
-        self.strings['keyword'].add(keyword)
+        self._strings.extend(('keyword', keyword))
 
     def addName(self, name: str):
-        self.strings['name'].add(name)
+        self._strings.extend(('name', name))
 
     def addSymbol(self, symbol: str):
-        self.strings['symbol'].add(symbol)
+        self._strings.extend(('symbol', symbol))
 
     def addString(self, cat: str, value: str):
-        self.strings[cat].add(value)
+        self._strings.extend((intern(cat), value))
 
     def addPubMedId(self, pmid: int):
-        self.pmids.add(pmid)
+        self._pmids.append(pmid)
+
+    def finalize(self):
+        """
+        Remove any duplicate strings and PMIDs.
+        """
+        seen = set()
+        strings = []
+        values = iter(self._strings)
+
+        for pair in zip(values, values):
+            if pair not in seen:
+                seen.add(pair)
+                strings.extend(pair)
+
+        self._strings = strings
+        self._pmids = array('i', sorted(set(self._pmids)))
+
+    def toTuple(self) -> tuple:
+        """
+        Return the (finalized) record as a tuple of only strings, integers,
+        and tuples of those (i.e., marshal-able).
+        """
+        self.finalize()
+        return (self.species_id, self.symbol, self.name) + tuple(
+            getattr(self, attr) for attr in self._EXTRA
+        ) + (tuple(self._strings), tuple(i for r in self._refs for i in r),
+             tuple(i for r in self._mappings for i in r),
+             tuple(self._pmids))
+
+    @classmethod
+    def fromTuple(cls, data: tuple):
+        """
+        Create a record from the tuple returned by `toTuple`.
+        """
+        record = cls.__new__(cls)
+        record.species_id, record.symbol, record.name = data[:3]
+        extra = len(cls._EXTRA) + 3
+
+        for attr, value in zip(cls._EXTRA, data[3:extra]):
+            setattr(record, attr, value)
+
+        strings, refs, mappings, pmids = data[extra:]
+        record._strings = list(strings)
+        refs, mappings = iter(refs), iter(mappings)
+        record._refs = [DBRef(*r) for r in zip(refs, refs)]
+        record._mappings = [DBRef(*r) for r in zip(mappings, mappings)]
+        record._pmids = array('i', pmids)
+        return record
+
+    def _addRef(self, db_ref: DBRef):
+        if db_ref not in self._refs:
+            self._refs.append(db_ref)
+
+    def _addMapping(self, db_ref: DBRef):
+        if db_ref not in self._mappings:
+            self._mappings.append(db_ref)
 
     def _sameSpecies(self, db_ref: DBRef) -> bool:
         ns_species = SPECIES_SPACES[db_ref.namespace]
@@ -103,13 +218,18 @@ class AbstractRecord:
 
     def _checkSpecies(self, db_ref: DBRef):
         if self.species_id not in SPECIES_SPACES[db_ref.namespace]:
-            refs = ', '.join('{}:{}'.format(*key) for key in self.refs)
+            refs = ', '.join('{}:{}'.format(*key) for key in self._refs)
             logging.debug('cross-species mapping for %s:%s to [%s] species:%s',
                           db_ref.namespace, db_ref.accession, refs,
                           self.species_id)
 
 
 class GeneRecord(AbstractRecord):
+
+    __slots__ = ('chromosome', 'location')
+
+    _EXTRA = __slots__
+
     def __init__(self, species_id: int, symbol: str=None, name: str=None,
                  chromosome: str=None, location: str=None):
         super(GeneRecord, self).__init__(species_id, symbol=symbol, name=name)
@@ -120,15 +240,20 @@ class GeneRecord(AbstractRecord):
         if db_ref.namespace in GENE_SPACES:
             if db_ref.namespace == Namespace.entrez or \
                     self._sameSpecies(db_ref):
-                self.refs.add(db_ref)
+                self._addRef(db_ref)
         else:
             if db_ref.namespace != Namespace.uniprot:
                 self._checkSpecies(db_ref)
 
-            self.mappings.add(db_ref)
+            self._addMapping(db_ref)
 
 
 class ProteinRecord(AbstractRecord):
+
+    __slots__ = ('length', 'mass')
+
+    _EXTRA = __slots__
+
     def __init__(self, species_id: int, symbol: str=None, name: str=None,
                  length: int=None, mass: int=None):
         super(ProteinRecord, self).__init__(species_id,
@@ -140,19 +265,71 @@ class ProteinRecord(AbstractRecord):
         if db_ref.namespace in PROTEIN_SPACES:
             if db_ref.namespace == Namespace.uniprot or \
                     self._sameSpecies(db_ref):
-                self.refs.add(db_ref)
+                self._addRef(db_ref)
         else:
             if db_ref.namespace != Namespace.entrez:
                 self._checkSpecies(db_ref)
 
-            self.mappings.add(db_ref)
+            self._addMapping(db_ref)
 
 
 class AbstractLoader(AbstractParser):
     """
     Database loading functionality common to both gene and protein entities.
+
+    Keeps track of the IDs of all entities that were modified while loading,
+    to (incrementally) refresh the mapping closure table after parsing.
+
+    Parsers hand their records to `_storeRecord`, which writes them to the
+    `cache` (a `gnamed.parsed.RecordWriter`), if set, or loads them with
+    `_loadParsed`. If `parsed` is set to a list of cache files, `parse`
+    loads the records from these caches instead of parsing the `files`.
+
+    In `tolerant` mode, the records of each batch (of `flush` records) are
+    loaded inside a savepoint. If the batch fails, the savepoint is rolled
+    back and the batch is replayed one record at a time, so only the
+    records that fail are rejected.
+    """
+
+    CLOSURE = True
+    """
+    Default setting whether to refresh the mapping closure after parsing.
+
+    Can be configured per instance via the `closure` boolean attribute.
+    """
+
+    BULK = False
+    """
+    Default setting whether to drop the secondary indexes and foreign keys
+    before parsing and to rebuild them afterwards (see `IndexManager`).
+
+    Can be configured per instance via the `bulk` boolean attribute.
     """
 
+    DIRTY = 1000000
+    """
+    Maximum number of modified entities (per kind) tracked for an
+    incremental refresh of the mapping closure; if more entities are
+    modified, the entire closure is rebuilt instead.
+    """
+
+    MAPPING_BATCH = 1000
+    """
+    Number of references or entity IDs to look up at a time when resolving
+    the gene-protein mappings of the loaded records.
+    """
+
+    NAMESPACE = None
+    """
+    The namespace of the repository a loader loads, which scopes its
+    `LoadLock`; ``None`` locks the entire DB.
+    """
+
+    TABLES = {
+        'gene': (GeneString.__table__, Gene2PubMed.__table__),
+        'protein': (ProteinString.__table__, Protein2PubMed.__table__),
+    }
+
     def __init__(self, *files: str, encoding: str=getdefaultencoding()):
         """
         :param files: any number of files (pathnames) to load
@@ -160,14 +337,436 @@ class AbstractLoader(AbstractParser):
         """
         super(AbstractLoader, self).__init__(*files, encoding=encoding)
         self.db_refs = {}
+        self.closure = AbstractLoader.CLOSURE
+        self.bulk = AbstractLoader.BULK
+        self.dirty = {'gene': set(), 'protein': set()}
+        self.ids = {'gene': IdAllocator(Gene), 'protein': IdAllocator(Protein)}
+        self.lookups = {'gene': RefLookup(Gene, GeneRef),
+                        'protein': RefLookup(Protein, ProteinRef)}
+        self._mappings = set()
+        self._strings = {'gene': set(), 'protein': set()}
+        self._pmids = {'gene': set(), 'protein': set()}
+        self._batch = []
+        self._savepoint = None
+        self._loading = False
+        self.cache = None
+        self.parsed = None
+
+    def parse(self) -> bool:
+        """
+        Parse and load all files (or the `parsed` record caches), then
+        refresh the mapping closure; return ``True`` if all files were
+        loaded.
+
+        In `bulk` mode, the secondary indexes and foreign keys are dropped
+        before parsing and rebuilt before refreshing the closure.
+
+        The entire load holds a `LoadLock` for the `NAMESPACE` (or the
+        whole DB, in `bulk` mode), so concurrent loaders of the same species
+        wait for each other.
+        """
+        if self.cache is not None:
+            # parsing into a cache does not write to the DB
+            return self._load()
+
+        lock = LoadLock(self.name, self.NAMESPACE, exclusive=self.bulk)
+        lock.acquire()
+        success = False
+
+        try:
+            success = self._load()
+        finally:
+            lock.release(success)
+
+        return success
+
+    def _load(self) -> bool:
+        if self.parsed is not None:
+            load = self._loadCaches
+        else:
+            load = super(AbstractLoader, self).parse
+
+        if self.bulk:
+            indexes = IndexManager()
+            indexes.drop()
+
+            try:
+                success = load()
+            finally:
+                indexes.rebuild()
+        else:
+            success = load()
+
+        if self.closure:
+            try:
+                self._refreshClosure()
+            except Exception as e:
+                logging.warning("%s while refreshing the mapping closure",
+                                e.__class__.__name__)
+
+                if logging.getLogger().getEffectiveLevel() <= logging.INFO:
+                    logging.exception(e)
+                else:
+                    logging.error(str(e).strip())
+
+        return success
+
+    def _loadCaches(self) -> bool:
+        """
+        Load the records from the `parsed` record caches; the caches can be
+        resumed (and checkpoints are counted) and the progress is reported
+        by record.
+        """
+        # the parsed module depends on this module
+        from gnamed.parsed import RecordReader
+
+        for path in self.parsed:
+            skip = 0
+
+            if self.resume:
+                position = LoadCheckpoint(path)
+
+                if position is not None and position.complete:
+                    logging.info('skipping completed cache %s', path)
+                    continue
+                elif position is not None:
+                    logging.info('resuming %s after record %s', path,
+                                 position.records)
+                    skip = position.records
+
+            self.session = Session(autoflush=False)
+            self.db_refs = {}
+            self._prepare()
+            logging.info('loading parsed records from %s', path)
+            self._reader = None
+            progress = self._progress(path)
+
+            with RecordReader(path) as reader:
+                num_records = 0
+
+                try:
+                    for db_key, record in reader:
+                        num_records += 1
+
+                        if num_records <= skip:
+                            continue
+
+                        if progress is not None and \
+                                num_records % self.PROGRESS == 0:
+                            progress(num_records, num_records)
+
+                        try:
+                            self._loadParsed(db_key, record)
+                        except Exception as e:
+                            if not self.tolerant:
+                                raise
+
+                            self._reject([self._describe(db_key, record)], e)
+
+                        if num_records % self.flush == 0:
+                            started = perf_counter()
+                            self._flush()
+
+                            if self.metrics is not None:
+                                self.metrics.flushed(perf_counter() - started)
+
+                        if self.commit and num_records % self.commit == 0:
+                            self._commit(path, num_records, num_records)
+
+                    self._commit(path, num_records, num_records,
+                                 complete=True)
+
+                    if progress is not None:
+                        progress(num_records, num_records, True)
+                except Exception as e:
+                    self._rollback()
+                    logging.warning("%s while loading record %s of %s",
+                                    e.__class__.__name__, num_records, path)
+
+                    if logging.getLogger().getEffectiveLevel() <= logging.INFO:
+                        logging.exception(e)
+                    else:
+                        logging.fatal(str(e).strip())
+
+                    return False
+                finally:
+                    if self.session is not None:
+                        self.session.close()
+                        self.session = None
+
+            logging.info('loaded %s records from %s', num_records - skip,
+                         path)
+
+        return True
+
+    def _storeRecord(self, db_key: DBRef, record: AbstractRecord):
+        """
+        Store a parsed record: write it to the `cache` (if set) or load it
+        into the DB (see `_loadParsed`).
+        """
+        if self.cache is not None:
+            self.cache.write(db_key, record)
+        else:
+            self._loadParsed(db_key, record)
+
+    def _loadParsed(self, db_key: DBRef, record: AbstractRecord):
+        """
+        Load a parsed record into the DB, applying any fix-ups the
+        repository's records need when they clash with the DB.
+
+        By default, this is just `_loadRecord`.
+        """
+        self._loadRecord(db_key, record)
+
+    @staticmethod
+    def _describe(db_key: DBRef, record: AbstractRecord) -> str:
+        """
+        Describe a record without raw lines (e.g., merged from several files)
+        for the rejects.
+        """
+        return '{}:{}\t{!r}'.format(db_key.namespace, db_key.accession, record)
+
+    def _refreshClosure(self):
+        if self.dirty is None:
+            RefreshClosure()
+        elif self.dirty['gene'] or self.dirty['protein']:
+            RefreshClosure(self.dirty['gene'], self.dirty['protein'])
+
+        self.dirty = {'gene': set(), 'protein': set()}
+
+    def _markDirty(self, entity_name: str, entity_id: int):
+        """
+        Register the ID of a modified "gene" or "protein" entity.
+        """
+        if self.dirty is not None and entity_id is not None:
+            self.dirty[entity_name].add(entity_id)
+
+            if len(self.dirty[entity_name]) > self.DIRTY:
+                logging.info('more than %s modified %ss; the mapping closure '
+                             'will be rebuilt', self.DIRTY, entity_name)
+                self.dirty = None
+
+    def _afterFlush(self, session, flush_context):
+        # new entities and references, and references linked to another
+        # entity, change the closure
+        for obj in session.new:
+            if isinstance(obj, (Gene, GeneRef)):
+                self._markDirty('gene', obj.id)
+            elif isinstance(obj, (Protein, ProteinRef)):
+                self._markDirty('protein', obj.id)
+
+        for obj in session.dirty:
+            if isinstance(obj, GeneRef):
+                entity_name = 'gene'
+            elif isinstance(obj, ProteinRef):
+                entity_name = 'protein'
+            else:
+                continue
+
+            if get_history(obj, 'id').has_changes() or \
+                    get_history(obj, entity_name).has_changes():
+                self._markDirty(entity_name, obj.id)
+
+    def _setup(self, stream: io.TextIOWrapper) -> int:
+        self._prepare()
+        return super(AbstractLoader, self)._setup(stream)
+
+    def _prepare(self):
+        """
+        Prepare the loader (and its session) to load the records of a file.
+        """
+        self._batch = []
+        self._savepoint = None
+        self._loading = False
+
+        if self.session is not None:
+            event.listen(self.session, 'after_flush', self._afterFlush)
+            event.listen(self.session, 'before_commit', self._flushPending)
 
     def _flush(self):
         """
         Write session objects into the DB to allow the GC to free some memory.
         """
-        self.session.flush()
+        if self._savepoint is not None:
+            self._release()
+        else:
+            self.session.flush()
+            self._flushPending(self.session)
+
         self.db_refs = {}
 
+    def _commit(self, path: str, lines: int, records: int,
+                complete: bool=False):
+        if self._savepoint is not None:
+            self._release()
+
+        super(AbstractLoader, self)._commit(path, lines, records, complete)
+        self.db_refs = {}
+
+    def _rollback(self):
+        if self._savepoint is not None:
+            self._abort()
+
+        super(AbstractLoader, self)._rollback()
+
+    def _reject(self, lines: list, error: Exception):
+        if self._loading:
+            # the record failed while loading and left the session in an
+            # unknown state: roll back its batch and replay the other records
+            batch = self._batch
+            self._abort()
+            self._replay(batch)
+
+        super(AbstractLoader, self)._reject(lines, error)
+
+    def _release(self):
+        """
+        Flush the current batch of records and release its savepoint; if
+        that fails, roll back the savepoint and replay the batch.
+        """
+        batch = self._batch
+
+        try:
+            self.session.flush()
+            self._flushPending(self.session)
+            self._savepoint.commit()
+        except Exception:
+            self._abort()
+            self._replay(batch)
+        else:
+            self._batch = []
+            self._savepoint = None
+
+    def _abort(self):
+        """
+        Roll back the savepoint of the current batch and discard any of its
+        cached or pending data.
+        """
+        if self._savepoint is not None:
+            self._savepoint.rollback()
+
+        self._savepoint = None
+        self._batch = []
+        self._loading = False
+        self._mappings = set()
+        self._strings = {'gene': set(), 'protein': set()}
+        self._pmids = {'gene': set(), 'protein': set()}
+        self.db_refs = {}
+
+    def _replay(self, batch: list):
+        """
+        Load the (db_key, record, lines) tuples of a failed batch one at a
+        time, each in its own savepoint, rejecting those that fail.
+
+        Records are replayed with `_loadParsed`, so they get the same
+        repository-specific fix-ups as when they were first loaded.
+        """
+        logging.info('replaying a batch of %s records', len(batch))
+
+        for db_key, record, lines in batch:
+            try:
+                self._loadParsed(db_key, record)
+                self.session.flush()
+                self._flushPending(self.session)
+                self._savepoint.commit()
+            except Exception as e:
+                self._abort()
+                super(AbstractLoader, self)._reject(lines, e)
+            else:
+                self._batch = []
+                self._savepoint = None
+
+    def _flushPending(self, session):
+        """
+        Write the strings, PMIDs and gene-protein mappings of all records
+        loaded since the last flush.
+
+        Strings and PMIDs are inserted in one batch per table, skipping any
+        existing rows (see `InsertIgnore`), so the existing collections of
+        the entities never need to be loaded.
+        """
+        session.flush()
+        connection = session.connection()
+
+        for entity_name, (strings, pmids) in self.TABLES.items():
+            if self._strings[entity_name]:
+                pending = self._strings[entity_name]
+                self._strings[entity_name] = set()
+                ids = InternStrings(connection,
+                                    (value for _, _, value in pending))
+                InsertIgnore(connection, strings, [
+                    {'id': eid, 'cat': cat, 'string_id': ids[value]}
+                    for eid, cat, value in pending
+                ])
+
+            if self._pmids[entity_name]:
+                pending = self._pmids[entity_name]
+                self._pmids[entity_name] = set()
+                InsertIgnore(connection, pmids, [
+                    {'id': eid, 'pmid': pmid} for eid, pmid in pending
+                ])
+
+        if self._mappings:
+            self._insertMappings(connection)
+
+    def _insertMappings(self, connection):
+        # resolve the mapped references and find the existing pairs with one
+        # query per batch of accessions or gene IDs, then insert all new
+        # pairs at once
+        pending, self._mappings = self._mappings, set()
+        size = self.MAPPING_BATCH
+        accessions = defaultdict(set)
+        ids = {}
+
+        for entity_name, _, (ns, acc) in pending:
+            other_name = 'protein' if entity_name == 'gene' else 'gene'
+            accessions[other_name, ns].add(acc)
+
+        for (other_name, ns), accs in accessions.items():
+            Ref = (GeneRef if other_name == 'gene' else ProteinRef).__table__
+            accs = list(accs)
+
+            for i in range(0, len(accs), size):
+                for acc, other_id in connection.execute(
+                        select([Ref.c.accession, Ref.c.id]).where(and_(
+                            Ref.c.namespace == ns,
+                            Ref.c.accession.in_(accs[i:i + size])
+                        ))):
+                    if other_id is not None:
+                        ids[other_name, DBRef(ns, acc)] = other_id
+
+        pairs = set()
+
+        for entity_name, entity_id, db_ref in pending:
+            if entity_name == 'gene':
+                other_id = ids.get(('protein', db_ref))
+                pair = (entity_id, other_id)
+            else:
+                other_id = ids.get(('gene', db_ref))
+                pair = (other_id, entity_id)
+
+            if other_id is not None:
+                pairs.add(pair)
+
+        gene_ids = list(set(gid for gid, _ in pairs))
+
+        for i in range(0, len(gene_ids), size):
+            pairs.difference_update(tuple(row) for row in connection.execute(
+                select([mapping.c.gene_id, mapping.c.protein_id]).where(
+                    mapping.c.gene_id.in_(gene_ids[i:i + size])
+                )
+            ))
+
+        if pairs:
+            logging.debug('adding %s gene-protein mappings', len(pairs))
+            connection.execute(mapping.insert(), [
+                {'gene_id': gid, 'protein_id': pid} for gid, pid in pairs
+            ])
+
+            for gid, pid in pairs:
+                self._markDirty('gene', gid)
+                self._markDirty('protein', pid)
+
     def _loadRecord(self, db_key: DBRef, record: AbstractRecord):
         """
         Load an `AbstractRecord` into the database.
@@ -181,6 +780,12 @@ class AbstractLoader(AbstractParser):
             "{}:{}".format(*r) for r in record.refs
         ))
 
+        if self.tolerant:
+            if self._savepoint is None:
+                self._savepoint = self.session.begin_nested()
+
+            self._loading = True
+
         # the entity associated to this record
         entity = None
         # this list ensures that there will be only one entity
@@ -190,7 +795,7 @@ class AbstractLoader(AbstractParser):
             ns_acc for ns_acc in record.refs if ns_acc not in self.db_refs
         )
         # set of ns, acc keys that have been loaded already
-        existing_db_keys = record.refs.difference(missing_db_keys)
+        existing_db_keys = set(record.refs).difference(missing_db_keys)
         # update DB references
         update_entity = list()
         # `setEntityAttributeFunction`s by attribute name
@@ -215,43 +820,21 @@ class AbstractLoader(AbstractParser):
         # set the object types according to the record type
         if isinstance(record, GeneRecord):
             EntityRef = GeneRef
-            OtherRef = ProteinRef
             Entity = Gene
-            EntityString = GeneString
-            Entity2PubMed = Gene2PubMed
-            entity_col = mapping.c.gene_id
-            other_col = mapping.c.protein_id
             entity_name = 'gene'
-            other_name = 'protein'
         else:
             EntityRef = ProteinRef
-            OtherRef = GeneRef
             Entity = Protein
-            EntityString = ProteinString
-            Entity2PubMed = Protein2PubMed
-            entity_col = mapping.c.protein_id
-            other_col = mapping.c.gene_id
             entity_name = 'protein'
-            other_name = 'gene'
 
         if missing_db_keys:
-            # split the keys into two lists of namespaces and accessions
-            ns_list, acc_list = zip(*missing_db_keys)
-
-            # load *everything* relevant to the record in one large query
+            # load the references and their entities in one (prepared) query
             # SELECT * FROM <entity>_refs
             #     LEFT OUTER JOIN <entity>s USING (id)
-            #     LEFT OUTER JOIN <entity>_strings USING (id)
-            #     LEFT OUTER JOIN <entity>2pubmed USING (id)
             #     WHERE <entity>_refs.namespace IN (...)
             #         AND <entity>_refs.accession IN (...);
-            # noinspection PyUnresolvedReferences
-            for db_ref in self.session.query(EntityRef).options(
-                    joinedload(getattr(EntityRef, entity_name)),
-                    joinedload(entity_name + '.strings'),
-                    joinedload(entity_name + '.pmids')
-            ).filter(and_(EntityRef.namespace.in_(ns_list),
-                          EntityRef.accession.in_(acc_list))):
+            for db_ref, _ in self.lookups[entity_name](self.session,
+                                                       missing_db_keys):
                 key = DBRef(db_ref.namespace, db_ref.accession)
                 self.db_refs[key] = db_ref
 
@@ -279,6 +862,7 @@ class AbstractLoader(AbstractParser):
             logging.debug('creating a new %s entity for %s:%s',
                           entity_name, *db_key)
             entity = Entity(record.species_id)
+            entity.id = self.ids[entity_name].next(self.session.connection())
             self.session.add(entity)
             addEntity(entity)
         elif len(entities) > 1:
@@ -314,63 +898,21 @@ class AbstractLoader(AbstractParser):
                 db_ref.symbol = record.symbol
                 db_ref.name = record.name
 
-        # update the entity with any new strings
-        known = defaultdict(set)
-
-        for s in entity.strings:
-            known[s.cat].add(s.value)
-
-        for cat in record.strings:
-            for value in record.strings[cat].difference(known[cat]):
-                logging.debug('adding %s="%s" to %s', cat, value, entity)
-                obj = EntityString(entity.id, cat, value)
-                entity.strings.append(obj)
-                self.session.add(obj)
-
-        # update the PubMed references (entity2pubmed)
-        known = set()
-
-        for p in entity.pmids:
-            known.add(p.pmid)
-
-        for pmid in record.pmids.difference(known):
-            logging.debug('adding PMID:%s to %s', pmid, entity)
-            obj = Entity2PubMed(entity.id, pmid)
-            entity.pmids.append(obj)
-            self.session.add(obj)
-
-        # update the entity mappings (genes2proteins)
-        if record.mappings:
-            known = {}
-            ns_list, acc_list = zip(*record.mappings)
-
-            # SELECT * FROM <other>_refs
-            #     LEFT OUTER JOIN genes2proteins
-            #         ON <other>_refs.id = genes2proteins.<this>_id
-            #     WHERE <other>_refs.namespace IN (...)
-            #         AND <other>_refs.accession IN (...);
-            # noinspection PyUnresolvedReferences
-            for ref, this_id in self.session.query(OtherRef,
-                                                   entity_col).outerjoin(
-                    mapping, OtherRef.id == other_col).filter(
-                    and_(OtherRef.namespace.in_(ns_list),
-                         OtherRef.accession.in_(acc_list))):
-                if DBRef(ref.namespace, ref.accession) in record.mappings:
-                    if ref.id not in known:
-                        known[ref.id] = {this_id, }
-                    else:
-                        known[ref.id].add(this_id)
-
-            for other_id, this_ids in known.items():
-                if entity.id not in this_ids:
-                    if entity.id is None:
-                        self.session.flush()
-                        assert entity.id is not None
-
-                    logging.debug('adding mapping {}:{}->{}:{}'.format(
-                        entity_name, entity.id, other_name, other_id
-                    ))
-                    self.session.execute(mapping.insert().values(**{
-                        '{}_id'.format(entity_name): entity.id,
-                        '{}_id'.format(other_name): other_id
-                    }))
+        # register the strings and PubMed references for the next flush
+        for cat, values in record.strings.items():
+            for value in values:
+                self._strings[entity_name].add((entity.id, cat, value))
+
+        for pmid in record.pmids:
+            self._pmids[entity_name].add((entity.id, pmid))
+
+        # register the entity mappings (genes2proteins) for the next flush
+        for db_ref in record.mappings:
+            self._mappings.add((entity_name, entity.id, db_ref))
+
+        # keep the record to replay the batch should it fail
+        if self.tolerant:
+            self._loading = False
+            self._batch.append((db_key, record, list(self._raw) or [
+                self._describe(db_key, record)
+            ]))
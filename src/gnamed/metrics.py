@@ -0,0 +1,281 @@
+"""
+.. py:module:: gnamed.metrics
+   :synopsis: Machine-readable progress and throughput metrics of loads.
+
+Parsers read their files through a `CountingReader`, which counts the
+(compressed) bytes read from a file as they pass through the binary
+buffer, so the position in the file is known without asking the text
+stream to ``tell()`` it (which is expensive and defeats its read-ahead).
+
+A `Metrics` emitter, if set on a parser, periodically writes the progress of
+the file being parsed: the lines, records and bytes read, the throughput
+(records/sec and bytes/sec over the last interval), the ETA, the latency of
+the last flush, the number of objects in the session, and the RSS of the
+process. The metrics are written as JSON lines or as a Prometheus textfile
+(for the node exporter's textfile collector), as defined by `FIELDS`.
+
+.. moduleauthor:: Florian Leitner <florian.leitner@gmail.com>
+.. License: GNU GPL v3 (http://www.gnu.org/licenses/gpl.html)
+"""
+import gzip
+import io
+import json
+import os
+import sys
+
+from time import perf_counter, time
+
+JSON = 'json'
+"""The JSON lines format (one object per emission)."""
+
+PROMETHEUS = 'prometheus'
+"""The Prometheus text format (the file is replaced with every emission)."""
+
+FORMATS = (JSON, PROMETHEUS)
+"""The formats `Metrics` can write."""
+
+INTERVAL = 10.0
+"""Default number of seconds between two emissions of a `Metrics` emitter."""
+
+FIELDS = (
+    ('lines', 'counter', 'Lines read from the file.'),
+    ('records', 'counter', 'Records parsed from the file.'),
+    ('bytes', 'counter', 'Bytes read from the file (compressed).'),
+    ('size', 'gauge', 'Size of the file in bytes (compressed).'),
+    ('records_per_second', 'gauge', 'Records parsed per second.'),
+    ('bytes_per_second', 'gauge', 'Bytes read per second.'),
+    ('eta_seconds', 'gauge', 'Estimated seconds until the file is parsed.'),
+    ('flushes', 'counter', 'Flushes of the parsed records to the DB.'),
+    ('flush_seconds', 'gauge', 'Duration of the last flush in seconds.'),
+    ('session_objects', 'gauge', 'Objects held by the DB session.'),
+    ('rss_bytes', 'gauge', 'Resident set size of the process in bytes.'),
+)
+"""The name, Prometheus type and description of each metric."""
+
+try:
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = None
+
+
+def _rss() -> int:
+    # the current RSS (on Linux), or else the peak RSS of the process
+    if _PAGE_SIZE is not None:
+        try:
+            with open('/proc/self/statm') as statm:
+                return int(statm.read().split()[1]) * _PAGE_SIZE
+        except (OSError, IndexError, ValueError):
+            pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class CountingReader(io.RawIOBase):
+    """
+    A raw binary file that counts the bytes read from it; wrap it into a
+    buffered reader (or a `gzip.GzipFile`) and a text stream.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: the file to read
+        """
+        super(CountingReader, self).__init__()
+        self.name = path
+        self.count = 0
+        self.size = os.path.getsize(path)
+        self._file = open(path, 'rb', buffering=0)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        n = self._file.readinto(buffer)
+        self.count += n or 0
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+
+        super(CountingReader, self).close()
+
+
+class _GzipFile(gzip.GzipFile):
+    # a gzip file that owns (and closes) the file object it decompresses
+
+    def close(self):
+        source = self.fileobj
+
+        try:
+            super(_GzipFile, self).close()
+        finally:
+            if source is not None:
+                source.close()
+
+
+def OpenCounted(path: str, encoding: str) -> tuple:
+    """
+    Open the file at `path` as a text stream that counts the bytes read
+    from the file; return the stream and its `CountingReader`.
+    Gzip-compressed files (``.gz``) are decompressed on the fly, counting
+    the compressed bytes.
+    """
+    reader = CountingReader(path)
+    binary = io.BufferedReader(reader)
+
+    if path.endswith('.gz'):
+        binary = _GzipFile(fileobj=binary, mode='rb')
+
+    return io.TextIOWrapper(binary, encoding=encoding), reader
+
+
+class Metrics:
+    """
+    Periodically write the progress and throughput of the files a parser
+    parses to a file (or STDERR).
+
+    The parser announces each file with `begin`, reports its flushes with
+    `flushed`, and calls `update` regularly (e.g., every
+    `gnamed.parsers.AbstractParser.PROGRESS` lines); `update` only writes
+    the metrics if `interval` seconds have passed since the last time.
+    """
+
+    def __init__(self, path: str=None, format: str=JSON,
+                 interval: float=INTERVAL):
+        """
+        :param path: the file to write to (JSON lines are appended, a
+                     Prometheus textfile is replaced); JSON lines are written
+                     to STDERR if ``None``
+        :param format: one of the `FORMATS`
+        :param interval: the minimum number of seconds between two emissions
+        """
+        if format not in FORMATS:
+            raise ValueError('unknown metrics format "{}"'.format(format))
+
+        if path is None and format != JSON:
+            raise ValueError('{} metrics need a file'.format(format))
+
+        self.path = path
+        self.format = format
+        self.interval = interval
+        self.loader = None
+        self.file = None
+        self.size = None
+        self.flushes = 0
+        self.flush_seconds = None
+        self._started = None
+        self._last = None  # time, records and bytes of the last emission
+
+    def begin(self, loader: str, path: str, size: int=None):
+        """
+        Start the metrics of a new file.
+
+        :param loader: the name of the parser
+        :param path: the file being parsed
+        :param size: the size of the file in bytes (if known)
+        """
+        self.loader = loader
+        self.file = path
+        self.size = size
+        self.flushes = 0
+        self.flush_seconds = None
+        self._started = perf_counter()
+        self._last = (self._started, 0, 0)
+
+    def flushed(self, seconds: float):
+        """
+        Record a flush of the parsed records that took `seconds`.
+        """
+        self.flushes += 1
+        self.flush_seconds = seconds
+
+    def update(self, lines: int, records: int, position: int=None,
+               session=None, force: bool=False):
+        """
+        Write the metrics if `interval` seconds have passed since the last
+        time (or if `force` is set, e.g., at the end of a file).
+
+        :param lines: the number of lines read from the file
+        :param records: the number of records parsed from the file
+        :param position: the number of bytes read from the file (if known)
+        :param session: the DB session of the parser (if any)
+        :param force: write the metrics regardless of the interval
+        """
+        now = perf_counter()
+        last, last_records, last_position = self._last
+
+        if not force and now - last < self.interval:
+            return
+
+        elapsed = now - last or 1e-9
+        metrics = {
+            'lines': lines, 'records': records, 'bytes': position,
+            'size': self.size,
+            'records_per_second': round((records - last_records) / elapsed,
+                                        1),
+            'bytes_per_second': None, 'eta_seconds': None,
+            'flushes': self.flushes, 'flush_seconds': self.flush_seconds,
+            'session_objects': None if session is None else
+            len(session.identity_map) + len(session.new),
+            'rss_bytes': _rss(),
+        }
+
+        if position is not None:
+            metrics['bytes_per_second'] = round(
+                (position - (last_position or 0)) / elapsed, 1
+            )
+
+            # the ETA assumes the average throughput of the whole file
+            if self.size and position:
+                metrics['eta_seconds'] = round(
+                    (self.size - position) * (now - self._started) / position,
+                    1
+                )
+
+        self._last = (now, records, position)
+
+        if self.format == JSON:
+            self._writeJson(metrics)
+        else:
+            self._writePrometheus(metrics)
+
+    def _writeJson(self, metrics: dict):
+        data = {'time': round(time(), 3), 'loader': self.loader,
+                'file': self.file}
+        data.update(metrics)
+        line = json.dumps(data) + '\n'
+
+        if self.path is None:
+            sys.stderr.write(line)
+            sys.stderr.flush()
+        else:
+            with open(self.path, 'a') as stream:
+                stream.write(line)
+
+    def _writePrometheus(self, metrics: dict):
+        labels = '{{loader="{}",file="{}"}}'.format(*(
+            value.replace('\\', '\\\\').replace('"', '\\"')
+            for value in (self.loader, self.file)
+        ))
+        temporary = self.path + '.tmp'
+
+        # the collector must never see a partial file
+        with open(temporary, 'w') as stream:
+            for name, kind, description in FIELDS:
+                if metrics[name] is not None:
+                    stream.write('# HELP gnamed_{0} {1}\n'
+                                 '# TYPE gnamed_{0} {2}\n'
+                                 'gnamed_{0}{3} {4}\n'.format(
+                                     name + '_total' if kind == 'counter'
+                                     else name, description, kind, labels,
+                                     metrics[name]
+                                 ))
+
+        os.replace(temporary, self.path)
@@ -5,24 +5,96 @@
 .. moduleauthor:: Florian Leitner <florian.leitner@gmail.com>
 .. License: GNU GPL v3 (http://www.gnu.org/licenses/gpl.html)
 """
+import hashlib
 import logging
+import os
+import re
+import socket
+import threading
 #import sqlalchemy
 
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import engine, func
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.ext.declarative import declarative_base, declared_attr
+from sqlalchemy import engine, event, func, inspect
 from sqlalchemy.orm import aliased, backref, relationship
 from sqlalchemy.orm.session import sessionmaker
-from sqlalchemy.schema import Column, ForeignKey, Sequence, Table
-from sqlalchemy.types import BigInteger, Integer, String, Text
+from sqlalchemy.schema import \
+    AddConstraint, Column, ForeignKey, Index, MetaData, Sequence, Table
+from sqlalchemy.sql.expression import \
+    and_, bindparam, exists, or_, select, text, union
+from sqlalchemy.types import \
+    BigInteger, Boolean, DateTime, Integer, String, Text
+
+from gnamed.constants import SPECIES_SPACES
+from gnamed.profiling import Phase
 
 _Base = declarative_base()
 _db = None
 _session = lambda *args, **kwds: None
+_strings = None
+_relaxed = False
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -262144,
+    'temp_store': 'MEMORY',
+    'mmap_size': 1 << 30,
+}
+"""
+The pragmas set on every new SQLite connection: write-ahead logging (so
+readers never block the loader), a 256 MB page cache, in-memory temporary
+tables, and memory-mapped I/O.
+"""
+
+SQLITE_LOAD_PRAGMAS = {
+    'synchronous': 'OFF',
+}
+"""
+The pragmas set on new SQLite connections while `RelaxDurability` is in
+effect: an interrupted load can lose its last transactions, but never
+corrupts the DB (given write-ahead logging).
+"""
+
+COPY_BATCH = 10000
+"""Number of rows to insert at a time when emulating ``COPY FROM``."""
+
+POOL_SIZE = 8
+"""
+Default number of DB connections kept open in the pool (i.e., enough for a
+loader, its `IndexManager` threads, and the closure refresh).
+"""
+
+POOL_OVERFLOW = 4
+"""Default number of additional, transient DB connections."""
 
+_STRING_TABLES = ('gene_strings', 'protein_strings')
 
-def InitDb(*args, **kwds):
+
+class OutdatedSchemaError(RuntimeError):
+    """
+    Raised by `InitDb` if the DB was built with an older schema that has to
+    be migrated (see `MigrateStrings`) or rebuilt.
     """
-    Create a new DBAPI connection pool.
+    pass
+
+
+# the entity IDs are INTEGER PRIMARY KEYs on SQLite, i.e., ROWID aliases
+_EntityId = BigInteger().with_variant(Integer, 'sqlite')
+
+
+def InitDb(*args, pool_size: int=POOL_SIZE, migrate: bool=False, **kwds):
+    """
+    Create a new DBAPI connection pool of `pool_size` connections (plus
+    `POOL_OVERFLOW`, unless ``max_overflow`` is given); the pool size is
+    ignored for SQLite, which does not pool connections to files.
+
+    Existing DBs whose entity strings are stored in the old layout (the
+    string values in the ``gene_strings`` and ``protein_strings`` tables,
+    instead of the ``string_values`` dictionary) are converted if `migrate`
+    is set (see `MigrateStrings`); otherwise, an `OutdatedSchemaError` is
+    raised.
 
     The most common and only really required argument is the connection URL.
 
@@ -31,12 +103,146 @@ def InitDb(*args, **kwds):
     """
     global _db
     global _session
+    global _strings
+
+    if _db is not None:
+        _db.dispose()
+
+    if args and engine.url.make_url(args[0]).get_backend_name() != 'sqlite':
+        kwds['pool_size'] = pool_size
+        kwds.setdefault('max_overflow', POOL_OVERFLOW)
+
     _db = engine.create_engine(*args, **kwds)
+
+    if _db.dialect.name == 'sqlite':
+        event.listen(_db, 'connect', _sqlitePragmas)
+
+    if _outdatedStrings(_db):
+        if not migrate:
+            raise OutdatedSchemaError(
+                'the DB stores entity strings in the old layout (without the '
+                'string_values dictionary); migrate it (gnamed migrate) or '
+                'rebuild it'
+            )
+
+        MigrateStrings()
+
     _Base.metadata.create_all(_db)
     _session = sessionmaker(bind=_db)
+    _strings = StringCache()
+    event.listen(_session, 'before_flush', _internStrings)
+    event.listen(_session, 'after_rollback', lambda session: _strings.clear())
     return None
 
 
+def _outdatedStrings(db) -> bool:
+    # string tables that still hold the values instead of string IDs
+    inspector = inspect(db)
+    tables = set(inspector.get_table_names())
+
+    for name in _STRING_TABLES:
+        if name in tables:
+            columns = set(c['name'] for c in inspector.get_columns(name))
+
+            if 'value' in columns and 'string_id' not in columns:
+                return True
+
+    return False
+
+
+def MigrateStrings():
+    """
+    Convert the entity strings of a DB built before the ``string_values``
+    dictionary: collect all distinct values in the dictionary and rewrite the
+    ``gene_strings`` and ``protein_strings`` tables with the string IDs (and
+    the new primary keys), in one transaction.
+    """
+    StringValue.__table__.create(_db, checkfirst=True)
+
+    with _db.begin() as connection:
+        for name, table in zip(_STRING_TABLES, (GeneString.__table__,
+                                                ProteinString.__table__)):
+            if 'string_id' in set(c['name'] for c in
+                                  inspect(connection).get_columns(name)):
+                continue
+
+            logging.info('migrating the strings of %s', name)
+            old = name + '_old'
+            connection.execute(text(
+                'CREATE TABLE {} AS SELECT id, cat, value FROM {}'.format(
+                    old, name
+                )
+            ))
+            connection.execute(text('DROP TABLE {}'.format(name)))
+            connection.execute(text(
+                'INSERT INTO string_values (value) '
+                'SELECT DISTINCT o.value FROM {} AS o '
+                'WHERE NOT EXISTS (SELECT 1 FROM string_values AS v '
+                'WHERE v.value = o.value)'.format(old)
+            ))
+            table.create(connection)
+            connection.execute(text(
+                'INSERT INTO {} (id, cat, string_id) '
+                'SELECT DISTINCT o.id, o.cat, v.id FROM {} AS o '
+                'JOIN string_values AS v ON (v.value = o.value)'.format(
+                    name, old
+                )
+            ))
+            connection.execute(text('DROP TABLE {}'.format(old)))
+
+
+def CloseDb():
+    """
+    Close all pooled DB connections (e.g., at exit).
+    """
+    if _db is not None:
+        _db.dispose()
+
+
+def _sqlitePragmas(dbapi_connection, connection_record):
+    pragmas = dict(SQLITE_PRAGMAS)
+
+    if _relaxed:
+        pragmas.update(SQLITE_LOAD_PRAGMAS)
+
+    cursor = dbapi_connection.cursor()
+
+    try:
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA {} = {}'.format(name, value))
+    finally:
+        cursor.close()
+
+
+def RelaxDurability(relax: bool=True):
+    """
+    Trade durability for load throughput on SQLite (see
+    `SQLITE_LOAD_PRAGMAS`); affects all connections opened from now on.
+    Without relaxing (any more), the write-ahead log is checkpointed into
+    the DB file.
+
+    Has no effect on other DBs.
+    """
+    global _relaxed
+    _relaxed = relax
+
+    if not relax and _db is not None and _db.dialect.name == 'sqlite':
+        with _db.connect() as connection:
+            connection.execute(text('PRAGMA wal_checkpoint(TRUNCATE)'))
+
+
+def IsDbError(error: Exception) -> bool:
+    """
+    Return ``True`` if the `error` was raised by the DB, independent of the
+    dialect and of whether the error was raised through SQLAlchemy or
+    directly by the DBAPI connection (e.g., by ``COPY FROM``).
+    """
+    if isinstance(error, DBAPIError):
+        return True
+
+    return _db is not None and isinstance(error, _db.dialect.dbapi.Error)
+
+
 def Session(*args, **kwds):
     """
     Start a new DB session.
@@ -47,6 +253,147 @@ def Session(*args, **kwds):
     return _session(*args, **kwds)
 
 
+def Connection():
+    """
+    Open a new DB connection, independent of any session.
+
+    see `sqlalchemy.engine.Connection
+    <http://docs.sqlalchemy.org/en/rel_0_7/core/connections.html#sqlalchemy.engine.base.Connection>`_
+    """
+    return _db.connect()
+
+
+def InternStrings(connection, values) -> dict:
+    """
+    Return a dictionary of the `string_values` IDs for the given strings,
+    adding any missing strings to the DB (see `StringCache`).
+
+    :param connection: the DB connection (in the current transaction)
+    :param values: an iterable of strings
+    """
+    return _strings.resolve(connection, values)
+
+
+def InsertIgnore(connection, table: Table, rows: list):
+    """
+    Insert all `rows` into the `table`, skipping any row that conflicts with
+    an existing one.
+
+    Uses ``INSERT ... ON CONFLICT DO NOTHING`` on PostgreSQL and ``INSERT OR
+    IGNORE`` on SQLite; on other DBs, each row is inserted in a savepoint.
+
+    :param connection: the DB connection (in the current transaction)
+    :param table: the table to insert into
+    :param rows: a list of dictionaries of column values
+    """
+    if not rows:
+        return
+
+    dialect = connection.dialect.name
+
+    if dialect == 'postgresql':
+        connection.execute(postgresql.insert(table).on_conflict_do_nothing(),
+                           rows)
+    elif dialect == 'sqlite':
+        connection.execute(table.insert().prefix_with('OR IGNORE'), rows)
+    else:
+        for row in rows:
+            savepoint = connection.begin_nested()
+
+            try:
+                connection.execute(table.insert(), row)
+            except IntegrityError:
+                savepoint.rollback()
+            else:
+                savepoint.commit()
+
+
+_COPY_ESCAPE = re.compile(r'\\(.)')
+_COPY_CHARS = {'t': '\t', 'n': '\n', 'r': '\r'}
+
+
+def CopyValue(value) -> str:
+    """
+    Encode a value as a field of a row in ``COPY`` text format: ``None`` is
+    ``\\N``, and backslashes, tabs and line breaks are escaped.
+    """
+    if value is None:
+        return '\\N'
+
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace(
+        '\n', '\\n').replace('\r', '\\r')
+
+
+def _copyField(value: str):
+    if value == '\\N':
+        return None
+    elif '\\' in value:
+        return _COPY_ESCAPE.sub(
+            lambda m: _COPY_CHARS.get(m.group(1), m.group(1)), value
+        )
+
+    return value
+
+
+def CopyFrom(connection, table: Table, stream, columns: tuple=None):
+    """
+    Load the tab-separated rows in ``COPY`` text format from `stream` into
+    the `table`.
+
+    Uses ``COPY FROM`` on PostgreSQL; on any other DB, the rows are decoded
+    and inserted with `COPY_BATCH` rows per ``executemany``.
+
+    :param connection: the DB connection (in the current transaction)
+    :param table: the table to load
+    :param stream: a text file object with the rows
+    :param columns: the names of the columns in the rows (default: all)
+
+    The load is timed as the ``copy`` phase of an active
+    `gnamed.profiling.Profile`.
+    """
+    if columns is None:
+        columns = tuple(c.name for c in table.c)
+
+    with Phase('copy'):
+        if connection.dialect.name == 'postgresql':
+            cursor = connection.connection.cursor()
+
+            try:
+                cursor.copy_from(stream, table.name, columns=columns)
+            finally:
+                cursor.close()
+
+            return
+
+        insert = table.insert()
+        rows = []
+
+        for line in stream:
+            values = line.rstrip('\n').split('\t')
+            rows.append({c: _copyField(v) for c, v in zip(columns, values)})
+
+            if len(rows) == COPY_BATCH:
+                connection.execute(insert, rows)
+                rows = []
+
+        if rows:
+            connection.execute(insert, rows)
+
+
+def _internStrings(session, flush_context, instances):
+    # assign the string IDs to all new entity strings in one batch
+    new = [obj for obj in session.new
+           if isinstance(obj, (GeneString, ProteinString)) and
+           obj.string_id is None]
+
+    if new:
+        ids = _strings.resolve(session.connection(),
+                               set(obj.value for obj in new))
+
+        for obj in new:
+            obj.string_id = ids[obj.value]
+
+
 def IsProteinRepo(key):
     return key == 'uni'
 
@@ -67,10 +414,8 @@ def RetrieveGeneStrings(repo_key):
     """
     session = Session()
 
-    for instance in session.query(
-        "accession", "category", "value"
-    ).from_statement(
-        """
+    try:
+        for instance in session.execute(text("""
         SELECT accession, 'official_symbol' AS category, symbol AS value
              FROM gene_refs
              WHERE namespace = :repo_key
@@ -81,40 +426,49 @@ def RetrieveGeneStrings(repo_key):
              WHERE namespace = :repo_key
                   AND name <> ''
         UNION ALL
-        SELECT accession, 'gene_symbol' AS category, value
-             FROM gene_refs
-             JOIN gene_strings
-                  USING (id)
-             WHERE namespace = :repo_key
-                  AND cat = 'symbol'
+        SELECT accession, 'gene_symbol' AS category, sv.value
+             FROM gene_refs AS r
+             JOIN gene_strings AS s
+                  ON (r.id = s.id)
+             JOIN string_values AS sv
+                  ON (s.string_id = sv.id)
+             WHERE r.namespace = :repo_key
+                  AND s.cat = 'symbol'
         UNION ALL
-        SELECT accession, 'gene_name' as category, value
-             FROM gene_refs
-             JOIN gene_strings
-                  USING (id)
-             WHERE namespace = :repo_key
-                  AND cat = 'name'
+        SELECT accession, 'gene_name' AS category, sv.value
+             FROM gene_refs AS r
+             JOIN gene_strings AS s
+                  ON (r.id = s.id)
+             JOIN string_values AS sv
+                  ON (s.string_id = sv.id)
+             WHERE r.namespace = :repo_key
+                  AND s.cat = 'name'
         UNION ALL
-        SELECT accession, 'protein_symbol' AS category, value
-             FROM gene_refs AS gr
+        SELECT accession, 'protein_symbol' AS category, sv.value
+             FROM gene_refs AS r
              JOIN genes2proteins AS g2p
-                  ON (gr.id = g2p.gene_id)
-             JOIN protein_strings AS ps
-                  ON (g2p.protein_id = ps.id)
-             WHERE gr.namespace = :repo_key
-                  AND ps.cat = 'symbol'
+                  ON (r.id = g2p.gene_id)
+             JOIN protein_strings AS s
+                  ON (g2p.protein_id = s.id)
+             JOIN string_values AS sv
+                  ON (s.string_id = sv.id)
+             WHERE r.namespace = :repo_key
+                  AND s.cat = 'symbol'
         UNION ALL
-        SELECT accession, 'protein_name' AS category, value
-             FROM gene_refs AS gr
+        SELECT accession, 'protein_name' AS category, sv.value
+             FROM gene_refs AS r
              JOIN genes2proteins AS g2p
-                  ON (gr.id = g2p.gene_id)
-             JOIN protein_strings AS ps
-                  ON (g2p.protein_id = ps.id)
-             WHERE gr.namespace = :repo_key
-                  AND ps.cat = 'name'
-        """
-    ).params(repo_key=repo_key).all():
-        yield instance
+                  ON (r.id = g2p.gene_id)
+             JOIN protein_strings AS s
+                  ON (g2p.protein_id = s.id)
+             JOIN string_values AS sv
+                  ON (s.string_id = sv.id)
+             WHERE r.namespace = :repo_key
+                  AND s.cat = 'name'
+        """), {'repo_key': repo_key}):
+            yield tuple(instance)
+    finally:
+        session.close()
 
 
 def RetrieveProteinStrings(repo_key):
@@ -123,54 +477,61 @@ def RetrieveProteinStrings(repo_key):
     """
     session = Session()
 
-    for instance in session.query(
-        "accession", "category", "value"
-    ).from_statement(
-        """
+    try:
+        for instance in session.execute(text("""
         SELECT accession, 'official_symbol' AS category, symbol AS value
-            FROM protein_refs
-            WHERE namespace = :repo_key
-                AND symbol <> ''
+             FROM protein_refs
+             WHERE namespace = :repo_key
+                  AND symbol <> ''
         UNION ALL
         SELECT accession, 'official_name' AS category, name AS value
-            FROM protein_refs
-            WHERE namespace = :repo_key
-                AND name <> ''
+             FROM protein_refs
+             WHERE namespace = :repo_key
+                  AND name <> ''
         UNION ALL
-        SELECT accession, 'protein_symbol' AS category, value
-            FROM protein_refs
-            JOIN protein_strings
-                USING (id)
-            WHERE namespace = :repo_key
-                AND cat = 'symbol'
+        SELECT accession, 'protein_symbol' AS category, sv.value
+             FROM protein_refs AS r
+             JOIN protein_strings AS s
+                  ON (r.id = s.id)
+             JOIN string_values AS sv
+                  ON (s.string_id = sv.id)
+             WHERE r.namespace = :repo_key
+                  AND s.cat = 'symbol'
         UNION ALL
-        SELECT accession, 'protein_name' as category, value
-            FROM protein_refs
-            JOIN protein_strings
-                USING (id)
-            WHERE namespace = :repo_key
-                AND cat = 'name'
+        SELECT accession, 'protein_name' AS category, sv.value
+             FROM protein_refs AS r
+             JOIN protein_strings AS s
+                  ON (r.id = s.id)
+             JOIN string_values AS sv
+                  ON (s.string_id = sv.id)
+             WHERE r.namespace = :repo_key
+                  AND s.cat = 'name'
         UNION ALL
-        SELECT accession, 'gene_symbol' AS category, value
-            FROM protein_refs AS pr
-            JOIN genes2proteins AS g2p
-                ON (pr.id = g2p.protein_id)
-            JOIN gene_strings AS gs
-                ON (g2p.gene_id = gs.id)
-            WHERE pr.namespace = :repo_key
-                AND gs.cat = 'symbol'
+        SELECT accession, 'gene_symbol' AS category, sv.value
+             FROM protein_refs AS r
+             JOIN genes2proteins AS g2p
+                  ON (r.id = g2p.protein_id)
+             JOIN gene_strings AS s
+                  ON (g2p.gene_id = s.id)
+             JOIN string_values AS sv
+                  ON (s.string_id = sv.id)
+             WHERE r.namespace = :repo_key
+                  AND s.cat = 'symbol'
         UNION ALL
-        SELECT accession, 'gene_name' AS category, value
-            FROM protein_refs AS pr
-            JOIN genes2proteins AS g2p
-                ON (pr.id = g2p.protein_id)
-            JOIN gene_strings AS gs
-                ON (g2p.gene_id = gs.id)
-            WHERE pr.namespace = :repo_key
-                AND gs.cat = 'name'
-        """
-    ).params(repo_key=repo_key).all():
-        yield instance
+        SELECT accession, 'gene_name' AS category, sv.value
+             FROM protein_refs AS r
+             JOIN genes2proteins AS g2p
+                  ON (r.id = g2p.protein_id)
+             JOIN gene_strings AS s
+                  ON (g2p.gene_id = s.id)
+             JOIN string_values AS sv
+                  ON (s.string_id = sv.id)
+             WHERE r.namespace = :repo_key
+                  AND s.cat = 'name'
+        """), {'repo_key': repo_key}):
+            yield tuple(instance)
+    finally:
+        session.close()
 
 
 def RetrieveCiteCounts(repo_key):
@@ -187,28 +548,34 @@ def RetrieveGeneCounts(repo_key):
     session = Session()
     logging.info("counting %s gene references", repo_key)
 
-    for instance in session.query(
-        GeneRef.accession, func.count(Gene2PubMed.pmid)
-    ).filter(
-        GeneRef.id == Gene2PubMed.id
-    ).filter(
-        GeneRef.namespace == repo_key
-    ).group_by(GeneRef.accession):
-        yield instance
+    try:
+        for instance in session.query(
+            GeneRef.accession, func.count(Gene2PubMed.pmid)
+        ).filter(
+            GeneRef.id == Gene2PubMed.id
+        ).filter(
+            GeneRef.namespace == repo_key
+        ).group_by(GeneRef.accession):
+            yield instance
+    finally:
+        session.close()
 
 
 def RetrieveProteinCounts(repo_key):
     session = Session()
     logging.info("counting %s protein references", repo_key)
 
-    for instance in session.query(
-        ProteinRef.accession, func.count(Protein2PubMed.pmid)
-    ).filter(
-        ProteinRef.id == Protein2PubMed.id
-    ).filter(
-        ProteinRef.namespace == repo_key
-    ).group_by(ProteinRef.accession):
-        yield instance
+    try:
+        for instance in session.query(
+            ProteinRef.accession, func.count(Protein2PubMed.pmid)
+        ).filter(
+            ProteinRef.id == Protein2PubMed.id
+        ).filter(
+            ProteinRef.namespace == repo_key
+        ).group_by(ProteinRef.accession):
+            yield instance
+    finally:
+        session.close()
 
 
 def MapRepositories(from_key, to_key):
@@ -236,14 +603,17 @@ def MapGeneRepositories(from_key, to_key):
     g1 =  aliased(GeneRef)
     g2 =  aliased(GeneRef)
 
-    for instance in session.query(
-        g1.accession, g2.accession
-    ).filter(g1.id == g2.id).filter(
-        g1.namespace == from_key
-    ).filter(
-        g2.namespace == to_key
-    ):
-        yield instance
+    try:
+        for instance in session.query(
+            g1.accession, g2.accession
+        ).filter(g1.id == g2.id).filter(
+            g1.namespace == from_key
+        ).filter(
+            g2.namespace == to_key
+        ):
+            yield instance
+    finally:
+        session.close()
 
 
 def MapProteinRepositories(protein_key, gene_key):
@@ -260,18 +630,866 @@ def MapProteinRepositories(protein_key, gene_key):
     session = Session()
     logging.info("mapping %s genes to %s proteins", gene_key, protein_key)
 
-    for instance in session.query(
-        GeneRef.accession, ProteinRef.accession
-    ).join(
-        Gene, GeneRef.id == Gene.id
-    ).join(Gene.proteins).join(
-        ProteinRef, Protein.refs
-    ).filter(
-        GeneRef.namespace == gene_key
-    ).filter(
-        ProteinRef.namespace == protein_key
-    ):
-        yield instance
+    try:
+        for instance in session.query(
+            GeneRef.accession, ProteinRef.accession
+        ).join(
+            Gene, GeneRef.id == Gene.id
+        ).join(Gene.proteins).join(
+            ProteinRef, Protein.refs
+        ).filter(
+            GeneRef.namespace == gene_key
+        ).filter(
+            ProteinRef.namespace == protein_key
+        ):
+            yield instance
+    finally:
+        session.close()
+
+
+MAP_BATCH = 10000
+"""Number of accessions to insert at a time into the temporary input table."""
+
+
+class _LineReader:
+    """
+    A minimal, read-only file object over an iterable of accessions for
+    streaming them into a ``COPY FROM`` statement.
+    """
+
+    def __init__(self, accessions):
+        self._lines = (CopyValue(acc) + '\n' for acc in accessions)
+        self._buffer = ''
+
+    def read(self, size: int=-1) -> str:
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._lines)
+            except StopIteration:
+                break
+
+        if size < 0:
+            size = len(self._buffer)
+
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def readline(self, size: int=-1) -> str:
+        if self._buffer:
+            return self.read(self._buffer.find('\n') + 1 or len(self._buffer))
+
+        return next(self._lines, '')
+
+
+def MapAccessions(from_key, to_key, accessions):
+    """
+    Map only the given accessions from one repository to another.
+
+    The accessions are loaded into a temporary table (using ``COPY FROM`` on
+    PostgreSQL and batched inserts for any other DB) and joined server-side,
+    so the cost scales with the number of accessions rather than the size of
+    the repositories.
+
+    :param from_key: the namespace of the `accessions`
+    :param to_key: the namespace to map the accessions to
+    :param accessions: an iterable of accession strings
+    :return: a generator of (from_accession, to_accession) tuples
+    """
+    session = Session()
+    connection = session.connection()
+    input_table = Table('map_input', MetaData(),
+                        Column('accession', String(64), nullable=False),
+                        prefixes=['TEMPORARY'])
+    logging.info("mapping given %s accessions to %s", from_key, to_key)
+
+    try:
+        input_table.create(connection)
+
+        if connection.dialect.name == 'postgresql':
+            cursor = connection.connection.cursor()
+            cursor.copy_from(_LineReader(accessions), 'map_input',
+                             columns=('accession',))
+            cursor.execute('ANALYZE map_input')
+            cursor.close()
+        else:
+            batch = []
+
+            for acc in accessions:
+                batch.append({'accession': acc})
+
+                if len(batch) == MAP_BATCH:
+                    connection.execute(input_table.insert(), batch)
+                    batch = []
+
+            if batch:
+                connection.execute(input_table.insert(), batch)
+
+        refs = {False: GeneRef.__table__, True: ProteinRef.__table__}
+        from_ref = refs[IsProteinRepo(from_key)].alias('from_ref')
+        to_ref = refs[IsProteinRepo(to_key)].alias('to_ref')
+        acc = select([input_table.c.accession]).distinct().alias('acc')
+        join = acc.join(from_ref, and_(
+            from_ref.c.namespace == from_key,
+            from_ref.c.accession == acc.c.accession
+        ))
+
+        if IsProteinRepo(from_key) == IsProteinRepo(to_key):
+            join = join.join(to_ref, to_ref.c.id == from_ref.c.id)
+        else:
+            if IsProteinRepo(from_key):
+                from_col, to_col = mapping.c.protein_id, mapping.c.gene_id
+            else:
+                from_col, to_col = mapping.c.gene_id, mapping.c.protein_id
+
+            join = join.join(mapping, from_col == from_ref.c.id).join(
+                to_ref, to_ref.c.id == to_col
+            )
+
+        query = select([from_ref.c.accession, to_ref.c.accession]).select_from(
+            join
+        ).where(to_ref.c.namespace == to_key)
+
+        for instance in connection.execution_options(
+                stream_results=True).execute(query):
+            yield tuple(instance)
+    finally:
+        session.close()
+
+
+def _closureSelects(dirty: dict=None) -> list:
+    """
+    Return the SELECT statements for all (from_ns, from_acc, to_ns, to_acc)
+    mapping paths: gene-gene, protein-protein (both via the same entity),
+    gene-protein, protein-gene, and gene-protein-gene.
+
+    :param dirty: if given, a dictionary of "gene" and "protein" tables with
+                  an ``id`` column, restricting the rows to those starting or
+                  ending at one of these entities
+    """
+    g1 = GeneRef.__table__.alias('g1')
+    g2 = GeneRef.__table__.alias('g2')
+    p1 = ProteinRef.__table__.alias('p1')
+    p2 = ProteinRef.__table__.alias('p2')
+    m1 = mapping.alias('m1')
+    m2 = mapping.alias('m2')
+    other = lambda r1, r2: or_(r1.c.namespace != r2.c.namespace,
+                               r1.c.accession != r2.c.accession)
+    # (FROM clause, WHERE clause, from refs, from kind, to refs, to kind)
+    paths = [
+        (g1.join(g2, g1.c.id == g2.c.id), other(g1, g2),
+         g1, 'gene', g2, 'gene'),
+        (p1.join(p2, p1.c.id == p2.c.id), other(p1, p2),
+         p1, 'protein', p2, 'protein'),
+        (g1.join(m1, g1.c.id == m1.c.gene_id).join(
+            p2, p2.c.id == m1.c.protein_id), None,
+         g1, 'gene', p2, 'protein'),
+        (p1.join(m1, p1.c.id == m1.c.protein_id).join(
+            g2, g2.c.id == m1.c.gene_id), None,
+         p1, 'protein', g2, 'gene'),
+        (g1.join(m1, g1.c.id == m1.c.gene_id).join(m2, and_(
+            m1.c.protein_id == m2.c.protein_id,
+            m1.c.gene_id != m2.c.gene_id
+        )).join(g2, g2.c.id == m2.c.gene_id), None,
+         g1, 'gene', g2, 'gene'),
+    ]
+    selects = []
+
+    for from_clause, where, r1, kind1, r2, kind2 in paths:
+        query = select([r1.c.namespace.label('from_ns'),
+                        r1.c.accession.label('from_acc'),
+                        r2.c.namespace.label('to_ns'),
+                        r2.c.accession.label('to_acc')]).select_from(
+            from_clause
+        )
+
+        if where is not None:
+            query = query.where(where)
+
+        if dirty is None:
+            selects.append(query)
+        else:
+            for ref, kind in ((r1, kind1), (r2, kind2)):
+                selects.append(query.where(
+                    ref.c.id.in_(select([dirty[kind].c.id]))
+                ))
+
+    return selects
+
+
+def RefreshClosure(gene_ids=None, protein_ids=None):
+    """
+    (Re-) compute the rows of the mapping closure table.
+
+    Without any arguments, the whole table is rebuilt. Otherwise, only the
+    rows starting or ending at the references of the given entities and of
+    the entities directly mapped to them are replaced.
+
+    :param gene_ids: a collection of modified gene IDs
+    :param protein_ids: a collection of modified protein IDs
+    """
+    session = Session()
+    connection = session.connection()
+    columns = [c.name for c in closure.c]
+
+    try:
+        if gene_ids is None and protein_ids is None:
+            logging.info('rebuilding the mapping closure')
+            connection.execute(closure.delete())
+            connection.execute(closure.insert().from_select(
+                columns, union(*_closureSelects())
+            ))
+        else:
+            meta = MetaData()
+            dirty = {
+                kind: Table('dirty_{}s'.format(kind), meta,
+                            Column('id', BigInteger, nullable=False),
+                            prefixes=['TEMPORARY'])
+                for kind in ('gene', 'protein')
+            }
+            ids = {'gene': set(gene_ids or ()),
+                   'protein': set(protein_ids or ())}
+            logging.info('refreshing the mapping closure for %s genes and '
+                         '%s proteins', len(ids['gene']), len(ids['protein']))
+
+            # add the entities directly mapped to the modified ones
+            for kind, other, col, other_col in (
+                    ('gene', 'protein', mapping.c.gene_id,
+                     mapping.c.protein_id),
+                    ('protein', 'gene', mapping.c.protein_id,
+                     mapping.c.gene_id)):
+                for batch in _batches(list(ids[other]), MAP_BATCH):
+                    ids[kind].update(row[0] for row in connection.execute(
+                        select([col]).where(other_col.in_(batch))
+                    ))
+
+            for kind, table in dirty.items():
+                table.create(connection)
+
+                for batch in _batches(list(ids[kind]), MAP_BATCH):
+                    connection.execute(table.insert(),
+                                       [{'id': i} for i in batch])
+
+            for kind, Ref in (('gene', GeneRef.__table__),
+                              ('protein', ProteinRef.__table__)):
+                for ns, acc in ((closure.c.from_ns, closure.c.from_acc),
+                                (closure.c.to_ns, closure.c.to_acc)):
+                    connection.execute(closure.delete().where(
+                        exists().where(and_(
+                            Ref.c.namespace == ns, Ref.c.accession == acc,
+                            Ref.c.id.in_(select([dirty[kind].c.id]))
+                        ))
+                    ))
+
+            connection.execute(closure.insert().from_select(
+                columns, union(*_closureSelects(dirty))
+            ))
+
+            for table in dirty.values():
+                table.drop(connection)
+
+        session.commit()
+    finally:
+        session.close()
+
+
+class StringCache:
+    """
+    A client-side cache of the IDs of the strings in the `string_values`
+    dictionary table.
+
+    Strings are resolved in batches: all unknown strings are first looked up
+    in the DB, and any strings still missing after that are inserted (see
+    `InsertIgnore`, in case another loader has just added them).
+    """
+
+    BATCH = 1000
+    """Number of strings to look up or insert at a time."""
+
+    SIZE = 1000000
+    """
+    Maximum number of cached strings; the cache is cleared when this size
+    is exceeded.
+    """
+
+    def __init__(self):
+        self._ids = {}
+
+    def clear(self):
+        """
+        Drop all cached string IDs (e.g., after a rollback).
+        """
+        self._ids = {}
+
+    def resolve(self, connection, values) -> dict:
+        """
+        Return a dictionary mapping each of the `values` to its string ID.
+
+        :param connection: the DB connection (in the current transaction)
+        :param values: an iterable of strings
+        """
+        values = set(values)
+        missing = [v for v in values if v not in self._ids]
+        found = {v: self._ids[v] for v in values if v in self._ids}
+
+        if missing:
+            for batch in _batches(missing, self.BATCH):
+                found.update(self._select(connection, batch))
+
+            # insert in a stable order, so concurrent loaders adding the
+            # same strings wait for each other instead of deadlocking
+            missing = sorted(v for v in missing if v not in found)
+            logging.debug('adding %s new strings', len(missing))
+
+            for batch in _batches(missing, self.BATCH):
+                InsertIgnore(connection, StringValue.__table__,
+                             [{'value': v} for v in batch])
+                found.update(self._select(connection, batch))
+
+            if len(self._ids) + len(found) > self.SIZE:
+                self._ids = {}
+
+            self._ids.update(found)
+
+        return found
+
+    @staticmethod
+    def _select(connection, values: list):
+        table = StringValue.__table__
+        return (tuple(row) for row in connection.execute(
+            select([table.c.value, table.c.id]).where(table.c.value.in_(values))
+        ))
+
+
+class RefLookup:
+    """
+    A prepared lookup of references and their entities by namespace and
+    accession, for the loaders' per-record queries.
+
+    On PostgreSQL, the query is a server-side prepared statement (prepared
+    once per pooled DB connection) that takes the namespaces and accessions
+    as two array parameters (``= ANY($1)``), so its plan is reused for every
+    record. On other DBs, the ``IN`` lists are padded to the next power of
+    two, so that only a few distinct statements are ever compiled (and
+    cached, see `compiled`) or sent to the DB.
+    """
+
+    BUCKET = 256
+    """
+    Maximum length of the padded ``IN`` lists; longer lists of accessions
+    are looked up in several queries.
+    """
+
+    def __init__(self, entity, entity_ref):
+        """
+        :param entity: the entity class (`Gene` or `Protein`)
+        :param entity_ref: the reference class (`GeneRef` or `ProteinRef`)
+        """
+        self.entity = entity
+        self.entity_ref = entity_ref
+        self.compiled = {}
+        ref, table = entity_ref.__table__, entity.__table__
+        self._name = 'gnamed_{}_lookup'.format(ref.name)
+        self._columns = list(ref.c) + list(table.c)
+        self._query = select(self._columns).select_from(
+            ref.outerjoin(table, ref.c.id == table.c.id)
+        )
+        self._statements = {}
+
+    def __call__(self, session, keys) -> list:
+        """
+        Return the (reference, entity) instance pairs of all references in
+        the `session` that match any of the namespaces and any of the
+        accessions in `keys`; the entity is ``None`` for references without
+        one.
+
+        :param session: the DB session to load the instances into
+        :param keys: a collection of (namespace, accession) pairs
+        """
+        namespaces = sorted(set(ns for ns, _ in keys))
+        accessions = sorted(set(acc for _, acc in keys))
+        connection = session.connection()
+        query = session.query(self.entity_ref, self.entity)
+
+        if connection.dialect.name == 'postgresql':
+            return query.from_statement(self._prepared(connection)).params(
+                ns=namespaces, accs=accessions
+            ).all()
+
+        results = []
+
+        for accs in _batches(accessions, self.BUCKET):
+            statement, params = self._statement(namespaces, accs)
+            results.extend(query.from_statement(statement).params(
+                **params
+            ).execution_options(compiled_cache=self.compiled))
+
+        return results
+
+    def _prepared(self, connection):
+        info = connection.connection.info
+
+        if self._name not in info:
+            ref = self.entity_ref.__table__
+            sql = str(self._query.where(text(
+                '{0}.namespace = ANY($1) AND {0}.accession = ANY($2)'.format(
+                    ref.name
+                )
+            )).compile(dialect=connection.dialect))
+            logging.debug('preparing %s', self._name)
+            cursor = connection.connection.cursor()
+
+            try:
+                cursor.execute('PREPARE {} (text[], text[]) AS {}'.format(
+                    self._name, sql
+                ))
+            finally:
+                cursor.close()
+
+            info[self._name] = True
+
+        return text('EXECUTE {}(:ns, :accs)'.format(self._name)).columns(
+            *self._columns
+        )
+
+    def _statement(self, namespaces: list, accessions: list) -> tuple:
+        sizes = (_bucket(len(namespaces)), _bucket(len(accessions)))
+
+        if sizes not in self._statements:
+            ref = self.entity_ref.__table__
+            self._statements[sizes] = self._query.where(and_(
+                ref.c.namespace.in_([bindparam('ns{}'.format(i))
+                                     for i in range(sizes[0])]),
+                ref.c.accession.in_([bindparam('acc{}'.format(i))
+                                     for i in range(sizes[1])]),
+            ))
+
+        params = {}
+
+        for prefix, values, size in (('ns', namespaces, sizes[0]),
+                                     ('acc', accessions, sizes[1])):
+            # pad the list by repeating its last value
+            for i in range(size):
+                params['{}{}'.format(prefix, i)] = values[
+                    min(i, len(values) - 1)
+                ]
+
+        return self._statements[sizes], params
+
+
+def _bucket(size: int) -> int:
+    return 1 << max(size - 1, 0).bit_length()
+
+
+def _batches(items: list, size: int):
+    for offset in range(0, len(items), size):
+        yield items[offset:offset + size]
+
+
+def MapClosure(from_key, to_key):
+    """
+    List all mappings between two repositories from the mapping closure
+    table, including mappings between genes via shared proteins.
+    """
+    session = Session()
+    logging.info("mapping between %s and %s via the closure", from_key,
+                 to_key)
+
+    try:
+        for instance in session.execute(select(
+            [closure.c.from_acc, closure.c.to_acc]
+        ).where(and_(closure.c.from_ns == from_key,
+                     closure.c.to_ns == to_key))):
+            yield tuple(instance)
+    finally:
+        session.close()
+
+
+def LoadCheckpoint(path: str):
+    """
+    Return the last `Checkpoint` recorded for the file at `path` (or
+    ``None``).
+    """
+    session = Session()
+
+    try:
+        return session.query(Checkpoint).get(os.path.abspath(path))
+    finally:
+        session.close()
+
+
+def SaveCheckpoint(connection, path: str, loader: str, lines: int,
+                   records: int, complete: bool=False):
+    """
+    Record (or update) the `Checkpoint` for the file at `path`.
+
+    The checkpoint should be saved in the same transaction as the records it
+    accounts for.
+
+    :param connection: the DB connection (in the current transaction)
+    :param path: the file being loaded
+    :param loader: the name of the loader (class)
+    :param lines: the number of lines loaded from that file
+    :param records: the number of records loaded from that file
+    :param complete: whether the file has been loaded completely
+    """
+    table = Checkpoint.__table__
+    path = os.path.abspath(path)
+    connection.execute(table.delete().where(table.c.path == path))
+    connection.execute(table.insert().values(
+        path=path, loader=loader, lines=lines, records=records,
+        complete=complete, updated=func.now()
+    ))
+
+
+class LoadLock:
+    """
+    Coordinates concurrent loaders: holds PostgreSQL advisory locks for the
+    duration of a load and records the load in the `LoaderRun` registry.
+
+    A loader of a generic repository (without species-specific namespace,
+    e.g., Entrez) or one that needs the DB for itself (e.g., a bulk load)
+    holds the global lock exclusively. Loaders of organism-specific
+    repositories hold the global lock shared, plus exclusive locks on their
+    namespace and on each of its species (see
+    `gnamed.constants.SPECIES_SPACES`). Therefore, loads that might write
+    the same entities wait for each other, while loads of disjoint species
+    run in parallel. All loaders acquire their locks in the same order, so
+    waiting loaders cannot deadlock each other.
+
+    The locks are session-level locks on a connection of their own, so
+    PostgreSQL releases them if the loader dies. Other DBs have no such
+    locks; SQLite serializes all writers by itself.
+    """
+
+    PREFIX = 'gnamed:'
+    """Prefix of the names the advisory lock keys are derived from."""
+
+    def __init__(self, loader: str, namespace: str=None,
+                 exclusive: bool=False):
+        """
+        :param loader: the name of the loader (class)
+        :param namespace: the namespace of the repository to load (``None``
+                          for all repositories)
+        :param exclusive: lock the entire DB
+        """
+        self.loader = loader
+        self.namespace = namespace
+        self.locks = [('global', exclusive or namespace is None or
+                       namespace not in SPECIES_SPACES)]
+
+        if not self.locks[0][1]:
+            self.locks.append(('namespace:' + namespace, True))
+            self.locks.extend(('species:{}'.format(species_id), True)
+                              for species_id in
+                              sorted(SPECIES_SPACES[namespace]))
+
+        self.run_id = None
+        self._connection = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.release(exc_type is None)
+
+    @staticmethod
+    def key(name: str) -> int:
+        """
+        Return the (signed 64-bit) advisory lock key for a lock `name`.
+        """
+        digest = hashlib.sha1((LoadLock.PREFIX + name).encode('utf-8'))
+        return int.from_bytes(digest.digest()[:8], 'big', signed=True)
+
+    def acquire(self):
+        """
+        Register the load and wait for its locks.
+        """
+        self.run_id = self._register()
+
+        if _db.dialect.name == 'postgresql':
+            self._connection = _db.connect().execution_options(
+                isolation_level='AUTOCOMMIT'
+            )
+
+            for name, exclusive in self.locks:
+                mode = '' if exclusive else '_shared'
+
+                if not self._connection.execute(
+                    text('SELECT pg_try_advisory_lock{}(:key)'.format(mode)),
+                    key=LoadLock.key(name)
+                ).scalar():
+                    logging.info('%s waits for the %s lock (held by: %s)',
+                                 self.loader, name, ', '.join(
+                                     str(run) for run in RunningLoaders()
+                                 ) or 'unknown')
+                    self._connection.execute(
+                        text('SELECT pg_advisory_lock{}(:key)'.format(mode)),
+                        key=LoadLock.key(name)
+                    )
+
+        self._update(status='running', started=func.now())
+
+    def release(self, success: bool=True):
+        """
+        Release the locks and record the end of the load.
+        """
+        if self._connection is not None:
+            try:
+                self._connection.execute(
+                    text('SELECT pg_advisory_unlock_all()')
+                )
+            finally:
+                self._connection.close()
+                self._connection = None
+
+        if self.run_id is not None:
+            self._update(status='complete' if success else 'failed',
+                         finished=func.now())
+            self.run_id = None
+
+    def _register(self) -> int:
+        with _db.begin() as connection:
+            return connection.execute(LoaderRun.__table__.insert().values(
+                loader=self.loader, namespace=self.namespace,
+                host=socket.gethostname(), pid=os.getpid(), status='waiting',
+                started=func.now()
+            )).inserted_primary_key[0]
+
+    def _update(self, **values):
+        table = LoaderRun.__table__
+
+        with _db.begin() as connection:
+            connection.execute(table.update().where(
+                table.c.id == self.run_id
+            ).values(**values))
+
+
+def RunningLoaders() -> list:
+    """
+    Return the `LoaderRun` of each load registered as running; a load that
+    died without releasing its `LoadLock` remains registered as running.
+    """
+    session = Session()
+
+    try:
+        return session.query(LoaderRun).filter(
+            LoaderRun.status == 'running'
+        ).order_by(LoaderRun.started).all()
+    finally:
+        session.close()
+
+
+class IndexManager:
+    """
+    Manages the secondary indexes and foreign keys of the schema around bulk
+    loads.
+
+    Before a bulk load, `drop` removes all secondary (i.e., non-PK) indexes
+    declared on the schema and (if the DB supports it) all foreign keys.
+    After the load, `rebuild` creates any missing index in parallel threads,
+    re-adds any missing foreign key, and updates the table statistics.
+    As `rebuild` only adds what is missing, it can be used to recover from
+    an aborted bulk load or to add newly declared indexes to an existing DB.
+    """
+
+    THREADS = 4
+    """
+    Default number of indexes to build concurrently.
+
+    Can be configured per instance via the `threads` integer attribute.
+    """
+
+    WORK_MEM = '1GB'
+    """
+    Default PostgreSQL ``maintenance_work_mem`` setting while building the
+    indexes and foreign keys.
+
+    Can be configured per instance via the `work_mem` string attribute.
+    """
+
+    def __init__(self):
+        self.threads = IndexManager.THREADS
+        self.work_mem = IndexManager.WORK_MEM
+
+    @staticmethod
+    def indexes() -> list:
+        """
+        List all secondary indexes declared on the schema.
+        """
+        return [idx for table in _Base.metadata.sorted_tables
+                for idx in sorted(table.indexes, key=lambda i: i.name)]
+
+    @staticmethod
+    def foreignKeys() -> list:
+        """
+        List all foreign key constraints declared on the schema.
+        """
+        return [fk for table in _Base.metadata.sorted_tables
+                for fk in table.foreign_key_constraints]
+
+    def drop(self):
+        """
+        Drop all existing secondary indexes and foreign keys.
+        """
+        inspector = inspect(_db)
+        quote = _db.dialect.identifier_preparer.quote
+
+        with _db.begin() as connection:
+            if _db.dialect.name != 'sqlite':
+                for table in reversed(_Base.metadata.sorted_tables):
+                    for fk in inspector.get_foreign_keys(table.name):
+                        if fk['name']:
+                            logging.info('dropping foreign key %s on %s',
+                                         fk['name'], table.name)
+                            connection.execute(text(
+                                'ALTER TABLE {} DROP CONSTRAINT {}'.format(
+                                    quote(table.name), quote(fk['name'])
+                                )
+                            ))
+
+            for idx in self.indexes():
+                if self._exists(inspector, idx):
+                    logging.info('dropping index %s', idx.name)
+                    idx.drop(connection)
+
+    def rebuild(self):
+        """
+        Create all missing secondary indexes and foreign keys, then analyze
+        the tables.
+        """
+        inspector = inspect(_db)
+        queue = [idx for idx in self.indexes()
+                 if not self._exists(inspector, idx)]
+        errors = []
+
+        def build():
+            with _db.begin() as connection:
+                self._tune(connection)
+
+                while queue:
+                    try:
+                        idx = queue.pop()
+                    except IndexError:
+                        break
+
+                    logging.info('building index %s', idx.name)
+
+                    try:
+                        idx.create(connection)
+                    except Exception as e:
+                        errors.append(e)
+                        raise
+
+        # SQLite serializes all writers, so build its indexes one by one
+        threads = 1 if _db.dialect.name == 'sqlite' else self.threads
+        workers = [threading.Thread(target=build)
+                   for _ in range(min(threads, len(queue)))]
+
+        for thread in workers:
+            thread.start()
+
+        for thread in workers:
+            thread.join()
+
+        if errors:
+            raise errors[0]
+
+        if _db.dialect.name != 'sqlite':
+            with _db.begin() as connection:
+                self._tune(connection)
+
+                for fk in self.foreignKeys():
+                    existing = inspector.get_foreign_keys(fk.table.name)
+
+                    if not any(other['constrained_columns'] == fk.column_keys
+                               for other in existing):
+                        logging.info('adding foreign key %s(%s) on %s',
+                                     fk.referred_table.name,
+                                     ', '.join(fk.column_keys), fk.table.name)
+                        connection.execute(AddConstraint(fk))
+
+        logging.info('analyzing the tables')
+
+        with _db.begin() as connection:
+            if _db.dialect.name == 'sqlite':
+                connection.execute(text('ANALYZE'))
+            else:
+                for table in _Base.metadata.sorted_tables:
+                    connection.execute(text('ANALYZE {}'.format(table.name)))
+
+    def _tune(self, connection):
+        if connection.dialect.name == 'postgresql':
+            connection.execute(text("SET LOCAL maintenance_work_mem = '{}'"
+                                    .format(self.work_mem)))
+
+    @staticmethod
+    def _exists(inspector, idx: Index) -> bool:
+        return idx.name in {i['name'] for i in
+                            inspector.get_indexes(idx.table.name)}
+
+
+class IdAllocator:
+    """
+    A hi/lo allocator of entity IDs.
+
+    Reserves blocks of IDs from the entity's sequence with a single query
+    (``nextval`` over ``generate_series`` on PostgreSQL), so that loaders
+    can assign the IDs of new entities client-side. As every ID is drawn
+    from the sequence, any number of concurrent loaders can allocate IDs
+    safely. On DBs without sequences (e.g., SQLite), blocks are reserved
+    above the current maximum ID instead, which is only safe for a single
+    loader at a time.
+    """
+
+    BLOCK = 10000
+    """
+    Default number of IDs to reserve at a time.
+
+    Can be configured per instance via the `block` integer attribute.
+    """
+
+    def __init__(self, entity):
+        """
+        :param entity: the entity class (`Gene` or `Protein`)
+        """
+        self.table = entity.__table__
+        self.sequence = self.table.c.id.default
+        self.block = IdAllocator.BLOCK
+        self._ids = iter(())
+        self._last = 0
+
+    def next(self, connection) -> int:
+        """
+        Return the next free ID, reserving a new block of IDs if necessary.
+
+        :param connection: the DB connection to reserve IDs with
+        """
+        try:
+            return next(self._ids)
+        except StopIteration:
+            self._ids = iter(self._reserve(connection))
+            return next(self._ids)
+
+    def _reserve(self, connection):
+        logging.debug('reserving %s IDs for %s', self.block, self.table.name)
+
+        if connection.dialect.name == 'postgresql':
+            return sorted(row[0] for row in connection.execute(
+                select([self.sequence.next_value()]).select_from(
+                    func.generate_series(1, self.block)
+                )
+            ))
+        elif connection.dialect.supports_sequences:
+            return [connection.execute(self.sequence)
+                    for _ in range(self.block)]
+        else:
+            start = connection.execute(
+                select([func.max(self.table.c.id)])
+            ).scalar() or 0
+            start = max(start, self._last) + 1
+            self._last = start + self.block - 1
+            return range(start, self._last + 1)
 
 
 class Species(_Base):
@@ -333,7 +1551,16 @@ mapping = Table(
     ), primary_key=True),
     Column('protein_id', BigInteger, ForeignKey(
         'proteins.id', onupdate='CASCADE', ondelete='CASCADE'
-    ), primary_key=True),
+    ), primary_key=True, index=True),
+)
+
+closure = Table(
+    'mapping_closure', _Base.metadata,
+    Column('from_ns', String(8), primary_key=True),
+    Column('from_acc', String(64), primary_key=True),
+    Column('to_ns', String(8), primary_key=True),
+    Column('to_acc', String(64), primary_key=True),
+    Index('mapping_closure_pair_idx', 'from_ns', 'to_ns'),
 )
 
 
@@ -341,7 +1568,7 @@ class Gene(_Base):
 
     __tablename__ = 'genes'
 
-    id = Column(BigInteger, Sequence('genes_id_seq', optional=True),
+    id = Column(_EntityId, Sequence('genes_id_seq', optional=True),
                 primary_key=True)
     species_id = Column(Integer, ForeignKey(
         'species.id', onupdate='CASCADE', ondelete='CASCADE'
@@ -371,7 +1598,7 @@ class Protein(_Base):
 
     __tablename__ = 'proteins'
 
-    id = Column(BigInteger, Sequence('proteins_id_seq', optional=True),
+    id = Column(_EntityId, Sequence('proteins_id_seq', optional=True),
                 primary_key=True)
     species_id = Column(Integer, ForeignKey(
         'species.id', onupdate='CASCADE', ondelete='CASCADE'
@@ -420,7 +1647,7 @@ class GeneRef(EntityRef, _Base):
 
     id = Column(BigInteger, ForeignKey(
         'genes.id', onupdate='CASCADE', ondelete='SET NULL'
-    ))
+    ), index=True)
 
     def __init__(self, namespace: str, accession: str,
                  symbol: str=None, name: str=None, id: int=None):
@@ -438,7 +1665,7 @@ class ProteinRef(EntityRef, _Base):
 
     id = Column(BigInteger, ForeignKey(
         'proteins.id', onupdate='CASCADE', ondelete='SET NULL'
-    ))
+    ), index=True)
 
     def __init__(self, namespace: str, accession: str,
                  symbol: str=None, name: str=None, id: int=None):
@@ -457,7 +1684,7 @@ class Gene2PubMed(_Base):
     id = Column(BigInteger, ForeignKey(
         'genes.id', onupdate='CASCADE', ondelete='CASCADE'
     ), primary_key=True)
-    pmid = Column(Integer, primary_key=True)
+    pmid = Column(Integer, primary_key=True, index=True)
 
     def __init__(self, id: int, pmid: int):
         self.id = id
@@ -477,7 +1704,7 @@ class Protein2PubMed(_Base):
     id = Column(BigInteger, ForeignKey(
         'proteins.id', onupdate='CASCADE', ondelete='CASCADE'
     ), primary_key=True)
-    pmid = Column(Integer, primary_key=True)
+    pmid = Column(Integer, primary_key=True, index=True)
 
     def __init__(self, id: int, pmid: int):
         self.id = id
@@ -490,49 +1717,136 @@ class Protein2PubMed(_Base):
         return "<Protein2PubMed:{}:{}>".format(self.id, self.pmid)
 
 
-class GeneString(_Base):
+class StringValue(_Base):
 
-    __tablename__ = 'gene_strings'
+    __tablename__ = 'string_values'
+
+    id = Column(Integer, Sequence('string_values_id_seq', optional=True),
+                primary_key=True)
+    value = Column(Text, nullable=False, unique=True)
+
+    def __init__(self, value: str):
+        self.value = value
+
+    def __repr__(self) -> str:
+        return '<StringValue:{} "{}">'.format(self.id, self.value)
+
+    def __str__(self) -> str:
+        return self.value
+
+
+class EntityString:
+    """
+    The strings of an entity, by category, stored as references to the
+    `StringValue` dictionary.
+
+    The `value` of new instances is resolved to its string ID (using the
+    `StringCache`) when the session is flushed.
+    """
 
-    id = Column(BigInteger, ForeignKey(
-        'genes.id', onupdate='CASCADE', ondelete='CASCADE'
-    ), primary_key=True)
     cat = Column(String(32), primary_key=True, index=True)
-    value = Column(Text, primary_key=True)
+
+    @declared_attr
+    def string_id(cls):
+        return Column(Integer, ForeignKey(
+            'string_values.id', onupdate='CASCADE', ondelete='CASCADE'
+        ), primary_key=True, autoincrement=False)
+
+    @declared_attr
+    def string(cls):
+        return relationship(StringValue, lazy='joined')
 
     def __init__(self, id: int, cat: str, value: str):
         self.id = id
         self.cat = cat
         self.value = value
 
+    @property
+    def value(self) -> str:
+        value = getattr(self, '_value', None)
+
+        if value is None and self.string is not None:
+            value = self.string.value
+
+        return value
+
+    @value.setter
+    def value(self, value: str):
+        self._value = value
+
+    def __str__(self) -> str:
+        return self.value
+
+
+class GeneString(EntityString, _Base):
+
+    __tablename__ = 'gene_strings'
+
+    id = Column(BigInteger, ForeignKey(
+        'genes.id', onupdate='CASCADE', ondelete='CASCADE'
+    ), primary_key=True)
+
     def __repr__(self) -> str:
         return '<GeneString:{}:{} "{}">'.format(
             self.id, self.cat, self.value
         )
 
-    def __str__(self) -> str:
-        return self.value
 
-
-class ProteinString(_Base):
+class ProteinString(EntityString, _Base):
 
     __tablename__ = 'protein_strings'
 
     id = Column(BigInteger, ForeignKey(
         'proteins.id', onupdate='CASCADE', ondelete='CASCADE'
     ), primary_key=True)
-    cat = Column(String(32), primary_key=True, index=True)
-    value = Column(Text, primary_key=True)
-
-    def __init__(self, id: int, cat: str, value: str):
-        self.id = id
-        self.cat = cat
-        self.value = value
 
     def __repr__(self) -> str:
         return '<ProteinString:{}:{} "{}">'.format(
             self.id, self.cat, self.value
         )
 
+
+class Checkpoint(_Base):
+    """
+    The number of lines and records of a file committed by a loader.
+    """
+
+    __tablename__ = 'load_checkpoints'
+
+    path = Column(Text, primary_key=True)
+    loader = Column(String(64), nullable=False)
+    lines = Column(BigInteger, nullable=False)
+    records = Column(BigInteger, nullable=False)
+    complete = Column(Boolean, nullable=False, default=False)
+    updated = Column(DateTime)
+
+    def __repr__(self) -> str:
+        return '<Checkpoint:{} {}:{}{}>'.format(
+            self.loader, self.path, self.lines,
+            ' (complete)' if self.complete else ''
+        )
+
+
+class LoaderRun(_Base):
+    """
+    A load registered by its `LoadLock`.
+    """
+
+    __tablename__ = 'loader_runs'
+
+    id = Column(Integer, Sequence('loader_runs_id_seq', optional=True),
+                primary_key=True)
+    loader = Column(String(64), nullable=False)
+    namespace = Column(String(8))
+    host = Column(String(255), nullable=False)
+    pid = Column(Integer, nullable=False)
+    status = Column(String(8), nullable=False)
+    started = Column(DateTime, nullable=False)
+    finished = Column(DateTime)
+
+    def __repr__(self) -> str:
+        return '<LoaderRun:{} {}>'.format(self.id, self)
+
     def __str__(self) -> str:
-        return self.value
+        return '{} ({}:{} since {})'.format(self.loader, self.host, self.pid,
+                                           self.started)
@@ -0,0 +1,235 @@
+"""
+.. py:module:: gnamed.parsed
+   :synopsis: A compressed, splittable cache of parsed gene/protein records.
+
+Parsing the large repositories (TrEMBL, Entrez gene_info) takes hours, while
+the parsed records only change with the files. Therefore, the records a
+parser produces can be written to a cache file (see ``gnamed parse``) and
+loaded from there later (see ``gnamed load --from-parsed``), skipping the
+parsers entirely. Cache files are named after the repository key and the
+checksum of the SHA-1 hashes of the parsed files (see `Checksum` and
+`CachePath`), so a cache is only used for exactly the same input files. As
+the file hashes are the keys of the release store (see `gnamed.releases`),
+the checksum of a stored release is known without reading its files.
+
+File layout::
+
+    MAGIC | frame... | index | index offset | MAGIC
+
+Each frame holds up to `BATCH` records as a zlib-compressed, marshalled list
+of (kind, namespace, accession, record tuple) tuples (see
+`AbstractRecord.toTuple`). The (compressed, marshalled) index at the end of
+the file holds the byte offsets of all frames, the number of records, and
+the checksum. As the frames are independent of each other, any number of
+readers can consume a cache in parallel (see `RecordReader.read`).
+
+.. moduleauthor:: Florian Leitner <florian.leitner@gmail.com>
+.. License: GNU GPL v3 (http://www.gnu.org/licenses/gpl.html)
+"""
+import hashlib
+import logging
+import marshal
+import os
+import struct
+import zlib
+
+from gnamed.loader import DBRef, GeneRecord, ProteinRecord
+
+MAGIC = b'GNAMEDR1'
+"""File signature and format version of parsed-record cache files."""
+
+BATCH = 10000
+"""Number of records per (compressed) frame."""
+
+SUFFIX = '.records'
+"""File name extension of parsed-record cache files."""
+
+_SIZE = struct.Struct('<I')
+_TRAILER = struct.Struct('<Q8s')
+_RECORDS = {'gene': GeneRecord, 'protein': ProteinRecord}
+
+
+def FileHash(path: str) -> str:
+    """
+    Return the hex SHA-1 digest of the contents of the file at `path`.
+    """
+    digest = hashlib.sha1()
+
+    with open(path, 'rb') as stream:
+        for chunk in iter(lambda: stream.read(1 << 20), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def Digest(*hashes: str) -> str:
+    """
+    Return the checksum of a sequence of (hex SHA-1) file `hashes`.
+    """
+    return hashlib.sha1(''.join(hashes).encode('ascii')).hexdigest()
+
+
+def Checksum(*paths: str) -> str:
+    """
+    Return the checksum of the contents of all files at `paths`.
+    """
+    return Digest(*(FileHash(path) for path in paths))
+
+
+def CachePath(directory: str, key: str, checksum: str) -> str:
+    """
+    Return the path of the parsed-record cache file in `directory` for the
+    files of the repository with the given `key` and `checksum`.
+    """
+    return os.path.join(directory, '{}-{}{}'.format(key, checksum, SUFFIX))
+
+
+class RecordWriter:
+    """
+    Writes parsed records to a cache file.
+
+    The records are written to a temporary file that only replaces the
+    file at `path` when the writer is closed, so incomplete caches never
+    appear under that name. If the writer is discarded instead (or the
+    context of a ``with`` block is left with an exception), the temporary
+    file is removed.
+    """
+
+    def __init__(self, path: str, checksum: str=None):
+        """
+        :param path: the cache file to write
+        :param checksum: the checksum of the parsed files (if known)
+        """
+        self.path = path
+        self.checksum = checksum
+        self.count = 0
+        self._tmp = '{}.tmp{}'.format(path, os.getpid())
+        self._stream = open(self._tmp, 'wb')
+        self._stream.write(MAGIC)
+        self._frames = []
+        self._batch = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def write(self, db_key: DBRef, record):
+        """
+        Add a (`GeneRecord` or `ProteinRecord`) record and its "primary"
+        (namespace, accession) key to the cache.
+        """
+        kind = 'gene' if isinstance(record, GeneRecord) else 'protein'
+        self._batch.append((kind, db_key.namespace, db_key.accession,
+                            record.toTuple()))
+        self.count += 1
+
+        if len(self._batch) == BATCH:
+            self._writeFrame()
+
+    def close(self):
+        """
+        Write the index and move the finished cache file into place.
+        """
+        if self._stream is None:
+            return
+
+        if self._batch:
+            self._writeFrame()
+
+        offset = self._stream.tell()
+        self._stream.write(zlib.compress(marshal.dumps({
+            'frames': self._frames, 'records': self.count,
+            'checksum': self.checksum,
+        })))
+        self._stream.write(_TRAILER.pack(offset, MAGIC))
+        self._stream.close()
+        self._stream = None
+        os.replace(self._tmp, self.path)
+        logging.info('cached %s parsed records in %s', self.count, self.path)
+
+    def discard(self):
+        """
+        Remove the incomplete cache file.
+        """
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+            os.remove(self._tmp)
+            logging.info('discarded the parsed records for %s', self.path)
+
+    def _writeFrame(self):
+        data = zlib.compress(marshal.dumps(self._batch))
+        self._frames.append(self._stream.tell())
+        self._stream.write(_SIZE.pack(len(data)))
+        self._stream.write(data)
+        self._batch = []
+
+
+class RecordReader:
+    """
+    Reads the parsed records from a cache file.
+
+    Iterating over a reader yields all (db_key, record) pairs in the order
+    they were written; use `read` to consume only a part of the frames.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: the cache file to read
+        """
+        self.path = path
+        self._stream = open(path, 'rb')
+
+        if self._stream.read(len(MAGIC)) != MAGIC:
+            self._stream.close()
+            raise ValueError('{} is not a parsed-record cache'.format(path))
+
+        self._stream.seek(-_TRAILER.size, os.SEEK_END)
+        offset, magic = _TRAILER.unpack(self._stream.read(_TRAILER.size))
+
+        if magic != MAGIC:
+            self._stream.close()
+            raise ValueError('{} is incomplete'.format(path))
+
+        end = self._stream.seek(0, os.SEEK_END) - _TRAILER.size
+        self._stream.seek(offset)
+        index = marshal.loads(zlib.decompress(
+            self._stream.read(end - offset)
+        ))
+        self.frames = index['frames']
+        self.count = index['records']
+        self.checksum = index['checksum']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self):
+        return self.read()
+
+    def close(self):
+        self._stream.close()
+
+    def read(self, part: int=0, parts: int=1):
+        """
+        Yield the (db_key, record) pairs of every `parts`-th frame, starting
+        with frame `part`, so that `parts` readers (e.g., in separate
+        processes) can consume a cache in parallel.
+        """
+        for offset in self.frames[part::parts]:
+            self._stream.seek(offset)
+            size, = _SIZE.unpack(self._stream.read(_SIZE.size))
+
+            for kind, ns, acc, data in marshal.loads(
+                    zlib.decompress(self._stream.read(size))):
+                yield DBRef(ns, acc), _RECORDS[kind].fromTuple(data)
@@ -9,16 +9,19 @@ import logging
 import sys
 import io
 
-from psycopg2 import Error
-from gnamed.orm import Session
+from gnamed.metrics import OpenCounted
+from gnamed.orm import IsDbError, LoadCheckpoint, SaveCheckpoint, Session
 from progress_bar import InitBarForInfile
+from time import perf_counter
 
 
 class AbstractParser:
     """
     An abstract parser implementation that opens file streams, handles DB
-    sessions (creating, flushing, committing) and creates a
-    `progress_bar` given the log-level.
+    sessions (creating, flushing, committing) and reports the progress of
+    each file: to a `gnamed.metrics.Metrics` emitter, if set as the
+    `metrics` attribute, or else with a `progress_bar` on a terminal
+    (given the log-level).
     """
 
     FLUSH = 10000
@@ -28,60 +31,175 @@ class AbstractParser:
     Can be configured per instance via the `flush` integer attribute.
     """
 
-    def __init__(self, *files: str, encoding: str=sys.getdefaultencoding()):
+    COMMIT = None
+    """
+    Default number of records to parse before invoking `_commit`; if
+    ``None``, the records are only committed at the end of each file.
+
+    Can be configured per instance via the `commit` integer attribute.
+    """
+
+    PROGRESS = 1000
+    """
+    Number of lines to parse between two progress updates.
+    """
+
+    RESUMABLE = False
+    """
+    Whether the parser can resume a file after the last committed line
+    (i.e., the parser holds no state across committed records).
+    """
+
+    TOLERANT = False
+    """
+    Default setting whether to reject records that cannot be parsed (or
+    loaded) and continue, rather than to abort the file.
+
+    Can be configured per instance via the `tolerant` boolean attribute.
+    """
+
+    MULTILINE = False
+    """
+    Whether the parser builds a record over several lines (and `_parse`
+    only returns the record once its last line was parsed); the lines of
+    an incomplete record are kept, so they can be rejected with it.
+    """
+
+    def __init__(self, *files, encoding: str=sys.getdefaultencoding()):
         """
-        :param files: any number of files (pathnames) to load
+        :param files: any number of files (pathnames or objects with a
+                      ``name`` and an ``open(encoding)`` method, e.g., a
+                      `gnamed.fetcher.RemoteFile`) to load
         :param encoding: the character encoding used by these files
         """
         self.session = None
         self.db_refs = None
         self.files = files
         self.encoding = encoding
+        self.encodings = {}
         self.record = None
         self.current_id = None
         self.flush = AbstractParser.FLUSH
+        self.commit = AbstractParser.COMMIT
+        self.checkpoint = False
+        self.resume = False
+        self.tolerant = AbstractParser.TOLERANT
+        self.rejects = None
+        self.rejected = 0
+        self.metrics = None
+        self._raw = []
+        self._reader = None
+
+    @property
+    def name(self) -> str:
+        """
+        The qualified class name of this parser.
+        """
+        return '{}.{}'.format(self.__class__.__module__,
+                              self.__class__.__name__)
 
-    def parse(self):
+    def parse(self) -> bool:
         """
-        Parse all relevant files and commit the added records to the DB.
+        Parse all relevant files and commit the added records to the DB;
+        return ``True`` if all files were parsed and committed.
 
         Manages DB session state/handling and flushes parsed records to the
-        DB every `flush` records.
+        DB every `flush` records. If `commit` is set, the records are
+        committed and the session is cleared every `commit` records, so the
+        memory use does not grow with the size of the files.
+
+        If `checkpoint` is set, the number of lines and records of each file
+        are recorded (in the ``load_checkpoints`` table) with every commit.
+        If the parser is `RESUMABLE` and `resume` is set, completed files are
+        skipped and any other file is continued after the last checkpoint.
+
+        If `tolerant` is set, records that cannot be parsed or loaded are
+        rejected (see `_reject`) and parsing continues with the next record.
         """
+        if self.resume and not self.RESUMABLE:
+            raise RuntimeError('{} cannot resume files'.format(
+                self.__class__.__name__
+            ))
+
+        success = True
+
         for file in self.files:
-            self.session = Session(autoflush=False)
-            logging.info('parsing %s (%s)', file, self.encoding)
-            stream = open(file, encoding=self.encoding)
-            progress_bar = None
+            path = getattr(file, 'name', file)
+            position = None
 
-            if logging.getLogger().getEffectiveLevel() > logging.DEBUG:
-                progress_bar = InitBarForInfile(file)
+            if self.resume:
+                position = LoadCheckpoint(path)
 
+                if position is not None and position.complete:
+                    logging.info('skipping completed file %s', path)
+                    continue
+
+            self.session = Session(autoflush=False)
+            logging.info('parsing %s (%s)', path,
+                         self.encodings.get(file, self.encoding))
+            stream = self._open(file)
+            progress = self._progress(path)
             self.record = None
             self.current_id = None
             self.db_refs = {}
+            self._raw = []
             line_count = self._setup(stream)
+            num_records = 0
+            committed = 0
+            rejected = self.rejected
+
+            if position is not None:
+                logging.info('resuming %s after line %s', path,
+                             position.lines)
+
+                while line_count < position.lines:
+                    stream.readline()
+                    line_count += 1
+
+                num_records = committed = position.records
 
             line = stream.readline().strip()
             line_count += 1
-            num_records = 0
 
             while line:
                 try:
-                    if progress_bar is not None and line_count % 100 == 0:
-                        #noinspection PyCallingNonCallable
-                        progress_bar(stream.tell())
+                    if progress is not None and \
+                            line_count % self.PROGRESS == 0:
+                        progress(line_count, num_records)
+
+                    if not self.tolerant:
+                        num_records += self._parse(line)
+                    else:
+                        self._raw.append(line)
 
-                    num_records += self._parse(line)
+                        try:
+                            parsed = self._parse(line)
+                        except Exception as e:
+                            lines = self._recover(line, stream)
+                            line_count += len(lines)
+                            self._reject(self._raw + lines, e)
+                            self._raw = []
+                        else:
+                            num_records += parsed
+
+                            if parsed or not self.MULTILINE:
+                                self._raw = []
 
                     if num_records and num_records % self.flush == 0:
+                        started = perf_counter()
                         self._flush()
 
+                        if self.metrics is not None:
+                            self.metrics.flushed(perf_counter() - started)
+
+                    if self.commit and num_records - committed >= self.commit:
+                        self._commit(path, line_count, num_records)
+                        committed = num_records
+
                     line = stream.readline().strip()
                     line_count += 1
                 except Exception as e:
-                    if progress_bar is not None:
-                        del progress_bar
+                    progress = None
 
                     logging.warning("%s while parsing line %s:\n%s",
                                     e.__class__.__name__, line_count,
@@ -92,32 +210,40 @@ class AbstractParser:
                     else:
                         logging.fatal(str(e).strip())
 
-                    if self.session is not None and isinstance(e, Error):
-                        self.session.rollback()
+                    if IsDbError(e):
+                        self._rollback()
 
-                    return
+                    stream.close()
+                    return False
 
+            self._raw = []
             num_records += self._cleanup(stream)
+            stream.close()
 
-            if progress_bar is not None:
-                del progress_bar
+            if progress is not None:
+                progress(line_count, num_records, True)
+                progress = None
 
-            if self.session is not None:
-                try:
-                    self.session.commit()
-                except Exception as e:
-                    self.session.rollback()
-                    logging.warning("%s while committing the parsed data",
-                                    e.__class__.__name__)
+            try:
+                self._commit(path, line_count, num_records, complete=True)
+            except Exception as e:
+                self._rollback()
+                success = False
+                logging.warning("%s while committing the parsed data",
+                                e.__class__.__name__)
 
-                    if logging.getLogger().getEffectiveLevel() <= logging.INFO:
-                        logging.exception(e)
-                    else:
-                        logging.error(str(e).strip())
+                if logging.getLogger().getEffectiveLevel() <= logging.INFO:
+                    logging.exception(e)
                 else:
-                    logging.info("parsed %s records from %s", num_records,
-                                 file)
+                    logging.error(str(e).strip())
+            else:
+                logging.info("parsed %s records from %s", num_records, path)
 
+                if self.rejected > rejected:
+                    logging.warning("rejected %s records from %s",
+                                    self.rejected - rejected, path)
+
+            if self.session is not None:
                 try:
                     self.session.close()
                 except Exception as e:
@@ -131,6 +257,58 @@ class AbstractParser:
                 finally:
                     self.session = None
 
+        return success
+
+    def _open(self, file) -> io.TextIOBase:
+        """
+        Open the `file` (a pathname or an object with an ``open(encoding)``
+        method) as a text stream, using its encoding in `encodings` (e.g.,
+        of files fetched without transcoding) or the default `encoding`.
+        Gzip-compressed files (``.gz``) are decompressed on the fly.
+
+        The bytes read from pathnames are counted by a
+        `gnamed.metrics.CountingReader`, kept as the `_reader` of the file.
+        """
+        encoding = self.encodings.get(file, self.encoding)
+
+        if isinstance(file, str):
+            # count the bytes read instead of asking the stream to tell()
+            stream, self._reader = OpenCounted(file, encoding)
+            return stream
+
+        self._reader = None
+        return file.open(encoding)
+
+    def _progress(self, path: str):
+        """
+        Return a function that reports the progress of parsing the file at
+        `path` given the number of lines and records parsed so far (and
+        whether the file is done), or ``None`` if there is no one to report
+        to.
+        """
+        reader = self._reader
+
+        if self.metrics is not None:
+            metrics = self.metrics
+            metrics.begin(self.name, path, reader and reader.size)
+
+            def update(lines: int, records: int, done: bool=False):
+                metrics.update(lines, records, reader and reader.count,
+                               self.session, force=done)
+
+            return update
+        elif reader is not None and sys.stderr.isatty() and \
+                logging.getLogger().getEffectiveLevel() > logging.DEBUG:
+            progress_bar = InitBarForInfile(path)
+
+            def show(lines: int, records: int, done: bool=False):
+                #noinspection PyCallingNonCallable
+                progress_bar(reader.count)
+
+            return show
+
+        return None
+
     def _setup(self, stream: io.TextIOWrapper) -> int:
         """
         Setup the virgin stream and return the line count into the stream after
@@ -150,6 +328,60 @@ class AbstractParser:
         """
         raise NotImplementedError('abstract')
 
+    def _commit(self, path: str, lines: int, records: int,
+                complete: bool=False):
+        """
+        Commit the parsed records (and, if enabled, the checkpoint for the
+        file at `path`) and clear the session.
+
+        :param path: the file being parsed
+        :param lines: the number of lines parsed from that file
+        :param records: the number of records parsed from that file
+        :param complete: whether the file has been parsed completely
+        """
+        if self.session is not None:
+            if self.checkpoint:
+                SaveCheckpoint(self.session.connection(), path, self.name,
+                               lines, records, complete)
+
+            self.session.commit()
+            self.session.expunge_all()
+
+    def _rollback(self):
+        """
+        Roll back any uncommitted records.
+        """
+        if self.session is not None:
+            self.session.rollback()
+
+    def _recover(self, line: str, stream: io.TextIOWrapper) -> list:
+        """
+        Reset the parser state after the given `line` could not be parsed (or
+        its record could not be loaded) and return any further lines of the
+        broken record that were consumed from the stream.
+        """
+        self.record = None
+        return []
+
+    def _reject(self, lines: list, error: Exception):
+        """
+        Reject a record that could not be parsed or loaded: log the error
+        and write a comment line with the error followed by the record's
+        `lines` to the `rejects` stream (if any).
+        """
+        self.rejected += 1
+        message = ' '.join(str(error).split())
+        logging.warning('rejected a record after %s: %s',
+                        error.__class__.__name__, message)
+
+        if self.rejects is not None:
+            self.rejects.write('# {}: {}\n'.format(error.__class__.__name__,
+                                                   message))
+
+            for line in lines:
+                self.rejects.write(line)
+                self.rejects.write('\n')
+
     def _cleanup(self, stream: io.TextIOWrapper) -> int:
         """
         Clean up the stream and dangling records and return the number of
@@ -9,10 +9,11 @@ import logging
 import io
 
 from collections import namedtuple, defaultdict
-from sqlalchemy.schema import Sequence
 
 from gnamed.constants import Namespace
 from gnamed.loader import GeneRecord, AbstractLoader, DBRef
+from gnamed.orm import Connection, CopyFrom, InternStrings, SaveCheckpoint, \
+    Gene, GeneRef, GeneString, Gene2PubMed
 
 Line = namedtuple('Line', [
     'species_id', 'id',
@@ -120,6 +121,8 @@ class Parser(AbstractLoader):
     Implements the `AbstractParser._parse` method.
     """
 
+    NAMESPACE = Namespace.entrez
+
     def _setup(self, stream: io.TextIOWrapper):
         assert len(self.files) == 2, \
             'received {} files, expected 2'.format(len(self.files))
@@ -266,7 +269,7 @@ class Parser(AbstractLoader):
         if db_key.accession in self._pmidMapping:
             record.pmids = self._pmidMapping[db_key.accession]
 
-        self._loadRecord(db_key, record)
+        self._storeRecord(db_key, record)
         return 1
 
 
@@ -275,67 +278,81 @@ class SpeedLoader(Parser):
     Overrides the database loading methods to directly dump all data "as is".
     """
 
-    def setDSN(self, dsn: str):
-        """
-        Set the DSN string for connecting psycopg2 to a Postgres DB.
-
-        :param dsn: the DSN string
-        """
-        self._dsn = dsn
-
     def _initBuffers(self):
         self._genes = io.StringIO()
         self._gene_refs = io.StringIO()
-        self._gene_strings = io.StringIO()
+        self._gene_strings = []
         self._gene2pmids = io.StringIO()
         #self._mappings = io.StringIO()
 
-    def _setup(self, stream: io.TextIOWrapper) -> int:
-        lines = super(SpeedLoader, self)._setup(stream)
-        self._gene_id = self.session.execute(Sequence('genes_id_seq'))
+    def _prepare(self):
+        super(SpeedLoader, self)._prepare()
         self._db_key2pid_map = dict()
         self._initBuffers()
         self._connect()
         #self._loadExistingLinks()
-        return lines
 
     def _connect(self):
-        import psycopg2
-
-        self._conn = psycopg2.connect(self._dsn)
+        self._connection = Connection()
+        self._transaction = self._connection.begin()
 
     def _loadExistingLinks(self):
-        cursor = self._conn.cursor('links')
-        cursor.execute("SELECT namespace, accession, id FROM protein_refs;")
-
-        for ns, acc, pid in cursor:
+        for ns, acc, pid in self._connection.execution_options(
+                stream_results=True).execute(
+                "SELECT namespace, accession, id FROM protein_refs;"):
             self._db_key2pid_map[DBRef(ns, acc)].add(pid)
 
-        cursor.close()
-
     def _flush(self):
-        cur = self._conn.cursor()
         stream = lambda buffer: io.StringIO(buffer.getvalue())
+        CopyFrom(self._connection, Gene.__table__, stream(self._genes))
+        CopyFrom(self._connection, GeneRef.__table__,
+                 stream(self._gene_refs))
+        CopyFrom(self._connection, GeneString.__table__,
+                 self._internStrings(), columns=('id', 'cat', 'string_id'))
+        CopyFrom(self._connection, Gene2PubMed.__table__,
+                 stream(self._gene2pmids))
+        #CopyFrom(self._connection, mapping, stream(self._mappings))
+        self._initBuffers()
+
+    def _internStrings(self) -> io.StringIO:
+        # resolve the string IDs of all buffered strings in one batch
+        ids = InternStrings(self._connection,
+                            (val for _, _, val in self._gene_strings))
+        return io.StringIO(''.join(
+            '{}\t{}\t{}\n'.format(eid, cat, ids[val])
+            for eid, cat, val in self._gene_strings
+        ))
+
+    def _commit(self, path: str, lines: int, records: int,
+                complete: bool=False):
+        """
+        Overrides the `AbstractParser._commit` method to COPY and commit the
+        buffered records on the loader's own connection.
+        """
+        self._flush()
 
+        if self.checkpoint:
+            SaveCheckpoint(self._connection, path, self.name, lines,
+                           records, complete)
+
+        self._transaction.commit()
+
+        if complete:
+            self._connection.close()
+        else:
+            self._transaction = self._connection.begin()
+
+        if self.session is not None:
+            self.session.commit()
+            self.session.expunge_all()
+
+    def _rollback(self):
         try:
-            cur.copy_from(stream(self._genes), 'genes')
-            cur.copy_from(stream(self._gene_refs), 'gene_refs')
-            cur.copy_from(stream(self._gene_strings), 'gene_strings')
-            cur.copy_from(stream(self._gene2pmids), 'gene2pubmed')
-            #cur.copy_from(stream(self._mappings), 'genes2proteins')
-            cur.execute("ALTER SEQUENCE genes_id_seq RESTART WITH %s",
-                        (self._gene_id,))
+            self._transaction.rollback()
         finally:
-            cur.close()
-
-        self._initBuffers()
+            self._connection.close()
 
-    def _cleanup(self, stream: io.TextIOWrapper) -> int:
-        super(SpeedLoader, self)._cleanup(stream)
-        self._flush()
-        self._conn.commit()
-        self._conn.close()
-        return 0  # no new records
+        super(SpeedLoader, self)._rollback()
 
     def _loadRecord(self, db_key: DBRef, record: GeneRecord):
         """
@@ -345,33 +362,30 @@ class SpeedLoader(Parser):
         :param record: the `GeneRecord` to load
         """
         assert not record.mappings, "speedloader does not handle mappings"
-        gid = str(self._gene_id)
-
-        self._genes.write('{}\t{}\t{}\t{}\n'.format(
+        gid = self.ids['gene'].next(self._connection)
+        # only buffer the rows once all rows of the record were built, so a
+        # rejected (tolerant) record leaves no partial rows in the buffers
+        gene = '{}\t{}\t{}\t{}\n'.format(
             gid, str(record.species_id),
             '\\N' if record.chromosome is None else record.chromosome,
             '\\N' if record.location is None else record.location
-        ))
-
-        self._gene_refs.write('{}\t{}\t{}\t{}\t{}\n'.format(
+        )
+        refs = ['{}\t{}\t{}\t{}\t{}\n'.format(
             db_key.namespace, db_key.accession,
             '\\N' if record.symbol is None else record.symbol,
             '\\N' if record.name is None else record.name, gid
-        ))
+        )]
 
         for ns, acc in record.refs:
             if ns != db_key.namespace or acc != db_key.accession:
-                self._gene_refs.write(
-                    '{}\t{}\t\\N\t\\N\t{}\n'.format(ns, acc, gid)
-                )
-
-        for cat, values in record.strings.items():
-            for val in values:
-                self._gene_strings.write(
-                    '{}\t{}\t{}\n'.format(gid, cat, val)
-                )
+                refs.append('{}\t{}\t\\N\t\\N\t{}\n'.format(ns, acc, gid))
 
-        for pmid in record.pmids:
-            self._gene2pmids.write('{}\t{}\n'.format(gid, pmid))
+        strings = [(gid, cat, val) for cat, values in record.strings.items()
+                   for val in values]
+        pmids = ''.join('{}\t{}\n'.format(gid, pmid) for pmid in record.pmids)
+        self._genes.write(gene)
+        self._gene_refs.write(''.join(refs))
+        self._gene_strings.extend(strings)
+        self._gene2pmids.write(pmids)
 
-        self._gene_id += 1
+        self._markDirty('gene', gid)
@@ -77,8 +77,18 @@ class Parser(AbstractLoader):
     Implements the `AbstractParser._parse` method.
     """
 
-    def _setup(self, stream: io.TextIOWrapper):
-        lines = super(Parser, self)._setup(stream)
+    NAMESPACE = Namespace.hgnc
+
+    RESUMABLE = True
+
+    def _prepare(self):
+        super(Parser, self)._prepare()
+
+        if self.cache is not None:
+            # parsing into a cache does not write to the DB; the links are
+            # corrected when the cache is loaded
+            return
+
         logging.debug('correcting wrong links by Entrez')
 
         try:
@@ -96,12 +106,15 @@ class Parser(AbstractLoader):
                     '%s:388159 to %s:648809', Namespace.hgnc,
                     Namespace.entrez, Namespace.entrez)
                 self.session.commit()
-                # commit, because otherwise multiple
-                # parsers would hang here waiting for
-                # each others commit
+                # commit right away, so concurrent
+                # loaders do not wait on this row until
+                # the whole load is committed (see
+                # `gnamed.orm.LoadLock`)
         except NoResultFound:
             pass
 
+    def _setup(self, stream: io.TextIOWrapper):
+        lines = super(Parser, self)._setup(stream)
         logging.debug("file header:\n%s", stream.readline().strip())
         return lines + 1
 
@@ -171,6 +184,10 @@ class Parser(AbstractLoader):
                     if subsubname.lower() not in ('other', '"other"'):
                         record.addKeyword(subsubname)
 
+        self._storeRecord(db_key, record)
+        return 1
+
+    def _loadParsed(self, db_key: DBRef, record: GeneRecord):
         try:
             self._loadRecord(db_key, record)
         except DuplicateEntityError:
@@ -189,8 +206,6 @@ class Parser(AbstractLoader):
             else:
                 raise
 
-        return 1
-
     def _cleanup(self, file: io.TextIOWrapper):
         records = super(Parser, self)._cleanup(file)
         return records
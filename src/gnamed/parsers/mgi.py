@@ -40,6 +40,8 @@ class Parser(AbstractLoader):
     Implements the `AbstractParser._parse` method.
     """
 
+    NAMESPACE = Namespace.mgi
+
     def _setup(self, stream: io.TextIOWrapper):
         assert len(self.files) == 3, \
             'received {} files, expected 3'.format(len(self.files))
@@ -170,21 +172,30 @@ class Parser(AbstractLoader):
 
             for db_key, record in self._records.items():
                 try:
-                    self._loadRecord(db_key, record)
-                except DuplicateEntityError:
-                    if len(record.refs) == 2:
-                        # assume all MGI links that do not coincide with the
-                        # Entrez back-link are bad, as it seems it is always
-                        # (mostly?) MGI that is not up-to-date.
-                        logging.info('removing likely bad Entrez ref in %s:%s',
-                                     *db_key)
-                        assert any(r.namespace == Namespace.entrez
-                                   for r in record.refs), record.refs
-                        record.refs = {r for r in record.refs if
-                                       r.namespace == Namespace.mgi}
-                        assert len(record.refs) == 1, record.refs
-                        self._loadRecord(db_key, record)
-                    else:
+                    self._storeRecord(db_key, record)
+                except Exception as e:
+                    if not self.tolerant:
                         raise
 
+                    self._reject([self._describe(db_key, record)], e)
+
         return num_records
+
+    def _loadParsed(self, db_key: DBRef, record: GeneRecord):
+        try:
+            self._loadRecord(db_key, record)
+        except DuplicateEntityError:
+            if len(record.refs) == 2:
+                # assume all MGI links that do not coincide with the
+                # Entrez back-link are bad, as it seems it is always
+                # (mostly?) MGI that is not up-to-date.
+                logging.info('removing likely bad Entrez ref in %s:%s',
+                             *db_key)
+                assert any(r.namespace == Namespace.entrez
+                           for r in record.refs), record.refs
+                record.refs = {r for r in record.refs if
+                               r.namespace == Namespace.mgi}
+                assert len(record.refs) == 1, record.refs
+                self._loadRecord(db_key, record)
+            else:
+                raise
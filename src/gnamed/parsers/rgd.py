@@ -49,6 +49,8 @@ class Parser(AbstractLoader):
     can map to multiple genes).
     """
 
+    NAMESPACE = Namespace.rgd
+
     def _setup(self, stream: io.TextIOWrapper):
         lines = super(Parser, self)._setup(stream)
         content = stream.readline().strip()
@@ -117,10 +119,15 @@ class Parser(AbstractLoader):
             for desc in row.descriptions.split('; '):
                 record.addKeyword(desc.strip())
 
+        self._storeRecord(db_key, record)
+        return 1
+
+    def _loadParsed(self, db_key: DBRef, record: GeneRecord):
         try:
             self._loadRecord(db_key, record)
         except DuplicateEntityError:
-            accs = getattr(row, Namespace.entrez)
+            accs = [ref.accession for ref in record.refs
+                    if ref.namespace == Namespace.entrez]
 
             if accs:
                 # Entrez Gene is not unique, having created multiple GIs for
@@ -131,9 +138,9 @@ class Parser(AbstractLoader):
                 # duplicate Genes.
                 logging.warning('removing duplicate rat genes for '
                                 'rgd:%s with Entrez GIs %s',
-                                row.id, accs)
+                                db_key.accession, ';'.join(accs))
                 rgd_ref = self.session.query(GeneRef).filter(
-                    GeneRef.accession == row.id
+                    GeneRef.accession == db_key.accession
                 ).filter(GeneRef.namespace == Namespace.rgd).one()
                 logging.debug('correct %s links to gene:%s',
                               repr(rgd_ref), rgd_ref.id)
@@ -142,8 +149,7 @@ class Parser(AbstractLoader):
                 # Update retired RGD and Entrez entries by pointing the
                 # outdated Refs to the right Gene (rgd_ref.id), while deleting
                 # the "duplicate" Genes.
-                # noinspection PyUnresolvedReferences
-                for gi in accs.split(';'):
+                for gi in accs:
                     entrez_ref = self.session.query(GeneRef).filter(
                         GeneRef.accession == gi
                     ).filter(GeneRef.namespace == Namespace.entrez).one()
@@ -180,8 +186,6 @@ class Parser(AbstractLoader):
             else:
                 raise
 
-        return 1
-
     def _cleanup(self, file: io.TextIOWrapper):
         records = super(Parser, self)._cleanup(file)
         return records
@@ -34,6 +34,10 @@ class Parser(AbstractLoader):
     A simple parser for SGD (yeastmine.yeastgenome.org) gene name data.
     """
 
+    NAMESPACE = Namespace.sgd
+
+    MULTILINE = True
+
     def _setup(self, stream: io.TextIOWrapper):
         lines = super(Parser, self)._setup(stream)
         self._db_key = None
@@ -53,7 +57,7 @@ class Parser(AbstractLoader):
 
         if self._db_key is None or row.id != self._db_key.accession:
             if self._record is not None:
-                self._loadRecord(self._db_key, self._record)
+                self._storeRecord(self._db_key, self._record)
                 count = 1
 
             #noinspection PyTypeChecker
@@ -94,7 +98,7 @@ class Parser(AbstractLoader):
         records = super(Parser, self)._cleanup(file)
 
         if self._record is not None:
-            self._loadRecord(self._db_key, self._record)
+            self._storeRecord(self._db_key, self._record)
             records += 1
 
         return records
@@ -25,6 +25,8 @@ class Parser(AbstractLoader):
     can map to multiple genes).
     """
 
+    NAMESPACE = Namespace.tair
+
     def _setup(self, stream: io.TextIOWrapper):
         assert len(self.files) == 3, \
             'received {} files, expected 3'.format(len(self.files))
@@ -127,21 +129,30 @@ class Parser(AbstractLoader):
 
             for db_key, record in self._records.items():
                 try:
-                    self._loadRecord(db_key, record)
-                except DuplicateEntityError:
-                    if len(record.refs) == 2:
-                        # assume all TAIR links that do not coincide with the
-                        # Entrez back-links are bad, as it will be always
-                        # TAIR that is not up-to-date.
-                        logging.info('removing likely bad Entrez ref in %s:%s',
-                                     *db_key)
-                        assert any(r.namespace == Namespace.entrez
-                                   for r in record.refs), record.refs
-                        record.refs = {r for r in record.refs if
-                                       r.namespace == Namespace.tair}
-                        assert len(record.refs) == 1, record.refs
-                        self._loadRecord(db_key, record)
-                    else:
+                    self._storeRecord(db_key, record)
+                except Exception as e:
+                    if not self.tolerant:
                         raise
 
+                    self._reject([self._describe(db_key, record)], e)
+
         return num_records
+
+    def _loadParsed(self, db_key: DBRef, record: GeneRecord):
+        try:
+            self._loadRecord(db_key, record)
+        except DuplicateEntityError:
+            if len(record.refs) == 2:
+                # assume all TAIR links that do not coincide with the
+                # Entrez back-links are bad, as it will be always
+                # TAIR that is not up-to-date.
+                logging.info('removing likely bad Entrez ref in %s:%s',
+                             *db_key)
+                assert any(r.namespace == Namespace.entrez
+                           for r in record.refs), record.refs
+                record.refs = {r for r in record.refs if
+                               r.namespace == Namespace.tair}
+                assert len(record.refs) == 1, record.refs
+                self._loadRecord(db_key, record)
+            else:
+                raise
@@ -16,9 +16,8 @@ import logging
 
 from gnamed.constants import Namespace, Species as SpeciesIds
 from gnamed.loader import ProteinRecord, AbstractLoader, DBRef
-from gnamed.orm import Species
-
-from sqlalchemy.schema import Sequence
+from gnamed.orm import Connection, CopyFrom, InternStrings, SaveCheckpoint, \
+    Species, Protein, ProteinRef, ProteinString, Protein2PubMed, mapping
 
 
 def translate_BioCyc(items: list):
@@ -229,6 +228,12 @@ class Parser(AbstractLoader):
     Implements the `AbstractParser._parse` method.
     """
 
+    NAMESPACE = Namespace.uniprot
+
+    MULTILINE = True
+
+    RESUMABLE = True
+
     def _setup(self, stream: io.TextIOWrapper) -> int:
         lines = super(Parser, self)._setup(stream)
         self.db_key = None
@@ -263,6 +268,27 @@ class Parser(AbstractLoader):
     def _cleanup(self, stream: io.TextIOWrapper) -> int:
         return super(Parser, self)._cleanup(stream)
 
+    def _recover(self, line: str, stream: io.TextIOWrapper) -> list:
+        # skip the rest of the broken entry
+        lines = []
+
+        while not line.startswith('//'):
+            line = stream.readline()
+
+            if not line:
+                break
+
+            line = line.strip()
+            lines.append(line)
+
+        self.db_key = None
+        self._id = ''
+        self._length = None
+        self._name_cat = None
+        self._skip_sequence = False
+        super(Parser, self)._recover(line, stream)
+        return lines
+
     def _parse(self, line: str) -> int:
         if line and not self._skip_sequence:
             return self._dispatcher[line[0:2]](line)
@@ -463,7 +489,7 @@ class Parser(AbstractLoader):
         matched = Parser.RX_RE.match(line)
 
         if matched:
-            self.record.pmids.add(int(matched.group('pmid')))
+            self.record.addPubMedId(int(matched.group('pmid')))
 
         return 0
 
@@ -516,7 +542,7 @@ class Parser(AbstractLoader):
     #noinspection PyUnusedLocal
     def _parseEND(self, line: str):
         #noinspection PyTypeChecker
-        self._loadRecord(self.db_key, self.record)
+        self._storeRecord(self.db_key, self.record)
         self.db_key = None
         self.record = None
         self._id = ''
@@ -531,24 +557,18 @@ class SpeedLoader(Parser):
     Overrides the database loading methods to directly dump all data "as is".
     """
 
-    def setDSN(self, dsn: str):
-        """
-        Set the DSN string for connecting psycopg2 to a Postgres DB.
-
-        :param dsn: the DSN string
-        """
-        self._dsn = dsn
-
-    def _setup(self, stream: io.TextIOWrapper) -> int:
+    def _prepare(self):
         logging.debug('speedloader setup')
-        lines = super(SpeedLoader, self)._setup(stream)
-        self._protein_id = self.session.execute(Sequence('proteins_id_seq'))
+        super(SpeedLoader, self)._prepare()
         self._initBuffers()
         self._links = set()
         self._connect()
         self._db_key2gid_map = dict()
         self._loadExistingLinks()
 
+    def _setup(self, stream: io.TextIOWrapper) -> int:
+        lines = super(SpeedLoader, self)._setup(stream)
+
         # after the setup, the session object is no longer needed; close it:
         try:
             self.session.close()
@@ -568,51 +588,77 @@ class SpeedLoader(Parser):
     def _initBuffers(self):
         self._proteins = io.StringIO()
         self._protein_refs = io.StringIO()
-        self._protein_strings = io.StringIO()
+        self._protein_strings = []
         self._protein2pubmed = io.StringIO()
         self._mappings = io.StringIO()
 
     def _loadExistingLinks(self):
-        cursor = self._conn.cursor('refs')
-        cursor.execute("SELECT namespace, accession, id FROM gene_refs;")
-
-        for ns, acc, gid in cursor:
+        for ns, acc, gid in self._connection.execution_options(
+                stream_results=True).execute(
+                "SELECT namespace, accession, id FROM gene_refs;"):
             db_key = DBRef(ns, acc)
             self._db_key2gid_map[db_key] = gid
 
-        cursor.close()
         logging.debug('loaded %s links', len(self._db_key2gid_map))
 
     def _connect(self):
-        import psycopg2
-
-        self._conn = psycopg2.connect(self._dsn)
+        self._connection = Connection()
+        self._transaction = self._connection.begin()
 
     def _flush(self):
         """
         Overrides the default `AbstractLoader._loadRecord` method.
         """
-        cur = self._conn.cursor()
         stream = lambda buffer: io.StringIO(buffer.getvalue())
+        CopyFrom(self._connection, Protein.__table__, stream(self._proteins))
+        CopyFrom(self._connection, ProteinRef.__table__,
+                 stream(self._protein_refs))
+        CopyFrom(self._connection, ProteinString.__table__,
+                 self._internStrings(), columns=('id', 'cat', 'string_id'))
+        CopyFrom(self._connection, Protein2PubMed.__table__,
+                 stream(self._protein2pubmed))
+        CopyFrom(self._connection, mapping, stream(self._mappings))
+        self._initBuffers()
+
+    def _internStrings(self) -> io.StringIO:
+        # resolve the string IDs of all buffered strings in one batch
+        ids = InternStrings(self._connection,
+                            (val for _, _, val in self._protein_strings))
+        return io.StringIO(''.join(
+            '{}\t{}\t{}\n'.format(eid, cat, ids[val])
+            for eid, cat, val in self._protein_strings
+        ))
+
+    def _commit(self, path: str, lines: int, records: int,
+                complete: bool=False):
+        """
+        Overrides the `AbstractParser._commit` method to COPY and commit the
+        buffered records on the loader's own connection.
+        """
+        self._flush()
 
+        if self.checkpoint:
+            SaveCheckpoint(self._connection, path, self.name, lines,
+                           records, complete)
+
+        self._transaction.commit()
+
+        if complete:
+            self._connection.close()
+        else:
+            self._transaction = self._connection.begin()
+
+        if self.session is not None:
+            self.session.commit()
+            self.session.expunge_all()
+
+    def _rollback(self):
         try:
-            cur.copy_from(stream(self._proteins), 'proteins')
-            cur.copy_from(stream(self._protein_refs), 'protein_refs')
-            cur.copy_from(stream(self._protein_strings), 'protein_strings')
-            cur.copy_from(stream(self._protein2pubmed), 'protein2pubmed')
-            cur.copy_from(stream(self._mappings), 'genes2proteins')
-            cur.execute("ALTER SEQUENCE proteins_id_seq RESTART WITH %s",
-                        (self._protein_id,))
+            self._transaction.rollback()
         finally:
-            cur.close()
+            self._connection.close()
 
-        self._initBuffers()
-
-    def _cleanup(self, stream: io.TextIOWrapper) -> int:
-        self._flush()
-        self._conn.commit()
-        self._conn.close()
-        return 0
+        super(SpeedLoader, self)._rollback()
 
     def _loadRecord(self, db_key: DBRef, record: ProteinRecord):
         """
@@ -622,35 +668,27 @@ class SpeedLoader(Parser):
                        record
         :param record: a `ProteinRecord` generated from the parsed record
         """
-        pid = str(self._protein_id)
-
-        self._proteins.write('{}\t{}\t{}\t{}\n'.format(
+        pid = self.ids['protein'].next(self._connection)
+        # only buffer the rows once all rows of the record were built, so a
+        # rejected (tolerant) record leaves no partial rows in the buffers
+        protein = '{}\t{}\t{}\t{}\n'.format(
             pid, str(record.species_id),
             '\\N' if record.length is None else record.length,
             '\\N' if record.mass is None else record.mass
-        ))
-
-        self._protein_refs.write('{}\t{}\t{}\t{}\t{}\n'.format(
+        )
+        refs = ['{}\t{}\t{}\t{}\t{}\n'.format(
             db_key.namespace, db_key.accession,
             '\\N' if record.symbol is None else record.symbol,
             '\\N' if record.name is None else record.name, pid
-        ))
+        )]
 
         for ns, acc in record.refs:
             if ns != db_key.namespace or acc != db_key.accession:
-                self._protein_refs.write('{}\t{}\t\\N\t\\N\t{}\n'.format(
-                    ns, acc, pid
-                ))
-
-        for cat, values in record.strings.items():
-            for val in values:
-                self._protein_strings.write(
-                    '{}\t{}\t{}\n'.format(pid, cat, val)
-                )
-
-        for pmid in record.pmids:
-            self._protein2pubmed.write('{}\t{}\n'.format(pid, pmid))
+                refs.append('{}\t{}\t\\N\t\\N\t{}\n'.format(ns, acc, pid))
 
+        strings = [(pid, cat, val) for cat, values in record.strings.items()
+                   for val in values]
+        pmids = ''.join('{}\t{}\n'.format(pid, pmid) for pmid in record.pmids)
         gene_ids = set()
 
         for key in record.mappings:
@@ -659,7 +697,13 @@ class SpeedLoader(Parser):
             except KeyError:
                 pass
 
+        self._proteins.write(protein)
+        self._protein_refs.write(''.join(refs))
+        self._protein_strings.extend(strings)
+        self._protein2pubmed.write(pmids)
+
         for gid in gene_ids:
             self._mappings.write('{}\t{}\n'.format(gid, pid))
+            self._markDirty('gene', gid)
 
-        self._protein_id += 1
+        self._markDirty('protein', pid)
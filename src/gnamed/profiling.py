@@ -0,0 +1,325 @@
+"""
+.. py:module:: gnamed.profiling
+   :synopsis: Measure where the time of a load goes (``gnamed load --profile``).
+
+A `Profile` times the phases of a parser run: reading lines, parsing them
+(and building the records), storing and loading the records, flushing,
+committing, and the SQL statements (via the SQLAlchemy engine events) and
+``COPY``\\s (see `Phase`) these phases run. `Profile.instrument` wraps the
+methods of a parser instance, so an unprofiled parser runs the unchanged
+code. The phases nest, so the profile reports the total and the own time
+(without any nested phase) of each phase, and the own times of all phases
+add up to the time of the profiled run.
+
+A `Sampler` samples the stack of the profiled thread instead, and writes the
+sampled stacks in the "folded" format of flame graph tools (e.g.,
+``flamegraph.pl`` or speedscope).
+
+Only the thread that started profiling is measured; e.g., the SQL of the
+threads that rebuild the indexes (in bulk mode) is not.
+
+.. moduleauthor:: Florian Leitner <florian.leitner@gmail.com>
+.. License: GNU GPL v3 (http://www.gnu.org/licenses/gpl.html)
+"""
+import sys
+import threading
+
+from collections import Counter
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from time import perf_counter
+
+PHASES = ('run', 'read', 'parse', 'store', 'load', 'flush', 'commit',
+          'closure', 'sql', 'copy')
+"""The phases of a parser run, in report order."""
+
+INSTRUMENTED = (
+    ('parse', 'run'), ('_setup', 'parse'), ('_parse', 'parse'),
+    ('_cleanup', 'parse'), ('_storeRecord', 'store'), ('_loadRecord', 'load'),
+    ('_flush', 'flush'), ('_commit', 'commit'), ('_refreshClosure', 'closure'),
+)
+"""The parser methods `Profile.instrument` wraps, and their phases."""
+
+INTERVAL = 0.005
+"""Default number of seconds between two samples of a `Sampler`."""
+
+_active = None  # the Profile being recorded
+
+
+class Timer:
+    """
+    The cumulative time and number of calls of a phase.
+    """
+
+    __slots__ = ('calls', 'total', 'own')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.own = 0.0
+
+
+class _TimedStream:
+    # times the lines read from a parser's stream as the "read" phase
+
+    def __init__(self, stream, profile: 'Profile'):
+        self._stream = stream
+        self._profile = profile
+
+    def __getattr__(self, name: str):
+        return getattr(self._stream, name)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        line = self.readline()
+
+        if not line:
+            raise StopIteration
+
+        return line
+
+    def readline(self, *args) -> str:
+        self._profile.start('read')
+
+        try:
+            return self._stream.readline(*args)
+        finally:
+            self._profile.stop('read')
+
+
+class Profile:
+    """
+    Cumulative timers (see `Timer`) and counters of the phases of a run.
+
+    Use the profile as a context manager around the run; while it is
+    active, it also times the SQL statements and `Phase`\\s of its thread.
+    """
+
+    def __init__(self):
+        self.timers = {}
+        self.records = 0
+        self.rows = 0
+        self._stack = []
+        self._thread = None
+
+    def __enter__(self) -> 'Profile':
+        global _active
+        _active = self
+        self._thread = threading.get_ident()
+        event.listen(Engine, 'before_cursor_execute', self._beforeExecute)
+        event.listen(Engine, 'after_cursor_execute', self._afterExecute)
+        event.listen(Engine, 'handle_error', self._onError)
+        return self
+
+    def __exit__(self, *exc):
+        global _active
+        event.remove(Engine, 'before_cursor_execute', self._beforeExecute)
+        event.remove(Engine, 'after_cursor_execute', self._afterExecute)
+        event.remove(Engine, 'handle_error', self._onError)
+        _active = None
+
+        while self._stack:
+            self.stop(self._stack[-1][0])
+
+    def start(self, phase: str):
+        """
+        Start timing a `phase` (nested in the current phase, if any).
+        """
+        self._stack.append([phase, perf_counter(), 0.0])
+
+    def stop(self, phase: str):
+        """
+        Stop timing the current `phase`.
+        """
+        # stop any phase left open by an error (e.g., a failed statement)
+        while self._stack[-1][0] != phase:
+            self.stop(self._stack[-1][0])
+
+        _, start, nested = self._stack.pop()
+        elapsed = perf_counter() - start
+        timer = self.timers.get(phase)
+
+        if timer is None:
+            timer = self.timers[phase] = Timer()
+
+        timer.calls += 1
+        timer.own += elapsed - nested
+
+        # recursive calls are part of the outermost call's total
+        if all(frame[0] != phase for frame in self._stack):
+            timer.total += elapsed
+
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def timed(self, phase: str, function):
+        """
+        Wrap a `function` so each call is timed as the `phase`.
+        """
+        def timedFunction(*args, **kwds):
+            self.start(phase)
+
+            try:
+                return function(*args, **kwds)
+            finally:
+                self.stop(phase)
+
+        timedFunction.__wrapped__ = function
+        return timedFunction
+
+    def instrument(self, parser):
+        """
+        Time the phases of a `gnamed.parsers.AbstractParser` instance by
+        wrapping its methods (see `INSTRUMENTED`) and its streams.
+        """
+        for method, phase in INSTRUMENTED:
+            if hasattr(parser, method):
+                setattr(parser, method,
+                        self.timed(phase, getattr(parser, method)))
+
+        # records are counted by the parser methods that return them
+        for method in ('_parse', '_cleanup'):
+            setattr(parser, method,
+                    self._counting(getattr(parser, method)))
+
+        setup = parser._setup
+
+        def setupFile(stream) -> int:
+            lines = setup(stream)
+
+            # parsers of several kinds of files select the line handler
+            # (i.e., replace _parse) in _setup
+            if not hasattr(parser._parse, '__wrapped__'):
+                parser._parse = self._counting(
+                    self.timed('parse', parser._parse)
+                )
+
+            return lines
+
+        parser._setup = setupFile
+        open_stream = parser._open
+        parser._open = lambda file: _TimedStream(open_stream(file), self)
+
+    def report(self, stream=None):
+        """
+        Write the timers of all phases (in `PHASES` order) and the counts of
+        lines, records and SQL statements to the `stream` (STDERR).
+        """
+        stream = sys.stderr if stream is None else stream
+        wall = sum(timer.own for timer in self.timers.values()) or 1.0
+        phases = [p for p in PHASES if p in self.timers] + \
+            sorted(p for p in self.timers if p not in PHASES)
+        print('phase\tcalls\tseconds\town s\town %', file=stream)
+
+        for phase in phases:
+            timer = self.timers[phase]
+            print('{}\t{}\t{:.3f}\t{:.3f}\t{:.1f}'.format(
+                phase, timer.calls, timer.total, timer.own,
+                100.0 * timer.own / wall
+            ), file=stream)
+
+        read = self.timers.get('read')
+        sql = self.timers.get('sql')
+        print('# {} lines, {} records, {} SQL statements ({} rows)'.format(
+            read.calls if read else 0, self.records,
+            sql.calls if sql else 0, self.rows
+        ), file=stream)
+
+    def _counting(self, function):
+        def countingFunction(*args, **kwds):
+            records = function(*args, **kwds)
+            self.records += records or 0
+            return records
+
+        countingFunction.__wrapped__ = function
+        return countingFunction
+
+    def _beforeExecute(self, conn, cursor, statement, parameters, context,
+                       executemany):
+        if threading.get_ident() == self._thread:
+            self.start('sql')
+            self.rows += len(parameters) if executemany else 1
+
+    def _afterExecute(self, conn, cursor, statement, parameters, context,
+                      executemany):
+        if threading.get_ident() == self._thread and self._stack and \
+                self._stack[-1][0] == 'sql':
+            self.stop('sql')
+
+    def _onError(self, context):
+        self._afterExecute(None, None, None, None, None, None)
+
+
+@contextmanager
+def Phase(name: str):
+    """
+    Time the enclosed code as the phase `name` of the active `Profile`, if
+    any (e.g., the ``COPY``\\s of the speed loaders, which bypass the engine
+    events).
+    """
+    profile = _active
+
+    if profile is None or threading.get_ident() != profile._thread:
+        yield
+    else:
+        profile.start(name)
+
+        try:
+            yield
+        finally:
+            profile.stop(name)
+
+
+class Sampler:
+    """
+    Sample the stack of the thread that started the sampler every
+    `interval` seconds and, when stopped, write the sampled stacks in the
+    folded format (``frame;frame;... count``) to a file.
+
+    Use the sampler as a context manager around the sampled code.
+    """
+
+    def __init__(self, path: str, interval: float=INTERVAL):
+        """
+        :param path: the file to write the folded stacks to
+        :param interval: the number of seconds between two samples
+        """
+        self.path = path
+        self.interval = interval
+        self.stacks = Counter()
+        self._target = None
+        self._done = threading.Event()
+        self._thread = None
+
+    def __enter__(self) -> 'Sampler':
+        self._target = threading.get_ident()
+        self._done.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True,
+                                        name='gnamed-sampler')
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._done.set()
+        self._thread.join()
+
+        with open(self.path, 'w') as stream:
+            for stack, count in sorted(self.stacks.items()):
+                stream.write('{} {}\n'.format(stack, count))
+
+    def _sample(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+
+            while frame is not None:
+                stack.append('{}:{}'.format(
+                    frame.f_globals.get('__name__', '?'), frame.f_code.co_name
+                ))
+                frame = frame.f_back
+
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
@@ -0,0 +1,255 @@
+"""
+.. py:module:: gnamed.releases
+   :synopsis: A content-addressed store of fetched repository releases.
+
+To reproduce a DB build, the exact files it was loaded from have to be at
+hand. A `Store` keeps every file it ever fetched, addressed by the SHA-1
+hash of its content, and records each distinct set of files of a repository
+as a `Release` (see ``gnamed fetch --store`` and ``gnamed load --release``).
+
+Directory layout::
+
+    DIR/downloads/                    # the last download of each file
+    DIR/objects/<sha1>/<filename>     # every distinct file content
+    DIR/releases/<key>/<id>.json      # the releases of each repository
+
+Fetching into a store is a normal `gnamed.fetcher.Retrieve` into its
+download directory, so unchanged files are not downloaded again; their
+hashes are kept in the download `gnamed.fetcher.Manifest`, so they are not
+read again either. Objects are hard links to the downloads (where the file
+system allows it), and a fetch only creates a new release if any file of
+the repository has changed since its latest release. Release IDs are the
+(UTC) time of their creation, so they sort chronologically.
+
+Objects keep the name of their file, so parsers can still tell the files of
+a repository apart, and the checksum of a release is the checksum of its
+files (see `gnamed.parsed.Checksum`), so parsed-record caches of a release
+are found without reading its files.
+
+.. moduleauthor:: Florian Leitner <florian.leitner@gmail.com>
+.. License: GNU GPL v3 (http://www.gnu.org/licenses/gpl.html)
+"""
+import json
+import logging
+import os
+import shutil
+import sys
+
+from datetime import datetime
+
+from gnamed.constants import REPOSITORIES
+from gnamed.fetcher import Manifest, Retrieve, WORKERS
+from gnamed.parsed import Digest, FileHash
+
+LATEST = 'latest'
+"""The release ID that refers to the latest release of a repository."""
+
+
+def _releaseOrder(release_id: str) -> tuple:
+    # IDs of releases created within the same second get a numeric suffix
+    # (".1", ".2", ...), which has to be compared as a number
+    timestamp, _, n = release_id.partition('.')
+    return (timestamp, int(n) if n.isdigit() else 0, n)
+
+
+class Release:
+    """
+    A set of stored files of a repository, in the order of its resources.
+    """
+
+    def __init__(self, store: 'Store', data: dict):
+        """
+        :param store: the `Store` the release belongs to
+        :param data: the release record (as stored)
+        """
+        self.store = store
+        self.id = data['id']
+        self.repository = data['repository']
+        self.created = data['created']
+        self.files = data['files']
+
+    def __repr__(self) -> str:
+        return '<Release {}@{}>'.format(self.repository, self.id)
+
+    @property
+    def paths(self) -> list:
+        """The paths of the (stored) files of this release."""
+        return [self.store.objectPath(f['sha1'], f['filename'])
+                for f in self.files]
+
+    @property
+    def encodings(self) -> dict:
+        """The encoding of each stored text file, by path."""
+        return {self.store.objectPath(f['sha1'], f['filename']):
+                f['encoding'] for f in self.files if f.get('encoding')}
+
+    @property
+    def checksum(self) -> str:
+        """The checksum of the files (see `gnamed.parsed.Checksum`)."""
+        return Digest(*(f['sha1'] for f in self.files))
+
+    def toDict(self) -> dict:
+        return {'id': self.id, 'repository': self.repository,
+                'created': self.created, 'files': self.files}
+
+
+class Store:
+    """
+    A directory of content-addressed files and the repository releases
+    that consist of them.
+    """
+
+    def __init__(self, directory: str):
+        """
+        :param directory: the root directory of the store (created when
+                          fetching into it)
+        """
+        self.directory = directory
+        self.downloads = os.path.join(directory, 'downloads')
+
+    def objectPath(self, sha1: str, filename: str) -> str:
+        """
+        Return the path of the stored file with the given hash and name.
+        """
+        return os.path.join(self.directory, 'objects', sha1, filename)
+
+    def releases(self, repo_key: str) -> list:
+        """
+        Return the IDs of all releases of a repository, oldest first.
+        """
+        directory = os.path.join(self.directory, 'releases', repo_key)
+
+        if not os.path.isdir(directory):
+            return []
+
+        return sorted((name[:-5] for name in os.listdir(directory)
+                       if name.endswith('.json')), key=_releaseOrder)
+
+    def release(self, repo_key: str, release_id: str=LATEST) -> Release:
+        """
+        Return a release of a repository (by default, the latest).
+
+        :raises KeyError: if no such release exists
+        """
+        if release_id == LATEST:
+            ids = self.releases(repo_key)
+
+            if not ids:
+                raise KeyError('no release of {} in {}'.format(
+                    repo_key, self.directory
+                ))
+
+            release_id = ids[-1]
+
+        try:
+            with open(self._releasePath(repo_key, release_id),
+                      encoding='utf-8') as stream:
+                return Release(self, json.load(stream))
+        except FileNotFoundError:
+            raise KeyError('no release {} of {} in {}'.format(
+                release_id, repo_key, self.directory
+            ))
+
+    def fetch(self, *repo_keys: str, encoding: str=sys.getdefaultencoding(),
+              workers: int=WORKERS, force: bool=False,
+              transcode: bool=True) -> list:
+        """
+        Fetch the files of the given repositories into the store and return
+        the current `Release` of each, or ``None`` if any file could not be
+        fetched.
+
+        The arguments are those of `gnamed.fetcher.Retrieve`.
+        """
+        os.makedirs(self.downloads, exist_ok=True)
+
+        if not Retrieve(*repo_keys, directory=self.downloads,
+                        encoding=encoding, workers=workers, force=force,
+                        transcode=transcode, echo=False):
+            return None
+
+        manifest = Manifest(self.downloads)
+        return [self._addRelease(repo_key, manifest)
+                for repo_key in repo_keys]
+
+    def _addRelease(self, repo_key: str, manifest: Manifest) -> Release:
+        # store the downloaded files and record them as a new release if
+        # anything changed since the latest one
+        repo = REPOSITORIES[repo_key]
+        files = []
+
+        for path, filename, _ in repo['resources']:
+            entry = manifest.get(filename)
+            files.append({
+                'filename': filename, 'url': repo['url'] + path,
+                'sha1': self._storeObject(filename, entry, manifest),
+                'size': os.path.getsize(os.path.join(self.downloads,
+                                                     filename)),
+                'encoding': entry.get('encoding'),
+            })
+
+        try:
+            latest = self.release(repo_key)
+        except KeyError:
+            latest = None
+
+        if latest is not None and latest.files == files:
+            logging.info('%s is unchanged since release %s',
+                         repo_key, latest.id)
+            return latest
+
+        now = datetime.utcnow()
+        release_id = now.strftime('%Y%m%dT%H%M%SZ')
+        n = 1
+
+        while os.path.exists(self._releasePath(repo_key, release_id)):
+            release_id = now.strftime('%Y%m%dT%H%M%SZ.{}'.format(n))
+            n += 1
+
+        release = Release(self, {
+            'id': release_id, 'repository': repo_key,
+            'created': now.isoformat() + 'Z', 'files': files,
+        })
+        target = self._releasePath(repo_key, release_id)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = '{}.tmp{}'.format(target, os.getpid())
+
+        with open(tmp, 'w', encoding='utf-8') as stream:
+            json.dump(release.toDict(), stream, indent=1, sort_keys=True)
+
+        os.replace(tmp, target)
+        logging.info('added release %s of %s', release_id, repo_key)
+        return release
+
+    def _storeObject(self, filename: str, entry: dict,
+                     manifest: Manifest) -> str:
+        # hash a downloaded file (unless its hash is known) and link it into
+        # the objects; returns the hash
+        source = os.path.join(self.downloads, filename)
+        mtime = os.stat(source).st_mtime_ns
+
+        if entry.get('sha1') and entry.get('mtime') == mtime:
+            sha1 = entry['sha1']
+        else:
+            logging.info("hashing '%s'", source)
+            sha1 = FileHash(source)
+            manifest.update(filename, sha1=sha1, mtime=mtime)
+
+        target = self.objectPath(sha1, filename)
+
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp = '{}.tmp{}'.format(target, os.getpid())
+
+            try:
+                os.link(source, tmp)
+            except OSError:
+                shutil.copyfile(source, tmp)
+
+            os.replace(tmp, target)
+            logging.info("stored '%s' as %s", filename, sha1)
+
+        return sha1
+
+    def _releasePath(self, repo_key: str, release_id: str) -> str:
+        return os.path.join(self.directory, 'releases', repo_key,
+                            release_id + '.json')
@@ -0,0 +1,457 @@
+"""
+.. py:module:: gnamed.snapshot
+   :synopsis: A self-contained, read-only, memory-mapped export of the DB.
+
+A snapshot is a single file holding the references, strings, PubMed IDs and
+gene/protein mappings of a gnamed DB in compact, dictionary-encoded,
+column-oriented integer arrays. All strings (namespaces, accessions, symbols,
+names, categories and values) are stored exactly once, in lexicographic order,
+so that a string's ID can be found by binary search and all tables can be
+sorted by string ID. The file is opened with ``mmap``, so loading a snapshot
+takes milliseconds and all processes using the same snapshot share its pages
+through the OS cache.
+
+File layout (all offsets 8-byte aligned)::
+
+    MAGIC | byteorder | #sections | section directory | sections...
+
+Each section directory entry holds the section name, the array type code,
+and the byte offset and item count of that section.
+
+.. moduleauthor:: Florian Leitner <florian.leitner@gmail.com>
+.. License: GNU GPL v3 (http://www.gnu.org/licenses/gpl.html)
+"""
+import logging
+import mmap
+import struct
+import sys
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+from gnamed.orm import Session, IsProteinRepo, \
+    GeneRef, ProteinRef, GeneString, ProteinString, StringValue, \
+    Gene2PubMed, Protein2PubMed, mapping
+
+MAGIC = b'GNAMEDS1'
+"""File signature and format version of snapshot files."""
+
+NONE = -1
+"""String ID used for missing (NULL) strings."""
+
+YIELD = 10000
+"""Number of rows to stream from the DB at a time."""
+
+_HEADER = struct.Struct('<8s8sQ')
+_ENTRY = struct.Struct('<24s8sQQ')
+_KINDS = ('gene', 'protein')
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+class _Dictionary:
+    """
+    Assigns (temporary) IDs to strings while streaming the tables.
+    """
+
+    def __init__(self):
+        self.ids = {}
+
+    def __call__(self, value: str) -> int:
+        if value is None:
+            return NONE
+
+        try:
+            return self.ids[value]
+        except KeyError:
+            sid = len(self.ids)
+            self.ids[value] = sid
+            return sid
+
+    def finalize(self):
+        """
+        Sort the dictionary and return the sorted strings and a remapping
+        array from the temporary to the final string IDs.
+        """
+        values = sorted(self.ids)
+        remap = array('q', bytes(8 * len(values)))
+
+        for sid, value in enumerate(values):
+            remap[self.ids[value]] = sid
+
+        self.ids = None
+        return values, remap
+
+
+def _remap(column: array, remap: array):
+    for i, sid in enumerate(column):
+        if sid != NONE:
+            column[i] = remap[sid]
+
+
+def _permute(column: array, order: list) -> array:
+    return array(column.typecode, (column[i] for i in order))
+
+
+def _stream(session, *columns, join=None):
+    query = session.query(*columns)
+
+    if join is not None:
+        query = query.join(join)
+
+    return query.yield_per(YIELD)
+
+
+def WriteSnapshot(path: str):
+    """
+    Write a snapshot of the current DB to the file at `path`.
+
+    The ``*_refs``, ``*_strings``, ``*2pubmed`` and ``genes2proteins``
+    tables are streamed from the DB exactly once; only the string dictionary
+    and the integer columns are held in memory while writing.
+
+    :param path: the snapshot file to (over-) write
+    """
+    session = Session()
+    intern = _Dictionary()
+    sections = {}
+
+    try:
+        for kind, Ref, String, PubMed in (
+                ('gene', GeneRef, GeneString, Gene2PubMed),
+                ('protein', ProteinRef, ProteinString, Protein2PubMed)):
+            logging.info('streaming %s references', kind)
+            cols = [array('q') for _ in range(5)]
+
+            for ns, acc, sym, name, eid in _stream(
+                    session, Ref.namespace, Ref.accession, Ref.symbol,
+                    Ref.name, Ref.id):
+                cols[0].append(intern(ns))
+                cols[1].append(intern(acc))
+                cols[2].append(intern(sym))
+                cols[3].append(intern(name))
+                cols[4].append(NONE if eid is None else eid)
+
+            for name, col in zip(('ns', 'acc', 'symbol', 'name', 'id'), cols):
+                sections['{}.refs.{}'.format(kind, name)] = col
+
+            logging.info('streaming %s strings', kind)
+            cols = [array('q') for _ in range(3)]
+
+            for eid, cat, value in _stream(session, String.id, String.cat,
+                                           StringValue.value,
+                                           join=String.string):
+                cols[0].append(eid)
+                cols[1].append(intern(cat))
+                cols[2].append(intern(value))
+
+            for name, col in zip(('id', 'cat', 'value'), cols):
+                sections['{}.strings.{}'.format(kind, name)] = col
+
+            logging.info('streaming %s PMIDs', kind)
+            cols = [array('q') for _ in range(2)]
+
+            for eid, pmid in _stream(session, PubMed.id, PubMed.pmid):
+                cols[0].append(eid)
+                cols[1].append(pmid)
+
+            sections['{}.pmids.id'.format(kind)] = cols[0]
+            sections['{}.pmids.pmid'.format(kind)] = cols[1]
+
+        logging.info('streaming gene-protein mappings')
+        genes, proteins = array('q'), array('q')
+
+        for gid, pid in _stream(session, mapping.c.gene_id,
+                                mapping.c.protein_id):
+            genes.append(gid)
+            proteins.append(pid)
+    finally:
+        session.close()
+
+    logging.info('sorting %s strings', len(intern.ids))
+    values, remap = intern.finalize()
+
+    for kind in _KINDS:
+        ref = '{}.refs.'.format(kind)
+
+        for name in ('ns', 'acc', 'symbol', 'name'):
+            _remap(sections[ref + name], remap)
+
+        ns, acc = sections[ref + 'ns'], sections[ref + 'acc']
+        order = sorted(range(len(ns)), key=lambda i: (ns[i], acc[i]))
+
+        for name in ('ns', 'acc', 'symbol', 'name', 'id'):
+            sections[ref + name] = _permute(sections[ref + name], order)
+
+        ids = sections[ref + 'id']
+        sections[ref + 'byid'] = array('q', sorted(range(len(ids)),
+                                                   key=ids.__getitem__))
+
+        for table, columns in (('strings', ('id', 'cat', 'value')),
+                               ('pmids', ('id', 'pmid'))):
+            prefix = '{}.{}.'.format(kind, table)
+
+            if table == 'strings':
+                _remap(sections[prefix + 'cat'], remap)
+                _remap(sections[prefix + 'value'], remap)
+
+            ids = sections[prefix + 'id']
+            order = sorted(range(len(ids)), key=ids.__getitem__)
+
+            for name in columns:
+                sections[prefix + name] = _permute(sections[prefix + name],
+                                                   order)
+
+    order = sorted(range(len(genes)), key=lambda i: (genes[i], proteins[i]))
+    sections['mapping.gene'] = _permute(genes, order)
+    sections['mapping.protein'] = _permute(proteins, order)
+    order = sorted(range(len(genes)), key=lambda i: (proteins[i], genes[i]))
+    sections['mapping.rprotein'] = _permute(proteins, order)
+    sections['mapping.rgene'] = _permute(genes, order)
+    del genes, proteins, order
+
+    offsets = array('q', [0])
+    data = bytearray()
+
+    for value in values:
+        data.extend(value.encode('utf-8'))
+        offsets.append(len(data))
+
+    sections['strings.offsets'] = offsets
+    sections['strings.data'] = array('B', data)
+    del data, values
+
+    logging.info('writing snapshot %s', path)
+    _write(path, sections)
+
+
+def _write(path: str, sections: dict):
+    names = sorted(sections)
+    offset = _align(_HEADER.size + _ENTRY.size * len(names))
+    directory = []
+
+    for name in names:
+        col = sections[name]
+        directory.append(_ENTRY.pack(name.encode('ascii'),
+                                     col.typecode.encode('ascii'),
+                                     offset, len(col)))
+        offset = _align(offset + col.itemsize * len(col))
+
+    with open(path, 'wb') as out:
+        out.write(_HEADER.pack(MAGIC, sys.byteorder.encode('ascii'),
+                               len(names)))
+
+        for entry in directory:
+            out.write(entry)
+
+        for name in names:
+            out.write(b'\0' * (_align(out.tell()) - out.tell()))
+            sections[name].tofile(out)
+
+
+class Snapshot:
+    """
+    Read-only access to a snapshot file written by `WriteSnapshot`.
+
+    Lookups use binary searches directly on the memory-mapped arrays;
+    nothing but the section directory is read when opening a snapshot.
+    Entities are identified by their kind ("gene" or "protein") and their
+    DB ID.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: the snapshot file to open
+        """
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, order, count = _HEADER.unpack_from(self._map, 0)
+
+        if magic != MAGIC:
+            raise ValueError('{} is not a gnamed snapshot'.format(path))
+
+        if order.rstrip(b'\0').decode('ascii') != sys.byteorder:
+            raise ValueError('{} was written on a {}-endian machine'.format(
+                path, order.rstrip(b'\0').decode('ascii')
+            ))
+
+        self._view = memoryview(self._map)
+        self._sections = {}
+
+        for i in range(count):
+            name, code, offset, length = _ENTRY.unpack_from(
+                self._map, _HEADER.size + i * _ENTRY.size
+            )
+            code = code.rstrip(b'\0').decode('ascii')
+            size = array(code).itemsize
+            self._sections[name.rstrip(b'\0').decode('ascii')] = \
+                self._view[offset:offset + size * length].cast(code)
+
+        self._offsets = self._sections['strings.offsets']
+        self._data = self._sections['strings.data']
+
+    def close(self):
+        """Release the memory map and the file handle."""
+        for section in self._sections.values():
+            section.release()
+
+        self._sections = {}
+        self._offsets = self._data = None
+        self._view.release()
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        """Return the number of strings in the dictionary."""
+        return len(self._offsets) - 1
+
+    def string(self, sid: int) -> str:
+        """Return the string for a string ID (``None`` for `NONE`)."""
+        if sid == NONE:
+            return None
+
+        return bytes(
+            self._data[self._offsets[sid]:self._offsets[sid + 1]]
+        ).decode('utf-8')
+
+    def _bytes(self, sid: int) -> bytes:
+        return bytes(self._data[self._offsets[sid]:self._offsets[sid + 1]])
+
+    def stringId(self, value: str) -> int:
+        """Return the ID of a string or `NONE` if it is unknown."""
+        key = value.encode('utf-8')
+        lo, hi = 0, len(self)
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+
+            if self._bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo < len(self) and self._bytes(lo) == key:
+            return lo
+        else:
+            return NONE
+
+    def _section(self, kind: str, table: str, column: str):
+        return self._sections['{}.{}.{}'.format(kind, table, column)]
+
+    def _refRow(self, kind: str, ns: int, acc: int) -> int:
+        nss = self._section(kind, 'refs', 'ns')
+        accs = self._section(kind, 'refs', 'acc')
+        lo = bisect_left(nss, ns)
+        hi = bisect_right(nss, ns, lo)
+        row = bisect_left(accs, acc, lo, hi)
+        return row if row < hi and accs[row] == acc else NONE
+
+    def lookup(self, namespace: str, accession: str) -> tuple:
+        """
+        Return the (kind, ID, symbol, name) tuple of a reference or ``None``
+        if the reference is unknown; the ID is ``None`` if the reference is
+        not linked to any entity.
+        """
+        kind = 'protein' if IsProteinRepo(namespace) else 'gene'
+        ns, acc = self.stringId(namespace), self.stringId(accession)
+
+        if ns == NONE or acc == NONE:
+            return None
+
+        row = self._refRow(kind, ns, acc)
+
+        if row == NONE:
+            return None
+
+        eid = self._section(kind, 'refs', 'id')[row]
+        return (kind, None if eid == NONE else eid,
+                self.string(self._section(kind, 'refs', 'symbol')[row]),
+                self.string(self._section(kind, 'refs', 'name')[row]))
+
+    def _rows(self, kind: str, table: str, eid: int) -> range:
+        ids = self._section(kind, table, 'id')
+        lo = bisect_left(ids, eid)
+        return range(lo, bisect_right(ids, eid, lo))
+
+    def refs(self, kind: str, eid: int) -> list:
+        """Return the (namespace, accession) pairs linked to an entity."""
+        ids = self._section(kind, 'refs', 'id')
+        byid = self._section(kind, 'refs', 'byid')
+        nss = self._section(kind, 'refs', 'ns')
+        accs = self._section(kind, 'refs', 'acc')
+        lo, hi = 0, len(byid)
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+
+            if ids[byid[mid]] < eid:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        result = []
+
+        while lo < len(byid) and ids[byid[lo]] == eid:
+            row = byid[lo]
+            result.append((self.string(nss[row]), self.string(accs[row])))
+            lo += 1
+
+        return result
+
+    def strings(self, kind: str, eid: int) -> list:
+        """Return the (category, value) pairs of an entity."""
+        cats = self._section(kind, 'strings', 'cat')
+        values = self._section(kind, 'strings', 'value')
+        return [(self.string(cats[i]), self.string(values[i]))
+                for i in self._rows(kind, 'strings', eid)]
+
+    def pmids(self, kind: str, eid: int) -> list:
+        """Return the PubMed IDs linked to an entity."""
+        pmids = self._section(kind, 'pmids', 'pmid')
+        return [pmids[i] for i in self._rows(kind, 'pmids', eid)]
+
+    def proteins(self, gene_id: int) -> list:
+        """Return the IDs of all proteins mapped to a gene."""
+        genes = self._sections['mapping.gene']
+        lo = bisect_left(genes, gene_id)
+        hi = bisect_right(genes, gene_id, lo)
+        return list(self._sections['mapping.protein'][lo:hi])
+
+    def genes(self, protein_id: int) -> list:
+        """Return the IDs of all genes mapped to a protein."""
+        proteins = self._sections['mapping.rprotein']
+        lo = bisect_left(proteins, protein_id)
+        hi = bisect_right(proteins, protein_id, lo)
+        return list(self._sections['mapping.rgene'][lo:hi])
+
+    def map(self, namespace: str, accession: str, to_namespace: str) -> list:
+        """
+        Return the accessions in `to_namespace` mapped to a reference, using
+        the same semantics as `gnamed.orm.MapRepositories`.
+        """
+        found = self.lookup(namespace, accession)
+
+        if found is None or found[1] is None:
+            return []
+
+        kind, eid = found[:2]
+        to_kind = 'protein' if IsProteinRepo(to_namespace) else 'gene'
+
+        if kind == to_kind:
+            targets = [eid]
+        elif kind == 'gene':
+            targets = self.proteins(eid)
+        else:
+            targets = self.genes(eid)
+
+        return [acc for target in targets
+                for ns, acc in self.refs(to_kind, target)
+                if ns == to_namespace]
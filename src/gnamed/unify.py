@@ -0,0 +1,386 @@
+"""
+.. py:module:: gnamed.unify
+   :synopsis: Build all gene and protein entities offline from parsed records.
+
+When loading repositories one by one, the entity of each record is resolved
+against the DB, record by record. Therefore, the load order matters, and
+records that link entities created by earlier loads raise a
+`gnamed.loader.DuplicateEntityError` that some parsers have to fix up.
+
+`Unify` instead reads the parsed records of all repositories (see
+`gnamed.parsed`) and computes the entities as the connected components of
+their shared references, using an array-based union-find per entity kind.
+References are only unified within the same species, and references to
+species-specific namespaces are only accepted for records of those species
+(see `gnamed.constants.SPECIES_SPACES`). The entities, references, strings,
+PubMed IDs and gene-protein mappings are then written into an empty DB in a
+single pass (using ``COPY`` on PostgreSQL), so a full rebuild is one
+linear-time job.
+
+As with loading, the parsed caches should be given in the suggested load
+order: the metadata (chromosome, location, length, mass) of an entity and
+the symbol and name of a reference are taken from the last record that has
+them.
+
+.. moduleauthor:: Florian Leitner <florian.leitner@gmail.com>
+.. License: GNU GPL v3 (http://www.gnu.org/licenses/gpl.html)
+"""
+import io
+import logging
+
+from array import array
+from sqlalchemy.sql.expression import select, text
+
+from gnamed.constants import SPECIES_SPACES
+from gnamed.loader import GeneRecord
+from gnamed.orm import Connection, CopyValue, Gene, Protein, GeneRef, \
+    ProteinRef, GeneString, ProteinString, Gene2PubMed, Protein2PubMed, \
+    mapping, IdAllocator, IndexManager, InsertIgnore, InternStrings, \
+    LoadLock, RefreshClosure
+from gnamed.parsed import RecordReader
+
+BATCH = 10000
+"""Number of rows to write at a time."""
+
+_KINDS = {
+    'gene': (Gene, GeneRef, GeneString, Gene2PubMed),
+    'protein': (Protein, ProteinRef, ProteinString, Protein2PubMed),
+}
+
+
+class _UnionFind:
+    """
+    An array-based union-find (disjoint-set forest) of the references of
+    one entity kind; each set is tagged with the species of the record
+    that created it.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.parent = array('l')
+        self.size = array('l')
+        self.species = array('l')
+
+    def add(self, key, species_id: int) -> int:
+        node = self.ids.get(key)
+
+        if node is None:
+            node = len(self.parent)
+            self.ids[key] = node
+            self.parent.append(node)
+            self.size.append(1)
+            self.species.append(species_id)
+
+        return node
+
+    def find(self, node: int) -> int:
+        parent = self.parent
+
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]  # path halving
+            node = parent[node]
+
+        return node
+
+    def union(self, a: int, b: int) -> bool:
+        """
+        Join the sets of nodes `a` and `b`; return ``False`` (and keep them
+        apart) if the sets belong to different species.
+        """
+        a, b = self.find(a), self.find(b)
+
+        if a == b:
+            return True
+        elif self.species[a] != self.species[b]:
+            return False
+
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+        return True
+
+
+class _Writer:
+    """
+    Writes batches of rows with ``COPY`` on PostgreSQL and with multi-row
+    ``INSERT`` statements elsewhere.
+
+    Rows of tables that may receive duplicates (strings and PubMed IDs)
+    are copied into temporary tables and only inserted (``DISTINCT``)
+    into their tables on `close`.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.copy = connection.dialect.name == 'postgresql'
+        self._staged = []
+
+    def write(self, table, rows: list, distinct: bool=False):
+        if not rows:
+            return
+        elif not self.copy:
+            if distinct:
+                InsertIgnore(self.connection, table, rows)
+            else:
+                self.connection.execute(table.insert(), rows)
+
+            return
+
+        name = table.name
+
+        if distinct:
+            name = 'unify_' + table.name
+
+            if table not in self._staged:
+                self.connection.execute(text(
+                    'CREATE TEMPORARY TABLE {} (LIKE {}) ON COMMIT DROP'
+                    .format(name, table.name)
+                ))
+                self._staged.append(table)
+
+        columns = [c.name for c in table.c]
+        data = io.StringIO(''.join(
+            '\t'.join(CopyValue(row[c]) for c in columns) + '\n'
+            for row in rows
+        ))
+        cursor = self.connection.connection.cursor()
+
+        try:
+            cursor.copy_from(data, name, columns=columns)
+        finally:
+            cursor.close()
+
+    def close(self):
+        for table in self._staged:
+            logging.info('inserting the distinct rows of %s', table.name)
+            self.connection.execute(text(
+                'INSERT INTO {0} SELECT DISTINCT * FROM unify_{0}'.format(
+                    table.name
+                )
+            ))
+
+        self._staged = []
+
+
+def _records(paths):
+    for path in paths:
+        logging.info('reading parsed records from %s', path)
+
+        with RecordReader(path) as reader:
+            for db_key, record in reader:
+                yield db_key, record
+
+
+def _kind(record) -> str:
+    return 'gene' if isinstance(record, GeneRecord) else 'protein'
+
+
+def Unify(*paths: str, bulk: bool=False, closure: bool=True):
+    """
+    Build all gene and protein entities from the parsed-record caches at
+    `paths` and write them into the DB, which must not contain any genes
+    or proteins yet.
+
+    :param paths: the parsed-record caches, in load order
+    :param bulk: drop the secondary indexes and foreign keys while writing
+                 (see `IndexManager`)
+    :param closure: rebuild the mapping closure afterwards
+    """
+    sets = {'gene': _UnionFind(), 'protein': _UnionFind()}
+    homes = {'gene': {}, 'protein': {}}  # node: (symbol, name)
+    metadata = {'gene': {}, 'protein': {}}  # node, attr: (seq, value)
+    seq = 0
+
+    # pass 1: unify the references of each kind
+    for db_key, record in _records(paths):
+        kind = _kind(record)
+        uf = sets[kind]
+        species_id = record.species_id
+        home = uf.add(db_key, species_id)
+        homes[kind][home] = (record.symbol, record.name)
+        seq += 1
+
+        for ref in record.refs:
+            if ref.namespace in SPECIES_SPACES and \
+                    species_id not in SPECIES_SPACES[ref.namespace]:
+                logging.debug('skipping %s:%s for %s:%s (species:%s)',
+                              ref.namespace, ref.accession, db_key.namespace,
+                              db_key.accession, species_id)
+            elif not uf.union(home, uf.add(ref, species_id)):
+                logging.info('not unifying %s:%s with %s:%s of another '
+                             'species than species:%s', ref.namespace,
+                             ref.accession, db_key.namespace,
+                             db_key.accession, species_id)
+
+        for attr in record._EXTRA:
+            value = getattr(record, attr)
+
+            if value:
+                metadata[kind][home, attr] = (seq, value)
+
+    logging.info('unified %s parsed records', seq)
+
+    # the DB must stay empty (of entities) until the entities are written
+    with LoadLock(__name__ + '.Unify'):
+        connection = Connection()
+
+        try:
+            for kind, (Entity, _, _, _) in _KINDS.items():
+                if connection.execute(
+                        select([Entity.__table__.c.id]).limit(1)
+                ).first() is not None:
+                    raise RuntimeError('the DB already contains {}s; unify needs '
+                                       'a DB without any entities'.format(kind))
+        finally:
+            connection.close()
+
+        indexes = IndexManager() if bulk else None
+
+        if indexes is not None:
+            indexes.drop()
+
+        connection = Connection()
+        transaction = connection.begin()
+
+        try:
+            writer = _Writer(connection)
+            entities = {
+                kind: _writeEntities(writer, kind, sets[kind], homes[kind],
+                                     metadata[kind])
+                for kind in _KINDS
+            }
+            del homes, metadata
+            _writeRecords(writer, paths, sets, entities)
+            writer.close()
+            transaction.commit()
+        except Exception:
+            transaction.rollback()
+            raise
+        finally:
+            connection.close()
+
+            if indexes is not None:
+                indexes.rebuild()
+
+        if closure:
+            RefreshClosure()
+
+
+def _writeEntities(writer: _Writer, kind: str, uf: _UnionFind, homes: dict,
+                   metadata: dict) -> dict:
+    # create one entity for each set that contains the primary reference of
+    # a record and write the entities and their references; returns the
+    # entity ID of each set (root node)
+    Entity, EntityRef = _KINDS[kind][:2]
+    ids = IdAllocator(Entity)
+    entities = {}
+    attrs = {}
+
+    for node in homes:
+        root = uf.find(node)
+
+        if root not in entities:
+            entities[root] = ids.next(writer.connection)
+
+    for (node, attr), (seq, value) in metadata.items():
+        key = (uf.find(node), attr)
+
+        if key not in attrs or attrs[key][0] < seq:
+            attrs[key] = (seq, value)
+
+    logging.info('writing %s %ss', len(entities), kind)
+    names = [c.name for c in Entity.__table__.c if c.name not in
+             ('id', 'species_id')]
+    rows = []
+
+    for root, eid in entities.items():
+        row = {'id': eid, 'species_id': uf.species[root]}
+
+        for name in names:
+            row[name] = attrs.get((root, name), (None, None))[1]
+
+        rows.append(row)
+
+        if len(rows) == BATCH:
+            writer.write(Entity.__table__, rows)
+            rows = []
+
+    writer.write(Entity.__table__, rows)
+    rows = []
+
+    for (ns, acc), node in uf.ids.items():
+        eid = entities.get(uf.find(node))
+
+        if eid is not None:
+            symbol, name = homes.get(node, (None, None))
+            rows.append({'namespace': ns, 'accession': acc, 'symbol': symbol,
+                         'name': name, 'id': eid})
+
+            if len(rows) == BATCH:
+                writer.write(EntityRef.__table__, rows)
+                rows = []
+
+    writer.write(EntityRef.__table__, rows)
+    return entities
+
+
+def _writeRecords(writer: _Writer, paths: tuple, sets: dict, entities: dict):
+    # pass 2: write the strings, PubMed IDs and mappings of all records
+    strings = {kind: [] for kind in _KINDS}
+    pmids = {kind: [] for kind in _KINDS}
+    pairs = set()
+
+    def writeStrings(kind):
+        table = _KINDS[kind][2].__table__
+        ids = InternStrings(writer.connection,
+                            (value for _, _, value in strings[kind]))
+        writer.write(table, [
+            {'id': eid, 'cat': cat, 'string_id': ids[value]}
+            for eid, cat, value in strings[kind]
+        ], distinct=True)
+        strings[kind] = []
+
+    for db_key, record in _records(paths):
+        kind = _kind(record)
+        uf = sets[kind]
+        eid = entities[kind][uf.find(uf.ids[db_key])]
+
+        for cat, values in record.strings.items():
+            for value in values:
+                strings[kind].append((eid, cat, value))
+
+        for pmid in record.pmids:
+            pmids[kind].append({'id': eid, 'pmid': pmid})
+
+        other = 'protein' if kind == 'gene' else 'gene'
+
+        for ref in record.mappings:
+            node = sets[other].ids.get(ref)
+
+            if node is not None:
+                other_id = entities[other].get(sets[other].find(node))
+
+                if other_id is not None:
+                    pairs.add((eid, other_id) if kind == 'gene' else
+                              (other_id, eid))
+
+        if len(strings[kind]) >= BATCH:
+            writeStrings(kind)
+
+        if len(pmids[kind]) >= BATCH:
+            writer.write(_KINDS[kind][3].__table__, pmids[kind],
+                         distinct=True)
+            pmids[kind] = []
+
+    for kind in _KINDS:
+        writeStrings(kind)
+        writer.write(_KINDS[kind][3].__table__, pmids[kind], distinct=True)
+
+    logging.info('writing %s gene-protein mappings', len(pairs))
+    pairs = list(pairs)
+
+    for i in range(0, len(pairs), BATCH):
+        writer.write(mapping, [{'gene_id': gid, 'protein_id': pid}
+                               for gid, pid in pairs[i:i + BATCH]])
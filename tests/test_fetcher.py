@@ -0,0 +1,241 @@
+"""
+Tests of the downloads of the fetcher against a local stand-in HTTP server
+(`http.server`) and a stand-in for `ftplib.FTP`.
+
+Run from the repository root with ``python -m unittest discover tests``
+(and ``src`` on the ``PYTHONPATH``).
+"""
+import ftplib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.error import HTTPError
+
+from gnamed import fetcher
+
+DATA = bytes(range(256)) * 400
+"""The content of the served files."""
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # serves the files of the server with ETags, Range and If-Range
+    # requests, and If-None-Match revalidation
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, dict(self.headers)))
+
+        if self.path in server.errors:
+            self.send_error(server.errors[self.path])
+            return
+
+        data, etag = server.files[self.path]
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        start = 0
+        ranged = self.headers.get('Range')
+
+        if ranged and self.headers.get('If-Range', etag) == etag:
+            start = int(ranged[len('bytes='):-1])
+
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Range',
+                                 'bytes */{}'.format(len(data)))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, len(data) - 1, len(data)
+            ))
+        else:
+            self.send_response(200)
+
+        body = data[start:]
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+
+        # drop the connection after some bytes, once
+        if server.interrupt is not None:
+            body = body[:server.interrupt]
+            server.interrupt = None
+
+        self.wfile.write(body)
+        self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+class _FTP:
+    # a stand-in for ftplib.FTP that serves the `files` and fails the
+    # first transfer after `interrupt` bytes (if set)
+
+    files = {}
+    interrupt = None
+    transfers = []
+
+    def __init__(self, timeout=None):
+        pass
+
+    def connect(self, host, port):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def voidcmd(self, command: str) -> str:
+        if command.startswith('MDTM '):
+            return '213 20120101000000'
+
+        return '200 OK'
+
+    def size(self, path: str) -> int:
+        return len(self.files[path])
+
+    def retrbinary(self, command, callback, blocksize=8192, rest=None):
+        path = command[len('RETR '):]
+        _FTP.transfers.append((path, rest))
+        data = self.files[path][rest or 0:]
+
+        if _FTP.interrupt is not None:
+            callback(data[:_FTP.interrupt])
+            _FTP.interrupt = None
+            raise ftplib.error_temp('426 Connection closed; transfer aborted')
+
+        callback(data)
+        return '226 Transfer complete'
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class HttpDownloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.files = {'/data.txt': (DATA, '"v1"')}
+        self.server.errors = {}
+        self.server.requests = []
+        self.server.interrupt = None
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  daemon=True)
+        thread.start()
+        self.url = 'http://127.0.0.1:{}/data.txt'.format(
+            self.server.server_address[1]
+        )
+        self.target = os.path.join(self.directory, 'data.txt')
+        self.backoff = mock.patch.object(fetcher, 'BACKOFF', 0)
+        self.backoff.start()
+
+    def tearDown(self):
+        self.backoff.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def content(self) -> bytes:
+        with open(self.target, 'rb') as stream:
+            return stream.read()
+
+    def testResumeInterruptedDownload(self):
+        self.server.interrupt = 1000
+        self.assertTrue(fetcher.Download(self.url, self.target))
+        self.assertEqual(DATA, self.content())
+        self.assertEqual(2, len(self.server.requests))
+        self.assertEqual('bytes=1000-',
+                         self.server.requests[1][1].get('Range'))
+        self.assertFalse(os.path.exists(self.target + fetcher.PARTIAL))
+
+    def testSkipUnchangedFile(self):
+        self.assertTrue(fetcher.Download(self.url, self.target))
+        self.assertFalse(fetcher.Download(self.url, self.target))
+        self.assertEqual('"v1"',
+                         self.server.requests[1][1].get('If-None-Match'))
+        self.assertEqual(DATA, self.content())
+
+    def testRestartStalePartial(self):
+        # the partial download is longer than the file on the server
+        partial = self.target + fetcher.PARTIAL
+
+        with open(partial, 'wb') as stream:
+            stream.write(DATA + DATA[:100])
+
+        fetcher.Manifest(self.directory).update(
+            'data.txt', url=self.url, complete=False, etag='"v1"',
+            modified=None, size=2 * len(DATA)
+        )
+        self.assertTrue(fetcher.Download(self.url, self.target))
+        self.assertEqual(DATA, self.content())
+        self.assertEqual(2, len(self.server.requests))
+        self.assertEqual('bytes={}-'.format(len(DATA) + 100),
+                         self.server.requests[0][1].get('Range'))
+        self.assertNotIn('Range', self.server.requests[1][1])
+
+    def testDoNotRetryRangeErrorWithoutOffset(self):
+        self.server.errors['/data.txt'] = 416
+
+        with self.assertRaises(HTTPError) as error:
+            fetcher.Download(self.url, self.target)
+
+        self.assertEqual(416, error.exception.code)
+        self.assertEqual(1, len(self.server.requests))
+
+
+class FtpDownloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.url = 'ftp://127.0.0.1/pub/data.txt'
+        self.target = os.path.join(self.directory, 'data.txt')
+        _FTP.files = {'/pub/data.txt': DATA}
+        _FTP.interrupt = None
+        _FTP.transfers = []
+        self.patches = [mock.patch.object(fetcher, 'BACKOFF', 0),
+                        mock.patch.object(fetcher.ftplib, 'FTP', _FTP)]
+
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+
+        shutil.rmtree(self.directory)
+
+    def content(self) -> bytes:
+        with open(self.target, 'rb') as stream:
+            return stream.read()
+
+    def testResumeInterruptedDownload(self):
+        _FTP.interrupt = 1000
+        self.assertTrue(fetcher.Download(self.url, self.target))
+        self.assertEqual(DATA, self.content())
+        self.assertEqual([('/pub/data.txt', None), ('/pub/data.txt', 1000)],
+                         _FTP.transfers)
+
+    def testSkipUnchangedFile(self):
+        self.assertTrue(fetcher.Download(self.url, self.target))
+        self.assertFalse(fetcher.Download(self.url, self.target))
+        self.assertEqual(1, len(_FTP.transfers))
+
+
+if __name__ == '__main__':
+    unittest.main()
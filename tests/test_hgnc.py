@@ -0,0 +1,74 @@
+"""
+Tests of the HGNC parser.
+
+Run from the repository root with ``python -m unittest discover tests``
+(and ``src`` on the ``PYTHONPATH``).
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from gnamed.constants import Namespace
+from gnamed.orm import Gene, GeneRef, InitDb, Session, Species
+from gnamed.parsed import Checksum, RecordWriter
+from gnamed.parsers import hgnc
+
+HEADER = (
+    'HGNC ID\tApproved Symbol\tApproved Name\tPrevious Symbols\t'
+    'Previous Names\tSynonyms\tName Synonyms\tChromosome\tPubmed IDs\t'
+    'Gene Family Tag\tGene family description\tEntrez Gene ID\t'
+    'Ensembl Gene ID\tMouse Genome Database ID\tUniProt ID\t'
+    'Rat Genome Database ID\n'
+)
+LINE = '5\tA1BG\talpha-1-B glycoprotein\t\t\t\t\t19q13.4\t\t\t\t1\t\t\t\t\n'
+
+
+class WrongEntrezLinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        InitDb('sqlite:///' + os.path.join(self.directory, 'test.db'))
+        session = Session()
+        species = Species(9606, None, 'species')
+        species.unique_name = 'Homo sapiens'
+        session.add(species)
+        session.flush()
+        genes = [Gene(9606), Gene(9606)]
+        session.add_all(genes)
+        session.flush()
+        session.add(GeneRef(Namespace.hgnc, '31739', id=genes[0].id))
+        session.add(GeneRef(Namespace.entrez, '648809', id=genes[1].id))
+        session.commit()
+        self.path = os.path.join(self.directory, 'hgnc.csv')
+
+        with open(self.path, 'w') as stream:
+            stream.write(HEADER)
+            stream.write(LINE)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def linkedGenes(self) -> set:
+        return set(i for i, in Session().query(GeneRef.id).filter(
+            GeneRef.accession.in_(('31739', '648809'))
+        ))
+
+    def testParsingIntoCacheDoesNotWrite(self):
+        parser = hgnc.Parser(self.path)
+        parser.closure = False
+        checksum = Checksum(self.path)
+
+        with RecordWriter(os.path.join(self.directory, 'hgnc.cache'),
+                          checksum) as parser.cache:
+            self.assertTrue(parser.parse())
+
+        self.assertEqual(2, len(self.linkedGenes()))
+
+    def testLoadingCorrectsLink(self):
+        self.assertTrue(hgnc.Parser(self.path).parse())
+        self.assertEqual(1, len(self.linkedGenes()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+Tests of the tolerant mode of the parsers (``gnamed load --tolerant``).
+
+Run from the repository root with ``python -m unittest discover tests``
+(and ``src`` on the ``PYTHONPATH``).
+"""
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from gnamed.orm import Gene, GeneRef, InitDb, Session, Species
+from gnamed.parsers import entrez
+
+GENE_INFO = (
+    '9606\t{0}\tSYM{0}\t-\t-\t-\t1\t1p1\tgene {0}\tprotein-coding\t'
+    'SYM{0}\tgene {0}\tO\t-\t20120101\n'
+)
+
+
+class _BrokenPubMedIds:
+    # fails while the fast loader builds the rows of a record
+
+    def __iter__(self):
+        raise ValueError('broken PubMed IDs')
+
+
+class _BrokenSpeedLoader(entrez.SpeedLoader):
+
+    def _loadRecord(self, db_key, record):
+        if db_key.accession == '3':
+            record._pmids = _BrokenPubMedIds()
+
+        super(_BrokenSpeedLoader, self)._loadRecord(db_key, record)
+
+
+class TolerantTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        InitDb('sqlite:///' + os.path.join(self.directory, 'test.db'))
+        session = Session()
+        species = Species(9606, None, 'species')
+        species.unique_name = 'Homo sapiens'
+        session.add(species)
+        session.commit()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name: str, lines: list) -> str:
+        path = os.path.join(self.directory, name)
+
+        with open(path, 'w') as stream:
+            stream.writelines(lines)
+
+        return path
+
+    def testRejectOnlyTheBadLine(self):
+        good = ['9606\t{}\t{}\n'.format(i % 5 + 1, 100 + i) for i in range(60)]
+        bad = '9606\t3\n'
+        gene2pubmed = self.write('gene2pubmed', ['#header\n'] + good[:50] +
+                                 [bad] + good[50:])
+        gene_info = self.write('gene_info', ['#header\n'] + [
+            GENE_INFO.format(i) for i in range(1, 6)
+        ])
+        parser = entrez.Parser(gene2pubmed, gene_info)
+        parser.tolerant = True
+        parser.rejects = io.StringIO()
+        self.assertTrue(parser.parse())
+        self.assertEqual(1, parser.rejected)
+        lines = parser.rejects.getvalue().splitlines()
+        self.assertEqual(2, len(lines))
+        self.assertTrue(lines[0].startswith('# ValueError'))
+        self.assertEqual(bad.strip(), lines[1])
+        self.assertEqual(5, Session().query(Gene).count())
+
+    def testFastLoaderRejectsWholeRecords(self):
+        gene2pubmed = self.write('gene2pubmed', ['#header\n'] + [
+            '9606\t{}\t{}\n'.format(i, 100 + i) for i in range(1, 6)
+        ])
+        gene_info = self.write('gene_info', ['#header\n'] + [
+            GENE_INFO.format(i) for i in range(1, 6)
+        ])
+        parser = _BrokenSpeedLoader(gene2pubmed, gene_info)
+        parser.tolerant = True
+        self.assertTrue(parser.parse())
+        self.assertEqual(1, parser.rejected)
+        session = Session()
+        self.assertEqual(4, session.query(Gene).count())
+        self.assertEqual(0, session.query(GeneRef).filter(
+            GeneRef.accession == '3'
+        ).count())
+
+
+if __name__ == '__main__':
+    unittest.main()